@@ -19,15 +19,16 @@ from __future__ import annotations
 import json
 import mimetypes
 import os
-import random
 import re
 import shutil
 import threading
 import time
+import uuid
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+import click
 from dotenv import load_dotenv
 from flask import (
     Flask,
@@ -42,15 +43,33 @@ from flask import (
     send_file,
     send_from_directory,
     session,
+    stream_with_context,
     url_for,
 )
-from flask_session import Session
+from sessions import Session
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash  # kept for compatibility (may be used in users.py)
 from werkzeug.utils import secure_filename
 
-from parser import parse_document
-from users import create_user, verify_login
+from parser import (
+    PAGE_CACHE,
+    DiskPageCache,
+    UPLOAD_INDEX,
+    chapter_toc,
+    iter_document,
+    iter_html_document,
+    iter_zip_document,
+    parse_page,
+    read_indexed_page,
+    read_page_toc,
+    write_page_index,
+)
+from blobs import BlobStore
+from catalog import SavesCatalog
+from drafts import DraftStore, draft_key
+from images import ImageStore
+from retention import TrashRetention
+from users import HashBusy, LoginThrottle, create_user, user_names, verify_login
 
 
 # =========================
@@ -59,28 +78,41 @@ from users import create_user, verify_login
 load_dotenv()
 
 BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.getenv("DATA_DIR") or BASE_DIR  # uploads, saves, trash, users.json, ... (code and assets stay in BASE_DIR)
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
-UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
-SAVES_DIR = os.path.join(BASE_DIR, "saves")
-SESSION_DIR = os.path.join(BASE_DIR, "flask_session")
-DB_PATH = os.path.join(UPLOAD_DIR, "uploads.json")
-SAVES_META_PATH = os.path.join(SAVES_DIR, "saves_meta.json")
-USERS_DB_PATH = os.path.join(BASE_DIR, "users.json")
-TRASH_DIR = os.path.join(BASE_DIR, "trash")
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+SAVES_DIR = os.path.join(DATA_DIR, "saves")
+SESSION_DIR = os.path.join(DATA_DIR, "flask_session")
+DRAFTS_DIR = os.path.join(DATA_DIR, "drafts")
+DB_PATH = os.path.join(UPLOAD_DIR, "uploads.json")  # legacy; imported into IMAGES_DB_PATH on first start
+IMAGES_DB_PATH = os.path.join(UPLOAD_DIR, "images.db")
+SAVES_META_PATH = os.path.join(SAVES_DIR, "saves_meta.json")  # legacy; imported into SAVES_CATALOG_PATH on first start
+SAVES_CATALOG_PATH = os.path.join(SAVES_DIR, ".catalog", "saves.db")
+PAGE_INDEX_DIR = os.path.join(SAVES_DIR, ".pageindex")
+PAGE_STORE_DIR = os.path.join(SAVES_DIR, ".pagecache")
+UPLOAD_BLOBS_DIR = os.path.join(UPLOAD_DIR, ".blobs")
+SAVE_BLOBS_DIR = os.path.join(SAVES_DIR, ".blobs")
+USERS_DB_PATH = os.path.join(DATA_DIR, "users.json")
+TRASH_DIR = os.path.join(DATA_DIR, "trash")
 TRASH_UPLOADS_DIR = os.path.join(TRASH_DIR, "uploads")
 TRASH_SAVES_DIR = os.path.join(TRASH_DIR, "saves")
-LOGS_DIR = os.path.join(BASE_DIR, "logs")
+TRASH_META_DIR = os.path.join(TRASH_DIR, "meta")
+LOGS_DIR = os.path.join(DATA_DIR, "logs")
 TRASH_LOGS_DIR = os.path.join(TRASH_DIR, "logs")
 
 for d in (
     UPLOAD_DIR,
     SAVES_DIR,
+    PAGE_INDEX_DIR,
+    PAGE_STORE_DIR,
     SESSION_DIR,
+    DRAFTS_DIR,
     LOGS_DIR,
     TRASH_UPLOADS_DIR,
     TRASH_SAVES_DIR,
+    TRASH_META_DIR,
     TRASH_LOGS_DIR,
 ):
     os.makedirs(d, exist_ok=True)
@@ -117,7 +149,8 @@ app = Flask(
     static_folder=STATIC_DIR,
     template_folder=TEMPLATES_DIR,
 )
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# one reverse proxy in front: remote_addr is the address it saw, not whatever the client put in X-Forwarded-For
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 # One place to set config
 app.config.update(
@@ -125,9 +158,16 @@ app.config.update(
     UPLOAD_FOLDER=UPLOAD_DIR,
     BUILD_VER=CACHE_VERSION,  # cache buster
 
-    # Flask-Session
-    SESSION_TYPE="filesystem",
+    # Operators who may open the /_ stats views (comma-separated user ids; empty = nobody)
+    ADMIN_USER_IDS=frozenset(u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()),
+
+    # Export rendering: >1 renders long documents in a process pool (0/1 = serial)
+    RENDER_WORKERS=int(os.getenv("RENDER_WORKERS", "0") or 0),
+
+    # Flask-Session ("sqlite" is provided by sessions.Session; "filesystem" still works)
+    SESSION_TYPE=os.getenv("SESSION_TYPE", "sqlite"),
     SESSION_FILE_DIR=SESSION_DIR,
+    SESSION_SQLITE_PATH=os.path.join(SESSION_DIR, "sessions.db"),
     SESSION_PERMANENT=False,
     SESSION_USE_SIGNER=True,
 
@@ -149,6 +189,11 @@ app.config.update(
     # Logs  ← ここで統一
     AUTH_LOG_PATH=os.path.join(TRASH_LOGS_DIR, "auth_log.jsonl"),
     TRASH_LOG_PATH=os.path.join(TRASH_LOGS_DIR, "trash_log.jsonl"),
+
+    # Trash retention: purge trashed images/saves after this many days. Off (0) unless the operator
+    # sets it; dry run only counts what would be removed (see /_trash_retention, `flask purge-trash`)
+    TRASH_RETENTION_DAYS=float(os.getenv("TRASH_RETENTION_DAYS", "0") or 0),
+    TRASH_RETENTION_DRY_RUN=os.getenv("TRASH_RETENTION_DRY_RUN", "").lower() in ("1", "true", "yes"),
 )
 
 Session(app)
@@ -191,9 +236,7 @@ def allowed_file(filename: str) -> bool:
 
 
 def _client_ip() -> str:
-    xff = request.headers.get("X-Forwarded-For", "")
-    if xff:
-        return xff.split(",")[0].strip()
+    # ProxyFix has already taken the proxy's entry of X-Forwarded-For; the header itself is client-controlled
     return request.remote_addr or ""
 
 
@@ -234,52 +277,42 @@ def _write_trash_log(event: dict) -> None:
 
 
 # =========================
-# DB Helpers (uploads.json)
+# Image records (SQLite)
 # =========================
-def _load_db() -> Dict[str, Any]:
-    if not os.path.exists(DB_PATH):
-        return {}
-    try:
-        with open(DB_PATH, "r", encoding="utf-8") as f:
-            raw = f.read().strip()
-            return json.loads(raw) if raw else {}
-    except Exception:
-        return {}
+# Indexed on owner / visibility / deleted_at / ts; records keep the uploads.json fields.
+# The parser resolves [uploadedimage:ID] through the same store (only the IDs it needs).
+# New IDs are random and sparse (unlisted images are served by ID, so IDs must not be enumerable);
+# ImageStore.insert checks and inserts in one transaction, so workers never collide.
+IMAGES = ImageStore(IMAGES_DB_PATH, json_path=DB_PATH)
+UPLOAD_INDEX.use_store(IMAGES)
 
+# File bytes live once per content (SHA-256) under .blobs; uploads/<stored_name> and saves/<name>
+# are hard links to them, so imports add a link instead of copying and identical uploads share storage.
+# Linked files are only ever replaced (temp file + rename), never rewritten in place. A blob whose last
+# name is replaced is removed right away; anything else left unreferenced is swept hourly in the background.
+UPLOAD_BLOBS = BlobStore(UPLOAD_BLOBS_DIR)
+SAVE_BLOBS = BlobStore(SAVE_BLOBS_DIR)
 
-def _save_db(db: Dict[str, Any]) -> None:
-    tmp = DB_PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(db, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, DB_PATH)
 
-
-def _gen_id(db: Dict[str, Any]) -> str:
-    while True:
-        nid = f"{random.randint(100000, 999999)}"
-        if nid not in db:
-            return nid
+@app.before_request
+def start_blob_gc():
+    UPLOAD_BLOBS.ensure_started()
+    SAVE_BLOBS.ensure_started()
 
 
 # =========================
-# Saves meta (saves_meta.json)
+# Saves catalog (SQLite)
 # =========================
-def _load_saves_meta() -> Dict[str, Any]:
-    if not os.path.exists(SAVES_META_PATH):
-        return {}
-    try:
-        with open(SAVES_META_PATH, "r", encoding="utf-8") as f:
-            raw = f.read().strip()
-            return json.loads(raw) if raw else {}
-    except Exception:
-        return {}
+# One row per saved file: the saves_meta.json fields plus size / mtime, indexed for the listings.
+# Routes that write a save call SAVES.put(); files added, removed or edited outside the app are
+# picked up by a background reconcile pass when the directory changes (and once a minute across
+# all workers for in-place edits), or on demand with `flask reconcile-saves`. Listings never scan.
+SAVES = SavesCatalog(SAVES_CATALOG_PATH, SAVES_DIR, meta_path=SAVES_META_PATH)
 
 
-def _save_saves_meta(meta: Dict[str, Any]) -> None:
-    tmp = SAVES_META_PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, SAVES_META_PATH)
+@app.before_request
+def start_saves_reconcile():
+    SAVES.ensure_started()
 
 
 # =========================
@@ -329,6 +362,7 @@ def require_login():
         "gallery_public",
         "saves_public",
         "saves_public_view",
+        "api_toc",
         "explore",
         "saves_public_raw",
     ):
@@ -350,6 +384,36 @@ def no_cache_static(resp: Response):
         resp.headers["Expires"] = "0"
     return resp
 
+# Rendered pages of public saves, shared by every worker through the disk.
+PUBLIC_PAGE_CACHE = DiskPageCache(PAGE_STORE_DIR)
+
+
+def _page_index_path(fname: str) -> str:
+    return os.path.join(PAGE_INDEX_DIR, os.path.basename(fname) + ".json")
+
+
+def _refresh_page_index(fname: str) -> Optional[dict]:
+    """Rebuild the page-offset sidecar of a saved file (best effort; readers fall back to a full parse)."""
+    try:
+        return write_page_index(os.path.join(SAVES_DIR, fname), _page_index_path(fname))
+    except Exception:
+        return None
+
+
+def _save_toc(fname: str) -> Dict[str, Any]:
+    """Chapter list of a saved file from its sidecar, rebuilding the sidecar when it is stale."""
+    path = os.path.join(SAVES_DIR, fname)
+    toc = read_page_toc(path, _page_index_path(fname))
+    if toc is None:
+        idx = _refresh_page_index(fname)
+        if idx is not None:
+            toc = {"total": idx["total"], "chapters": idx["chapters"]}
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                toc = chapter_toc(f.read())
+    return toc
+
+
 def _move_save_to_trash(fname: str, meta_rec: dict) -> dict:
     src = os.path.join(SAVES_DIR, fname)
     stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
@@ -358,15 +422,54 @@ def _move_save_to_trash(fname: str, meta_rec: dict) -> dict:
 
     if os.path.exists(src):
         shutil.move(src, dst)
+    try:
+        os.remove(_page_index_path(fname))
+    except OSError:
+        pass
+    PUBLIC_PAGE_CACHE.invalidate(fname)
 
     meta_rec["deleted_at"] = int(time.time())
     meta_rec["trash_path"] = dst_name
     return meta_rec
 
 
+# When TRASH_RETENTION_DAYS is set, trashed items older than that are removed for good by a
+# background worker (one per process, coordinated so only one pass runs per hour across workers):
+# files and records go in batches, then the stores are compacted, unreferenced blobs swept and
+# trash_log.jsonl rotated. Trash files from before images.db / the saves catalog are never touched.
+RETENTION = TrashRetention(
+    IMAGES,
+    SAVES,
+    TRASH_UPLOADS_DIR,
+    TRASH_SAVES_DIR,
+    mark_path=os.path.join(TRASH_META_DIR, ".last_retention"),
+    blob_stores=(UPLOAD_BLOBS, SAVE_BLOBS),
+    log_path=app.config["TRASH_LOG_PATH"],
+    max_age=app.config["TRASH_RETENTION_DAYS"] * 24 * 3600,
+    dry_run=app.config["TRASH_RETENTION_DRY_RUN"],
+)
+
+
+@app.before_request
+def start_trash_retention():
+    RETENTION.ensure_started()
+
+
 # =========================
 # Auth Routes
 # =========================
+# Failed logins back off per IP and per username; throttled or overflow attempts are
+# answered before any password hash is computed (hashing runs on users.HASH_POOL).
+LOGIN_THROTTLE = LoginThrottle()
+
+
+def _auth_busy(template: str, message: str, status: int, retry_after: float, **ctx):
+    flash(message)
+    resp = Response(render_template(template, **ctx), status=status)
+    resp.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+    return resp
+
+
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
     if request.method == "POST":
@@ -375,6 +478,8 @@ def signup():
 
         try:
             uid = create_user(username, password)
+        except HashBusy:
+            return _auth_busy("signup.html", "混み合っています。少し待ってからもう一度お試しください", 503, 1)
         except ValueError as e:
             msg = "登録に失敗しました"
             if str(e) == "username exists":
@@ -400,13 +505,27 @@ def login():
         username = request.form.get("username", "")
         password = request.form.get("password", "")
         next_url = request.form.get("next") or url_for("index")
+        keys = (("ip", _client_ip()), ("user", username.strip()))
+
+        wait = LOGIN_THROTTLE.retry_after(*keys)
+        if wait:
+            _write_auth_log({"event": "login_throttled", "username": username})
+            return _auth_busy(
+                "login.html", f"ログインの試行が多すぎます。{int(wait + 0.999)} 秒後にもう一度お試しください",
+                429, wait, next=next_url,
+            )
 
-        uid = verify_login(username, password)
+        try:
+            uid = verify_login(username, password)
+        except HashBusy:
+            return _auth_busy("login.html", "混み合っています。少し待ってからもう一度お試しください", 503, 1, next=next_url)
         if not uid:
+            LOGIN_THROTTLE.failed(*keys)
             flash("ユーザー名またはパスワードが違います")
             _write_auth_log({"event": "login_failed", "username": username})
             return redirect(url_for("login", next=next_url))
 
+        LOGIN_THROTTLE.succeeded(keys[1])   # IP 側は残す（自分のアカウントで数え直させない）
         session.clear()
         session["user_id"] = uid
         _write_auth_log({"event": "login_ok", "user_id": uid, "username": username})
@@ -428,6 +547,26 @@ def _whoami():
     return {"user_id": session.get("user_id"), "endpoint": request.endpoint}
 
 
+def _require_admin():
+    """Stats views are for operators only; everyone else gets a 404, as if the route did not exist."""
+    if session.get("user_id") not in app.config["ADMIN_USER_IDS"]:
+        abort(404)
+
+
+@app.route("/_trash_retention")
+def _trash_retention():
+    """Settings, totals and the last pass of the trash retention worker."""
+    _require_admin()
+    return RETENTION.stats()
+
+
+@app.route("/_page_cache")
+def _page_cache():
+    """Hit/miss counters of the in-process page cache and the shared disk cache of public saves."""
+    _require_admin()
+    return {**PAGE_CACHE.stats(), "disk": PUBLIC_PAGE_CACHE.stats()}
+
+
 # =========================
 # Static Upload Serving
 # =========================
@@ -441,22 +580,14 @@ def uploaded(filename):
 # =========================
 @app.route("/gallery")
 def gallery():
-    db = _load_db()
     uid = session.get("user_id")
     q = (request.args.get("q") or "").strip().lower()
 
     items = []
-    for k, v in db.items():
-        v = dict(v)
+    # owner's images, trashed/deleted hidden, newest first
+    for k, v in IMAGES.by_owner(uid):
         v.setdefault("visibility", "private")
 
-        # Hide trashed/deleted by default
-        if v.get("deleted_at"):
-            continue
-
-        if v.get("owner") != uid:
-            continue
-
         if q:
             hay = " ".join([
                 str(k or ""),
@@ -475,18 +606,11 @@ def gallery():
 
 @app.route("/gallery/public")
 def gallery_public():
-    db = _load_db()
     q = (request.args.get("q") or "").strip().lower()
 
     items = []
-    for k, v in db.items():
-        v = dict(v)
-        v.setdefault("visibility", "private")
-        if v.get("deleted_at"):
-            continue
-        if v.get("visibility") != "public":
-            continue
-
+    # public, not trashed, newest first
+    for k, v in IMAGES.public():
         if q:
             hay = " ".join([
                 str(k or ""),
@@ -512,50 +636,29 @@ def explore():
     if t not in ("saves", "images"):
         t = "saves"
 
-    # ★ ここで users.json をロード
-    try:
-        with open(USERS_DB_PATH, "r", encoding="utf-8") as f:
-            users_db = json.load(f).get("users", {})
-    except Exception:
-        users_db = {}
+    # ★ owner_id → username（メモリ上の索引。users.json が変わったときだけ作り直す）
+    owner_names = user_names()
 
     if t == "saves":
-        meta = _load_saves_meta()
         files = []
 
-        for name in os.listdir(SAVES_DIR):
-            if not name.lower().endswith(".txt"):
-                continue
-
-            m = meta.get(name, {})
-            if m.get("deleted_at"):
-                continue
-
-            if m.get("visibility") != "public":
-                continue
-
+        # public, not trashed, newest first
+        for name, size, mtime, m in SAVES.public():
             if q and q not in name.lower():
                 continue
 
-            p = os.path.join(SAVES_DIR, name)
-            if not os.path.isfile(p):
-                continue
-
-            st = os.stat(p)
-
             # ★ ここが本命：owner_id → username
             owner_id = m.get("owner", "")
-            owner_name = users_db.get(owner_id, {}).get("username", owner_id)
+            owner_name = owner_names.get(owner_id) or owner_id
 
             files.append({
                 "name": name,
-                "mtime": st.st_mtime,
-                "mtime_str": datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M"),
-                "size_kb": round(st.st_size / 1024, 1),
+                "mtime": mtime,
+                "mtime_str": datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M"),
+                "size_kb": round(size / 1024, 1),
                 "owner": owner_name,   # ← username が入る
             })
 
-        files.sort(key=lambda x: -x["mtime"])
         return render_template(
             "explore_saves.html",
             q=request.args.get("q", ""),
@@ -564,22 +667,15 @@ def explore():
         )
 
 
-    # images
-    db = _load_db()
+    # images (public, not trashed, newest first)
     items = []
-    for img_id, rec in db.items():
-        rec = dict(rec)
-        rec.setdefault("visibility", "private")
-        if rec.get("deleted_at"):
-            continue
-        if rec.get("visibility") != "public":
-            continue
+    for img_id, rec in IMAGES.public():
         title = (rec.get("title") or rec.get("original_name") or rec.get("stored_name") or "")
         hay = f"{img_id} {title}".lower()
         if q and q not in hay:
             continue
         owner_id = rec.get("owner", "")
-        owner_name = users_db.get(owner_id, {}).get("username", owner_id)
+        owner_name = owner_names.get(owner_id) or owner_id
         items.append({"id": img_id, "owner_name": owner_name, **rec})
     items.sort(key=lambda x: x.get("ts", 0), reverse=True)
     return render_template("explore_gallery.html", q=request.args.get("q", ""), items=items, type=t)
@@ -588,8 +684,7 @@ def explore():
 # IDで解決する画像URL: /image/123456
 @app.route("/image/<img_id>")
 def image_by_id(img_id):
-    db = _load_db()
-    rec = db.get(img_id)
+    rec = IMAGES.get(img_id)
     if not rec:
         abort(404)
 
@@ -620,8 +715,7 @@ def images_import():
         return redirect(url_for("login", next=request.full_path))
 
     src_id = (request.form.get("img_id") or "").strip()
-    db = _load_db()
-    src = db.get(src_id)
+    src = IMAGES.get(src_id)
     if not src:
         abort(404)
     if src.get("deleted_at"):
@@ -633,18 +727,12 @@ def images_import():
     if not os.path.exists(src_path):
         abort(404)
 
-    # コピー先ファイル名（衝突回避）
-    root, ext = os.path.splitext(src["stored_name"])
-    cand = f"{root}_import{ext}"
-    i = 1
-    while os.path.exists(os.path.join(app.config["UPLOAD_FOLDER"], cand)):
-        cand = f"{root}_import{i}{ext}"
-        i += 1
-
-    shutil.copy2(src_path, os.path.join(app.config["UPLOAD_FOLDER"], cand))
+    # 取り込み先は同じ中身へのリンク（バイトは写さない）
+    ext = os.path.splitext(src["stored_name"])[1]
+    cand = f"import-{uuid.uuid4().hex}{ext}"
+    UPLOAD_BLOBS.link(src_path, os.path.join(app.config["UPLOAD_FOLDER"], cand))
 
-    new_id = _gen_id(db)
-    db[new_id] = {
+    new_id = IMAGES.insert({
         "stored_name": cand,
         "original_name": src.get("original_name") or cand,
         "original_name_safe": src.get("original_name_safe") or cand,
@@ -654,8 +742,7 @@ def images_import():
         "visibility": "private",
         "imported_from": src_id,
         "imported_from_owner": src.get("owner", ""),
-    }
-    _save_db(db)
+    })
 
     flash(f"ギャラリーに追加しました: ID {new_id}")
     return redirect(url_for("gallery"))
@@ -679,10 +766,8 @@ def index():
             default_text = ""
 
     # Gallery list (owner only, newest first, skip trashed)
-    db = _load_db()
     uid = session.get("user_id")
-    gallery_items = [{"id": k, **v} for k, v in db.items() if v.get("owner") == uid and not v.get("deleted_at")]
-    gallery_items.sort(key=lambda x: x.get("ts", 0), reverse=True)
+    gallery_items = [{"id": k, **v} for k, v in IMAGES.by_owner(uid)]
 
     refresh = request.args.get("cloud_refresh") == "1"
     cloud_manifest = load_cloud_manifest(force_refresh=refresh)
@@ -724,9 +809,6 @@ def upload():
 
     ext = orig_name.rsplit(".", 1)[1].lower()
 
-    db = _load_db()
-    nid = _gen_id(db)
-
     safe_name = secure_filename(orig_name)
     root, current_ext = os.path.splitext(safe_name)
 
@@ -737,16 +819,12 @@ def upload():
         current_ext = f".{ext}"
 
     root = root or "image"
-    candidate = f"{root}{current_ext}"
-    counter = 1
-    while os.path.exists(os.path.join(app.config["UPLOAD_FOLDER"], candidate)):
-        candidate = f"{root}-{counter}{current_ext}"
-        counter += 1
-
-    stored_name = candidate
+    stored_name = f"{root}-{uuid.uuid4().hex}{current_ext}"  # unique without probing the directory
     path = os.path.join(app.config["UPLOAD_FOLDER"], stored_name)
 
-    file.save(path)
+    tmp = UPLOAD_BLOBS.tmp_path()
+    file.save(tmp)
+    UPLOAD_BLOBS.put(tmp, path)
 
     mime_type = mimetypes.guess_type(stored_name)[0] or "application/octet-stream"
     gcs_upload_file(
@@ -756,7 +834,7 @@ def upload():
         content_type=mime_type,
     )
 
-    db[nid] = {
+    nid = IMAGES.insert({
         "stored_name": stored_name,
         "original_name": orig_name,
         "original_name_safe": secure_filename(orig_name),
@@ -764,25 +842,139 @@ def upload():
         "owner": session.get("user_id"),
         "visibility": "private",
         "title": request.form.get("title") or None,
-    }
-    _save_db(db)
+    })
 
     flash(f"アップロード完了: ID {nid}")
     return redirect(url_for("gallery"))
 
 
 
+# =========================
+# Drafts
+# =========================
+# Manuscripts live in a content-addressed store; the session only keeps the hash ("draft_id"),
+# which is also the revision id of the preview patch protocol.
+# Drafts expire together with the sessions that can still reference them; a draft replaced by a newer
+# one is kept only for a short grace. Expired drafts are swept by a background thread.
+DRAFTS = DraftStore(DRAFTS_DIR, ttl=app.permanent_session_lifetime.total_seconds())
+
+
+@app.before_request
+def start_draft_gc():
+    DRAFTS.ensure_started()
+
+
+def _draft_text() -> str:
+    """The session's draft manuscript ("" when there is none or it has expired)."""
+    legacy = session.pop("last_text", None)
+    if legacy is not None:
+        # sessions written before the draft store held the text itself
+        _set_draft_text(legacy)
+        return legacy
+    return DRAFTS.get(session.get("draft_id")) or ""
+
+
+def _set_draft_text(text: str) -> str:
+    """Store text as the session's draft and return its id (the session is only touched when it changes)."""
+    key = DRAFTS.put(text)
+    old = session.get("draft_id")
+    if old != key:
+        session["draft_id"] = key
+        DRAFTS.release(old)   # superseded: collected after a short grace unless another session reads it
+    return key
+
+
 # =========================
 # Preview / Reading
 # =========================
+RE_ASTRAL = re.compile("[\U00010000-\U0010ffff]")
+
+
+def _js_offset(text: str, units: int) -> int:
+    # JS の文字位置（UTF-16 単位）→ Python の文字位置。BMP 外の文字は JS では 2 単位
+    pos = units
+    for m in RE_ASTRAL.finditer(text):
+        if m.start() >= pos:
+            break
+        pos -= 1
+    return pos
+
+
+def _apply_text_patch(text: str, ops) -> Optional[tuple]:
+    """Apply [{offset, delete, insert}, ...] in order; (new_text, last_offset) or None when invalid."""
+    if not isinstance(ops, list):
+        return None
+    touched = 0
+    for op in ops:
+        if not isinstance(op, dict):
+            return None
+        offset, delete, insert = op.get("offset"), op.get("delete", 0), op.get("insert", "")
+        if type(offset) is not int or type(delete) is not int or not isinstance(insert, str):
+            return None
+        if offset < 0 or delete < 0:
+            return None
+        start = _js_offset(text, offset)
+        end = _js_offset(text, offset + delete)
+        if end > len(text):
+            return None
+        text = text[:start] + insert + text[end:]
+        touched = start
+    return text, touched
+
+
+def _preview_page_payload(text: str, p: int, writing_mode: str) -> Dict[str, Any]:
+    """JSON body of the preview APIs for page p of text (raises on render failure)."""
+    page = parse_page(text, p)
+
+    p = page["index"]
+    total = page["total"]
+
+    raw_text = page.get("text", "")
+    m = re.match(r"\[chapter:(.+?)\]\s*\n*", raw_text)
+    if m:
+        chapter_title = m.group(1)
+        body_text = raw_text[m.end():]
+    else:
+        chapter_title = None
+        body_text = raw_text
+
+    page = {**page, "chapter": chapter_title, "text": body_text}
+
+    # Remove duplicated chapter rendering in html (defensive)
+    html0 = page.get("html", "")
+    html0 = re.sub(
+        r'^\s*<[^>]*class="chapter"[^>]*>.*?</[^>]+>\s*',
+        "",
+        html0,
+        flags=re.S
+    )
+    html0 = re.sub(
+        r'^\s*\[chapter:(.+?)\]\s*(?:<br\s*/?>\s*)*',
+        "",
+        html0,
+        flags=re.S | re.I
+    )
+    page["html"] = html0
+
+    return dict(
+        success=True,
+        p=p,
+        total=total,
+        page_html=page["html"],
+        page_text=page["text"],
+        writing_mode=writing_mode,
+        rev=draft_key(text),
+    )
+
+
 @app.route("/preview", methods=["GET", "POST"])
 def preview():
     if request.method == "POST":
-        session["last_text"] = request.form.get("text", "")
+        _set_draft_text(request.form.get("text", ""))
         session["last_writing_mode"] = request.form.get("writing_mode", "horizontal")
         return redirect(url_for("preview"))
 
-    text = session.get("last_text", "")
+    text = _draft_text()
 
     # ★ 追加：GETパラメータを優先して反映
     req_mode = (request.args.get("writing_mode") or "").strip()
@@ -795,26 +987,20 @@ def preview():
         flash("プレビューする文章がありません。先に入力してください。")
         return redirect(url_for("index"))
 
-    try:
-        pages = parse_document(text)
-    except Exception as e:
-        flash(f"プレビュー生成に失敗しました: {e}")
-        return redirect(url_for("index"))
-
     p = request.args.get("p", "1")
     try:
         p = int(p)
     except ValueError:
         p = 1
 
-    if not pages:
-        page = {"text": "", "html": ""}
-        p = 1
-        total = 0
-    else:
-        p = max(1, min(len(pages), p))
-        page = pages[p - 1]
-        total = len(pages)
+    try:
+        page = parse_page(text, p)
+    except Exception as e:
+        flash(f"プレビュー生成に失敗しました: {e}")
+        return redirect(url_for("index"))
+
+    p = page["index"]
+    total = page["total"]
 
     raw_text = page.get("text", "")
 
@@ -834,7 +1020,6 @@ def preview():
 
     return render_template(
         "preview.html",
-        pages=pages,
         page=page,
         p=p,
         nums=nums,
@@ -843,6 +1028,7 @@ def preview():
         total=total,
         writing_mode=writing_mode,
         text=text,
+        toc=chapter_toc(text)["chapters"],
     )
 
 
@@ -853,11 +1039,11 @@ def api_preview_page():
     if request.method == "POST":
         text = payload.get("text", "")
         writing_mode = payload.get("writing_mode", "horizontal")
-        session["last_text"] = text
+        _set_draft_text(text)
         session["last_writing_mode"] = writing_mode
         p_param = payload.get("p")
     else:
-        text = session.get("last_text", "")
+        text = _draft_text()
         writing_mode = session.get("last_writing_mode", "horizontal")
         p_param = request.args.get("p")
 
@@ -870,71 +1056,89 @@ def api_preview_page():
         p = 1
 
     try:
-        pages = parse_document(text)
+        return jsonify(_preview_page_payload(text, p, writing_mode))
     except Exception as e:
         return jsonify(success=False, message=f"プレビュー生成に失敗しました: {e}"), 400
 
-    total = len(pages)
-    p = max(1, min(total, p))
-    page = pages[p - 1]
 
-    raw_text = page.get("text", "")
-    m = re.match(r"\[chapter:(.+?)\]\s*\n*", raw_text)
-    if m:
-        chapter_title = m.group(1)
-        body_text = raw_text[m.end():]
-    else:
-        chapter_title = None
-        body_text = raw_text
+@app.route("/api/preview_patch", methods=["POST"])
+def api_preview_patch():
+    """Apply a text patch to the session draft and render only the page it touched.
 
-    page = {**page, "chapter": chapter_title, "text": body_text}
+    Body: {"base_rev": str, "ops": [{"offset": int, "delete": int, "insert": str}], "p"?: int}.
+    Offsets are UTF-16 code units (JavaScript string indices), applied in order.
+    A stale base_rev or a malformed patch answers 409 with resync=true;
+    the client then falls back to posting the full text to /api/preview_page.
+    """
+    payload = request.get_json(silent=True) or {}
+    text = _draft_text()
+    writing_mode = payload.get("writing_mode") or session.get("last_writing_mode", "horizontal")
 
-    # Remove duplicated chapter rendering in html (defensive)
-    html0 = page.get("html", "")
-    html0 = re.sub(
-        r'^\s*<[^>]*class="chapter"[^>]*>.*?</[^>]+>\s*',
-        "",
-        html0,
-        flags=re.S
-    )
-    html0 = re.sub(
-        r'^\s*\[chapter:(.+?)\]\s*(?:<br\s*/?>\s*)*',
-        "",
-        html0,
-        flags=re.S | re.I
-    )
-    page["html"] = html0
+    if not text or payload.get("base_rev") != session.get("draft_id"):
+        return jsonify(success=False, resync=True, message="プレビューの版が一致しません。"), 409
+    patched = _apply_text_patch(text, payload.get("ops"))
+    if patched is None:
+        return jsonify(success=False, resync=True, message="差分を適用できませんでした。"), 409
+    text, touched = patched
 
-    return jsonify(
-        success=True,
-        p=p,
-        total=total,
-        page_html=page["html"],
-        page_text=page["text"],
-        writing_mode=writing_mode,
-    )
+    _set_draft_text(text)
+    session["last_writing_mode"] = writing_mode
+    if not text:
+        return jsonify(success=False, message="プレビューする文章がありません。"), 400
+
+    # ページ指定が無ければ編集した位置のページを返す
+    try:
+        p = int(payload.get("p") or 0)
+    except (TypeError, ValueError):
+        p = 0
+    if p <= 0:
+        p = text.count("[newpage]", 0, touched) + 1
+
+    try:
+        return jsonify(_preview_page_payload(text, p, writing_mode))
+    except Exception as e:
+        return jsonify(success=False, message=f"プレビュー生成に失敗しました: {e}"), 400
+
+
+@app.route("/api/toc")
+def api_toc():
+    """Chapter table of contents: a public save with ?fname=, otherwise the session draft."""
+    fname = request.args.get("fname", "")
+    if fname:
+        m = SAVES.get(fname) or {}
+        if m.get("deleted_at") or m.get("visibility") != "public":
+            return jsonify(success=False, message="作品が見つかりません。"), 404
+        if not os.path.isfile(os.path.join(SAVES_DIR, fname)):
+            return jsonify(success=False, message="作品が見つかりません。"), 404
+        toc = _save_toc(fname)
+    else:
+        text = _draft_text()
+        if not text:
+            return jsonify(success=False, message="プレビューする文章がありません。"), 400
+        toc = chapter_toc(text)
+
+    return jsonify(success=True, total=toc["total"], chapters=toc["chapters"])
 
 
 @app.route("/read")
 def read_single():
-    text = session.get("last_text", "")
+    text = _draft_text()
     writing_mode = session.get("last_writing_mode", "horizontal")
     if not text:
         return redirect(url_for("index"))
-    try:
-        pages = parse_document(text)
-    except Exception as e:
-        flash(f"本文の読み込みに失敗しました: {e}")
-        return redirect(url_for("index"))
-
     try:
         p = int(request.args.get("p", 1))
     except Exception:
         p = 1
 
-    total = len(pages) or 1
-    p = max(1, min(total, p))
-    page = pages[p - 1] if pages else {"text": "", "html": ""}
+    try:
+        page = parse_page(text, p)
+    except Exception as e:
+        flash(f"本文の読み込みに失敗しました: {e}")
+        return redirect(url_for("index"))
+
+    p = page["index"]
+    total = page["total"]
 
     nums = list(range(1, total + 1))
     prev_p = 1 if p <= 1 else p - 1
@@ -959,9 +1163,36 @@ def read_single():
 def export():
     text = request.form.get("text", "")
     writing_mode = request.form.get("writing_mode", "horizontal")
-    session["last_text"] = text
+    _set_draft_text(text)
     session["last_writing_mode"] = writing_mode
-    out_path = os.path.join(BASE_DIR, "export.txt")
+
+    if request.form.get("format") == "html":
+        # streamed: each page goes out as soon as it is rendered, assets are inlined where they appear
+        chunks = iter_html_document(
+            iter_document(text, workers=app.config["RENDER_WORKERS"]),
+            writing_mode=writing_mode,
+            include_boilerplate=True,
+            inline_assets=True,
+        )
+        return Response(
+            stream_with_context(chunks),
+            mimetype="text/html; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="export.html"'},
+        )
+
+    if request.form.get("format") == "zip":
+        # index.html + one copy of each CSS/JS file and image, referenced by relative path (no base64)
+        chunks = iter_zip_document(
+            iter_document(text, workers=app.config["RENDER_WORKERS"]),
+            writing_mode=writing_mode,
+        )
+        return Response(
+            stream_with_context(chunks),
+            mimetype="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="export.zip"'},
+        )
+
+    out_path = os.path.join(DATA_DIR, "export.txt")
     with open(out_path, "w", encoding="utf-8") as f:
         f.write(text)
     return send_file(out_path, as_attachment=True, download_name="export.txt", mimetype="text/plain")
@@ -973,8 +1204,7 @@ def export():
 @app.route("/trash_image/<img_id>", methods=["POST"])
 def trash_image(img_id):
     """Move image to trash (soft delete)."""
-    db = _load_db()
-    rec = db.get(img_id)
+    rec = IMAGES.get(img_id)
     if not rec:
         flash(f"ID {img_id} の画像が見つかりませんでした。")
         return redirect(url_for("gallery"))
@@ -989,8 +1219,7 @@ def trash_image(img_id):
         flash(f"ゴミ箱移動に失敗: {e}")
         return redirect(url_for("gallery"))
 
-    db[img_id] = rec
-    _save_db(db)
+    IMAGES.put(img_id, rec)
 
     _write_trash_log({
         "event": "trash_image",
@@ -1010,14 +1239,12 @@ def trash_save():
     if not fname or not fname.lower().endswith(".txt"):
         abort(400)
 
-    meta = _load_saves_meta()
-    rec = meta.get(fname, {})
+    rec = SAVES.get(fname) or {}
     if rec.get("owner") != uid:
         abort(403)
 
     rec = _move_save_to_trash(fname, rec)
-    meta[fname] = rec
-    _save_saves_meta(meta)
+    SAVES.put(fname, rec)
 
     _write_trash_log({
         "event": "trash_save",
@@ -1085,20 +1312,23 @@ def save_local():
     path = os.path.join(SAVES_DIR, name)
 
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        # 別名で取り込まれた保存とブロブを共有していることがあるので、上書きせず新しい中身として置く
+        tmp = SAVE_BLOBS.tmp_path()
+        with open(tmp, "w", encoding="utf-8") as f:
             f.write(text)
+        SAVE_BLOBS.put(tmp, path)
+        _refresh_page_index(name)
+        PUBLIC_PAGE_CACHE.invalidate(name)
 
-        session["last_text"] = text
+        _set_draft_text(text)
         session["last_filename"] = name
 
-        meta = _load_saves_meta()
-        rec = meta.get(name, {})
+        rec = SAVES.get(name) or {}
         rec.setdefault("owner", session.get("user_id"))
         rec.setdefault("visibility", "private")
         rec.setdefault("pinned", False)
         rec["updated_at"] = int(time.time())
-        meta[name] = rec
-        _save_saves_meta(meta)
+        SAVES.put(name, rec, mtime=time.time())   # the file may be a link to an older blob with its old mtime
 
         payload: Dict[str, Any] = dict(success=True, message=f"「{name}」を保存しました", filename=name)
 
@@ -1116,40 +1346,24 @@ def save_local():
 @app.route("/saves")
 def saves_list():
     uid = session.get("user_id")
-    meta = _load_saves_meta()
     q = (request.args.get("q") or "").strip().lower()
 
     files = []
     try:
-        for name in os.listdir(SAVES_DIR):
-            if not name.lower().endswith(".txt"):
-                continue
-
+        # owner's files, trashed hidden, pinned first then newest
+        for name, size, mtime, m in SAVES.by_owner(uid):
             if q and (q not in name.lower()):
                 continue
 
-            p = os.path.join(SAVES_DIR, name)
-            if not os.path.isfile(p):
-                continue
-
-            m = meta.get(name, {})
-            if m.get("deleted_at"):
-                continue
-            if m.get("owner") != uid:
-                continue
-
-            st = os.stat(p)
             files.append({
                 "name": name,
-                "size": st.st_size,
-                "size_kb": round(st.st_size / 1024, 1),
-                "mtime": st.st_mtime,
-                "mtime_str": datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M"),
+                "size": size,
+                "size_kb": round(size / 1024, 1),
+                "mtime": mtime,
+                "mtime_str": datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M"),
                 "visibility": m.get("visibility", "private"),
                 "pinned": bool(m.get("pinned", False)),
             })
-
-        files.sort(key=lambda x: (not x["pinned"], -x["mtime"]))
     except Exception as e:
         flash(f"保存一覧の取得に失敗しました: {e}")
         files = []
@@ -1171,8 +1385,7 @@ def saves_open():
         flash("ファイルが見つかりません")
         return redirect(url_for("saves_list"))
 
-    meta = _load_saves_meta()
-    rec = meta.get(fname)
+    rec = SAVES.get(fname)
 
     if not rec or rec.get("owner") != uid:
         flash("このファイルを開く権限がありません")
@@ -1188,8 +1401,7 @@ def saves_public_raw(fname):
     if not fname or not fname.lower().endswith(".txt"):
         abort(404)
 
-    meta = _load_saves_meta()
-    m = meta.get(fname, {})
+    m = SAVES.get(fname) or {}
     if m.get("deleted_at"):
         abort(404)
     if m.get("visibility") != "public":
@@ -1220,8 +1432,7 @@ def saves_set_visibility():
     if vis not in ("private", "unlisted", "public"):
         abort(400)
 
-    meta = _load_saves_meta()
-    rec = meta.get(fname, {})
+    rec = SAVES.get(fname) or {}
 
     if rec.get("owner") and rec.get("owner") != uid:
         abort(403)
@@ -1230,8 +1441,8 @@ def saves_set_visibility():
     rec.setdefault("pinned", False)
     rec["visibility"] = vis
     rec["updated_at"] = int(time.time())
-    meta[fname] = rec
-    _save_saves_meta(meta)
+    SAVES.put(fname, rec)
+    PUBLIC_PAGE_CACHE.invalidate(fname)
 
     flash(f"{fname} の公開設定を {vis} にしました")
     return redirect(url_for("saves_list"))
@@ -1241,17 +1452,14 @@ def set_visibility(img_id):
     uid = session.get("user_id")
     vis = (request.form.get("visibility") or "private").strip()
 
-    db = _load_db()
-    rec = db.get(img_id)
+    rec = IMAGES.get(img_id)
 
     if not rec:
         abort(404)
     if rec.get("owner") != uid:
         abort(403)
 
-    rec["visibility"] = vis
-    db[img_id] = rec
-    _save_db(db)
+    IMAGES.update(img_id, visibility=vis)
 
     return redirect(url_for("gallery"))
 
@@ -1265,8 +1473,7 @@ def saves_toggle_pin():
     if not fname or not fname.lower().endswith(".txt"):
         abort(400)
 
-    meta = _load_saves_meta()
-    rec = meta.get(fname, {})
+    rec = SAVES.get(fname) or {}
 
     if rec.get("owner") and rec.get("owner") != uid:
         abort(403)
@@ -1275,47 +1482,29 @@ def saves_toggle_pin():
     rec.setdefault("visibility", "private")
     rec["pinned"] = not bool(rec.get("pinned", False))
     rec["updated_at"] = int(time.time())
-    meta[fname] = rec
-    _save_saves_meta(meta)
+    SAVES.put(fname, rec)
 
     return redirect(url_for("saves_list"))
 
 
 @app.route("/saves/public")
 def saves_public():
-    meta = _load_saves_meta()
     q = (request.args.get("q") or "").strip().lower()
 
     files = []
     try:
-        for name in os.listdir(SAVES_DIR):
-            if not name.lower().endswith(".txt"):
-                continue
-
-            m = meta.get(name, {})
-            if m.get("deleted_at"):
-                continue
-
-            if m.get("visibility") != "public":
-                continue
-
+        # public, not trashed, newest first
+        for name, size, mtime, m in SAVES.public():
             if q and (q not in name.lower()):
                 continue
 
-            p = os.path.join(SAVES_DIR, name)
-            if not os.path.isfile(p):
-                continue
-
-            st = os.stat(p)
             files.append({
                 "name": name,
-                "size": st.st_size,
-                "size_kb": round(st.st_size / 1024, 1),
-                "mtime": st.st_mtime,
-                "mtime_str": datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M"),
+                "size": size,
+                "size_kb": round(size / 1024, 1),
+                "mtime": mtime,
+                "mtime_str": datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M"),
             })
-
-        files.sort(key=lambda x: -x["mtime"])
     except Exception as e:
         flash(f"公開保存一覧の取得に失敗しました: {e}")
         files = []
@@ -1331,8 +1520,7 @@ def saves_public_view():
         abort(404)
 
     # 2) メタ参照
-    meta = _load_saves_meta()
-    m = meta.get(fname, {})
+    m = SAVES.get(fname) or {}
     if m.get("deleted_at"):
         abort(404)
     if m.get("visibility") != "public":
@@ -1343,26 +1531,42 @@ def saves_public_view():
     if not os.path.isfile(path):
         abort(404)
 
-    with open(path, "r", encoding="utf-8") as f:
-        text = f.read()
-
-    # 4) ページ分割
-    pages = parse_document(text)
-    if not pages:
-        abort(404)
-
-    # 5) ページ番号（不正値対策）
+    # 4) ページ番号（不正値対策）
     try:
         p = int(request.args.get("p", 1))
     except (TypeError, ValueError):
         p = 1
-    p = max(1, min(p, len(pages)))
 
-    page = pages[p - 1]
+    # 5) 要求されたページだけ描画（範囲外は丸める）
+    #    共有キャッシュにあればそれを使う。無ければページ索引が本文と一致するとき該当ページだけ読み、
+    #    索引も使えなければ全文を読んで索引を作り直す
+    toc = _save_toc(fname)
+    p = max(1, min(toc["total"], p))
+    version = PUBLIC_PAGE_CACHE.version(path)
+    html = PUBLIC_PAGE_CACHE.get(fname, version, p) if version else None
+    if html is not None:
+        page = {"index": p, "html": html, "total": toc["total"]}
+    else:
+        page = read_indexed_page(path, _page_index_path(fname), p)
+        if page is None:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            page = parse_page(text, p)
+            # 索引が本文と一致していて exact でないだけなら、作り直しても同じなのでそのまま（目次も上で取ったもの）
+            if read_page_toc(path, _page_index_path(fname)) is None:
+                idx = _refresh_page_index(fname)
+                if idx is not None:
+                    toc = {"total": idx["total"], "chapters": idx["chapters"]}
+        # 描画中に本文が書き換わっていなければ共有する
+        if version and PUBLIC_PAGE_CACHE.version(path) == version:
+            PUBLIC_PAGE_CACHE.put(fname, version, page["index"], page["html"])
+    p = page["index"]
+    total = page["total"]
+
     prev_p = max(1, p - 1)
-    next_p = min(len(pages), p + 1)
+    next_p = min(total, p + 1)
 
-    nums = range(1, len(pages) + 1)
+    nums = range(1, total + 1)
     writing_mode = request.args.get("writing_mode", "horizontal")
 
     return render_template(
@@ -1374,6 +1578,7 @@ def saves_public_view():
         next_p=next_p,
         nums=nums,
         writing_mode=writing_mode,
+        toc=toc["chapters"],
     )
 
 
@@ -1410,8 +1615,7 @@ def saves_import():
     if not fname.lower().endswith(".txt"):
         abort(400)
 
-    meta = _load_saves_meta()
-    src_rec = meta.get(fname, {})
+    src_rec = SAVES.get(fname) or {}
     if src_rec.get("visibility") != "public":
         abort(404)
 
@@ -1426,17 +1630,18 @@ def saves_import():
         new_name = f"{base}_import{i}{ext}"
         i += 1
 
-    shutil.copy2(src_path, os.path.join(SAVES_DIR, new_name))
+    SAVE_BLOBS.link(src_path, os.path.join(SAVES_DIR, new_name))
+    _refresh_page_index(new_name)
+    PUBLIC_PAGE_CACHE.invalidate(new_name)
 
-    meta[new_name] = {
+    SAVES.put(new_name, {
         "owner": uid,
         "visibility": "private",
         "pinned": False,
         "updated_at": int(time.time()),
         "imported_from": fname,
         "imported_from_owner": src_rec.get("owner", ""),
-    }
-    _save_saves_meta(meta)
+    })
 
     flash(f"取り込みました: {new_name}")
     return redirect(url_for("saves_list"))
@@ -1447,6 +1652,30 @@ def saves_auto_open():
     return ("", 204)
 
 
+# =========================
+# CLI
+# =========================
+@app.cli.command("purge-trash")
+@click.option("--dry-run", is_flag=True, help="Only report what would be removed.")
+@click.option("--days", type=float, default=None, help="Retention for this pass (default: TRASH_RETENTION_DAYS).")
+def purge_trash_command(dry_run, days):
+    """Run one trash retention pass now (the same pass the background worker runs)."""
+    if days is None and RETENTION.max_age <= 0:
+        raise click.UsageError("trash retention is off; set TRASH_RETENTION_DAYS or pass --days")
+    max_age = None if days is None else days * 24 * 3600
+    if max_age is not None and max_age <= 0:
+        raise click.BadParameter("must be greater than 0", param_hint="--days")
+    report = RETENTION.run(dry_run=dry_run or None, max_age=max_age)
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+@app.cli.command("reconcile-saves")
+def reconcile_saves_command():
+    """Pick up saves added, removed or edited outside the app now."""
+    changed = SAVES.reconcile()
+    click.echo(json.dumps({"changed": changed, **SAVES.stats()}, ensure_ascii=False, indent=2))
+
+
 # =========================
 # Entrypoint
 # =========================
@@ -0,0 +1,321 @@
+"""PixiText parser benchmark.
+
+Generates synthetic manuscripts and times each parser stage separately
+(_preprocess, split_pages, render_block, render_inline, parse_document,
+to_html_document), reporting MB/s, pages/s and peak memory.
+
+    python bench_parser.py                          # print results
+    python bench_parser.py --out bench.json         # save results
+    python bench_parser.py --baseline bench.json    # compare, exit 1 on regression
+    python bench_parser.py --adversarial            # worst-case inputs, exit 1 if super-linear
+    python bench_parser.py --fuzz 20000             # new parser vs regex reference, exit 1 on mismatch
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from html import escape
+
+import parser as P
+
+
+# =========================
+# Corpora
+# =========================
+SENTENCES = [
+    "朝の光が窓辺に差し込み、彼女はゆっくりと目を開けた。",
+    "遠くで汽笛が鳴り、港町はいつもの喧騒を取り戻していく。",
+    "「まだ間に合うよ」と彼は言ったが、その声は震えていた。",
+    "石畳の坂道を登りきると、古い灯台が見えてきた。",
+    "The rain had not stopped for three days, and the river was rising.",
+]
+
+
+def _prose_line(rng: random.Random) -> str:
+    return "".join(rng.choice(SENTENCES) for _ in range(rng.randint(1, 4)))
+
+
+def _ruby_line(rng: random.Random) -> str:
+    words = [("漢字", "かんじ"), ("灯台", "とうだい"), ("喧騒", "けんそう"), ("石畳", "いしだたみ")]
+    parts = []
+    for _ in range(rng.randint(3, 8)):
+        base, rt = rng.choice(words)
+        parts.append(f"{rng.choice(SENTENCES)[:12]}[[rb:{base} > {rt}]]")
+    return "".join(parts)
+
+
+def _link_line(rng: random.Random, pages: int) -> str:
+    if rng.random() < 0.5:
+        return f"{_prose_line(rng)}[jump:{rng.randint(1, pages)}]へ進む。"
+    return f"{_prose_line(rng)}[[jumpuri:公式サイト > https://example.com/{rng.randint(1, 999)}]]"
+
+
+def _manuscript(rng: random.Random, size: int, pages: int, line) -> str:
+    # 約 size 文字の本文を pages ページ・章見出し付きで組み立てる
+    per_page = max(1, size // pages)
+    out = []
+    for p in range(1, pages + 1):
+        lines = [f"[chapter:第{p}章]"] if p % 10 == 1 else []
+        n = 0
+        while n < per_page:
+            s = line(rng, p)
+            lines.append(s)
+            n += len(s) + 1
+            if rng.random() < 0.2:
+                lines.append("")
+        out.append("\n".join(lines))
+    return "\n[newpage]\n".join(out)
+
+
+def build_corpora(scale: float, seed: int) -> dict:
+    size = int(1_000_000 * scale)
+    rng = random.Random(seed)
+    return {
+        "plain": _manuscript(rng, size, 50, lambda r, p: _prose_line(r)),
+        "ruby": _manuscript(rng, size, 50, lambda r, p: _ruby_line(r)),
+        "images": _manuscript(
+            rng, size, 50,
+            lambda r, p: f"[uploadedimage:{r.randint(1000, 99999999)}]" if r.random() < 0.3 else _prose_line(r),
+        ),
+        "pages": _manuscript(rng, size, 3000, lambda r, p: _prose_line(r)),
+        "links": _manuscript(rng, size, 200, lambda r, p: _link_line(r, 200)),
+    }
+
+
+# =========================
+# Stages
+# =========================
+def _stages(text: str) -> dict:
+    # 各段階の入力はあらかじめ作っておき、計測対象の関数だけを呼ぶ
+    pre = P._preprocess(text)
+    pages = P.split_pages(pre)
+    blocks = [(i, b) for i, page in enumerate(pages, start=1) for b in P.RE_BLOCK_SPLIT.split(page)]
+    paras = [escape(line) for page in pages for line in page.split("\n") if line.strip()]
+    parsed = P.parse_document(text)
+
+    def parse_cold():
+        P.PAGE_CACHE.clear()
+        return P.parse_document(text)
+
+    return {
+        "_preprocess": lambda: P._preprocess(text),
+        "split_pages": lambda: P.split_pages(pre),
+        "render_block": lambda: [P.render_block(b, i) for i, b in blocks],
+        "render_inline": lambda: [P.render_inline(s) for s in paras],
+        "parse_document": parse_cold,
+        "parse_document_cached": lambda: P.parse_document(text),
+        "to_html_document": lambda: P.to_html_document(parsed, include_boilerplate=True),
+    }
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _peak(fn) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(scale: float, repeat: int, seed: int) -> dict:
+    results = {}
+    for name, text in build_corpora(scale, seed).items():
+        mb = len(text.encode("utf-8")) / 1e6
+        npages = len(P.split_pages(P._preprocess(text)))
+        stages = {}
+        for stage, fn in _stages(text).items():
+            sec = _time(fn, repeat)
+            stages[stage] = {
+                "seconds": round(sec, 6),
+                "mb_per_s": round(mb / sec, 3) if sec else None,
+                "pages_per_s": round(npages / sec, 1) if sec else None,
+                "peak_bytes": _peak(fn),
+            }
+        results[name] = {"mb": round(mb, 3), "pages": npages, "stages": stages}
+    P.PAGE_CACHE.clear()
+    return results
+
+
+# =========================
+# Adversarial inputs
+# =========================
+# 正規表現の .*? や (?=^\s*...) が二乗時間になりうる形。n は目安の文字数
+ADVERSARIAL = {
+    "rb_open": lambda n: "[[rb:" * (n // 5),
+    "rb_open_gt": lambda n: "[[rb:" * (n // 5) + ">",
+    "rb_amp": lambda n: "[[rb:&&&&&&&&&" * (n // 14) + "&gt;",
+    "rb_spaces": lambda n: ("[[rb:" + " " * 50) * (n // 55) + "x",
+    "rb_overlap": lambda n: "[[rb:a[[jumpuri:b>c]]" + "[[rb:" * (n // 5) + ">",
+    "jumpuri_open": lambda n: "[[rb:a>b]]" + "[[jumpuri:" * (n // 10) + ">",
+    "jump_digits": lambda n: ("[jump:" + "1" * 40) * (n // 46),
+    "chapter_open": lambda n: "[chapter:" * (n // 9) + "]",
+    "chapter_open_lines": lambda n: "[chapter:x\n" * (n // 11) + "]",
+    "blank_then_tag": lambda n: "\n" * n + "[chapter:a]",
+    "spaced_tags": lambda n: " \n [chapter:a]x" * (n // 14),
+    "newpages": lambda n: "[newpage]" * (n // 9),
+}
+
+
+def check_adversarial(size: int, repeat: int, max_factor: float, max_growth: float) -> list:
+    # 同じ長さの通常の原稿に対する倍率と、長さを 4 倍にしたときの伸び（線形なら約 4）を見る
+    def parse(text):
+        P.PAGE_CACHE.clear()
+        return P.parse_document(text)
+
+    def timed(text):
+        return max(_time(lambda: parse(text), repeat), 1e-3)
+
+    rng = random.Random(0)
+    plain = timed(_manuscript(rng, size, 50, lambda r, p: _prose_line(r)))
+    failures = []
+    for name, make in ADVERSARIAL.items():
+        small = timed(make(size))
+        large = timed(make(size * 4))
+        factor, growth = small / plain, large / small
+        line = f"{name:20s} {small * 1e3:9.1f} ms  x{factor:6.1f} plain  x{growth:5.2f} at 4x size"
+        print(line)
+        if factor > max_factor or growth > max_growth:
+            failures.append(line)
+    P.PAGE_CACHE.clear()
+    return failures
+
+
+def _legacy_pages(text: str) -> list:
+    # 構文木を使わない元の経路（_preprocess → split_pages → RE_BLOCK_SPLIT → render_block）
+    out = []
+    for i, raw in enumerate(P.split_pages(P._preprocess(text)), start=1):
+        blocks = [b for b in P.RE_BLOCK_SPLIT.split(raw) if b]
+        out.append("\n".join(P.render_block(b, i) for b in blocks))
+    return out
+
+
+FUZZ_ATOMS = [
+    "a", "漢字", " ", "\t", "\n", "\n\n", "\r\n", "[", "]", ">", "&", "&gt;", "]]", "1",
+    "[[rb:", "[[jumpuri:", "[jump:", "[jump:12]", "[chapter:", "[chapter:章]", "[newpage]",
+    "[uploadedimage:1234]", "[pixivimage:1@2]", "http://x",
+]
+
+
+def fuzz(count: int, seed: int) -> int:
+    # render_inline を正規表現版と、parse_document を元の経路と突き合わせる
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(count):
+        text = "".join(rng.choice(FUZZ_ATOMS) for _ in range(rng.randint(0, 40)))
+        line = escape(text.replace("\r", "").replace("\n", " "))
+        if P.render_inline(line) != P._render_inline_regex(line):
+            mismatches += 1
+            print("render_inline mismatch:", repr(line), file=sys.stderr)
+        P.PAGE_CACHE.clear()
+        if [p["html"] for p in P.parse_document(text)] != _legacy_pages(text):
+            mismatches += 1
+            print("parse_document mismatch:", repr(text), file=sys.stderr)
+        if mismatches >= 10:
+            break
+    P.PAGE_CACHE.clear()
+    return mismatches
+
+
+# =========================
+# Baseline comparison
+# =========================
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    # スループットが baseline の (1 - tolerance) 倍を下回った段階を返す
+    regressions = []
+    for corpus, cur in current["results"].items():
+        base = baseline.get("results", {}).get(corpus)
+        if not base:
+            continue
+        for stage, c in cur["stages"].items():
+            b = base["stages"].get(stage)
+            if not b or not b.get("mb_per_s") or not c.get("mb_per_s"):
+                continue
+            ratio = c["mb_per_s"] / b["mb_per_s"]
+            line = f"{corpus:8s} {stage:22s} {b['mb_per_s']:10.2f} -> {c['mb_per_s']:10.2f} MB/s  x{ratio:.2f}"
+            print(line)
+            if ratio < 1 - tolerance:
+                regressions.append(line)
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", type=float, default=1.0, help="corpus size in millions of characters (default 1.0)")
+    ap.add_argument("--repeat", type=int, default=3, help="timing runs per stage; the best is kept")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--baseline", help="results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed throughput drop vs baseline (default 0.25)")
+    ap.add_argument("--adversarial", action="store_true", help="time worst-case inputs instead of the corpora")
+    ap.add_argument("--max-factor", type=float, default=60.0, help="allowed slowdown vs plain text (default 60)")
+    ap.add_argument("--max-growth", type=float, default=6.0, help="allowed time growth for 4x input (default 6)")
+    ap.add_argument("--fuzz", type=int, metavar="N", help="compare N random inputs against the regex reference")
+    args = ap.parse_args(argv)
+
+    if args.fuzz:
+        mismatches = fuzz(args.fuzz, args.seed)
+        print(f"{args.fuzz} inputs, {mismatches} mismatch(es)")
+        return 1 if mismatches else 0
+
+    if args.adversarial:
+        failures = check_adversarial(int(100_000 * args.scale), args.repeat, args.max_factor, args.max_growth)
+        if failures:
+            print(f"\n{len(failures)} input(s) exceeded x{args.max_factor:g} plain or x{args.max_growth:g} growth:",
+                  file=sys.stderr)
+            for line in failures:
+                print("  " + line, file=sys.stderr)
+            return 1
+        return 0
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "results": run(args.scale, args.repeat, args.seed),
+    }
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if not args.baseline:
+        for corpus, r in report["results"].items():
+            for stage, s in r["stages"].items():
+                print(f"{corpus:8s} {stage:22s} {s['mb_per_s']:10.2f} MB/s {s['pages_per_s']:12.1f} pages/s "
+                      f"{s['peak_bytes'] / 1e6:9.1f} MB peak")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if (baseline.get("scale"), baseline.get("seed")) != (args.scale, args.seed):
+        print("warning: baseline was recorded with a different --scale/--seed", file=sys.stderr)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) regressed more than {args.tolerance:.0%}:", file=sys.stderr)
+        for line in regressions:
+            print("  " + line, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import os
+import stat
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+# ---------- 内容アドレスのブロブ ----------
+# 中身を SHA-256 の名前で <root>/<先頭2文字>/<sha><拡張子> に 1 つだけ置き、アプリが使う名前
+# （uploads/<stored_name> や saves/<ファイル名>）はそこへのハードリンクにする。
+# 参照カウントはファイルシステムのリンク数（st_nlink - 1）なので、ワーカー間でもずれない。
+# 取り込み（import）はリンクを 1 本足すだけでバイトを写さず、同じ中身のアップロードは同じブロブになる。
+# ゴミ箱への移動はリンクごと動かす（復元できるように参照は残る）。put() / link() で名前を差し替えて
+# 参照が無くなった前のブロブはその場で消し、完全に消したものなどで残ったブロブは gc() が消す
+# （ensure_started() のスレッドが interval ごとに全ワーカーで 1 回。ゴミ箱の保持期間とは別に動く）。
+# 前提: リンクしている名前は中身をその場で書き換えない（共有している全部が変わる）。書き込みは一時ファイルに
+# 書いて改名で差し替える（アプリは put()、アプリの外でも同じ。詳しくは README）。
+# リンクは元の inode の mtime を引き継ぐので、更新時刻は呼び出し側で別に持つ（os.utime で共有の inode を触らない）
+def _ext(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+class BlobStore:
+    def __init__(self, root: str, grace: float = 3600, max_digests: int = 4096, interval: float = 3600):
+        self.root = root
+        self.grace = grace                 # これより新しいブロブと一時ファイルは gc() で消さない
+        self.max_digests = max_digests
+        self.interval = interval           # ensure_started() のスレッドが gc() する間隔（全ワーカーで 1 回）
+        self.mark_path = os.path.join(root, ".last_gc")
+        self.removed = 0
+        self.removed_bytes = 0
+        self.hashed = 0                    # 置いてあるファイルの中身を読み直してハッシュした回数
+        self._lock = threading.Lock()
+        self._digests = OrderedDict()      # (dev, ino, size, mtime_ns) → sha。このプロセスで置いた・ハッシュした inode
+        self._worker_pid = None
+        os.makedirs(root, exist_ok=True)
+
+    def _blob(self, sha: str, ext: str) -> str:
+        return os.path.join(self.root, sha[:2], sha + ext)
+
+    @staticmethod
+    def digest(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def _key(st) -> tuple:
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _remember(self, path: str, sha: str) -> None:
+        try:
+            key = self._key(os.stat(path))
+        except OSError:
+            return
+        with self._lock:
+            self._digests[key] = sha
+            self._digests.move_to_end(key)
+            while len(self._digests) > self.max_digests:
+                self._digests.popitem(last=False)
+
+    def _digest_of(self, path: str) -> str:
+        # 既に知っている inode（put() で置いた・前に取り込んだもの）なら読み直さない
+        try:
+            key = self._key(os.stat(path))
+        except OSError:
+            key = None
+        with self._lock:
+            sha = self._digests.get(key)
+        if sha is None:
+            sha = self.digest(path)
+            with self._lock:
+                self.hashed += 1
+            self._remember(path, sha)
+        return sha
+
+    def _blob_of(self, path: str) -> Optional[str]:
+        # path が今リンクしているブロブ。ブロブへのリンクでなければ（無い・リンク 1 本だけ）None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_nlink < 2:
+            return None
+        blob = self._blob(self._digest_of(path), _ext(path))
+        try:
+            bst = os.stat(blob)
+        except OSError:
+            return None
+        return blob if (bst.st_dev, bst.st_ino) == (st.st_dev, st.st_ino) else None
+
+    def _release(self, blob: str) -> None:
+        # 名前を差し替えて参照が無くなったブロブを消す（同時に同じブロブへリンクした側は put() / link() が作り直す）
+        try:
+            st = os.stat(blob)
+            if st.st_nlink > 1:
+                return
+            os.remove(blob)
+        except OSError:
+            return
+        with self._lock:
+            self.removed += 1
+            self.removed_bytes += st.st_size
+
+    @staticmethod
+    def _tmp(base: str) -> str:
+        # 同じスレッドで前に落ちて残ったものがあれば消しておく
+        tmp = f"{base}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return tmp
+
+    @staticmethod
+    def _link(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except (FileExistsError, FileNotFoundError):
+            raise
+        except OSError:
+            shutil.copy2(src, dst)         # ハードリンクが使えないファイルシステム（重複は減らない）
+
+    def tmp_path(self) -> str:
+        # put() に渡す一時ファイルの置き場所（ブロブと同じファイルシステム）
+        return self._tmp(os.path.join(self.root, "incoming"))
+
+    # ----- 置く -----
+    def put(self, src: str, dst: str) -> str:
+        # 一時ファイル src の中身を取り込み、dst をそのブロブへのリンクにする（src は消える）。ブロブのパスを返す
+        sha = self.digest(src)
+        blob = self._blob(sha, _ext(dst))
+        old = self._blob_of(dst)
+        tmp = self._tmp(dst)
+        try:
+            self._link(blob, tmp)          # 同じ中身が既にある
+            os.remove(src)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(src, blob)
+            self._link(blob, tmp)
+        os.replace(tmp, dst)
+        self._remember(dst, sha)
+        if old and old != blob:
+            self._release(old)
+        return blob
+
+    def link(self, src: str, dst: str) -> str:
+        # 既存のファイル src を、バイトを写さずに dst としても置く。src がまだブロブでなければ登録する
+        blob = self._blob(self._digest_of(src), _ext(dst))
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                self._link(src, blob)
+            except FileExistsError:
+                pass
+        old = self._blob_of(dst)
+        tmp = self._tmp(dst)
+        try:
+            self._link(blob, tmp)
+        except FileNotFoundError:          # 掃除と重なった
+            self._link(src, tmp)
+        os.replace(tmp, dst)
+        if old and old != blob:
+            self._release(old)
+        return blob
+
+    def refs(self, path: str) -> int:
+        # path（リンクでもブロブでも）の中身を参照している名前の数（ブロブ自身は数えない）
+        try:
+            return max(0, os.stat(path).st_nlink - 1)
+        except OSError:
+            return 0
+
+    # ----- 掃除 -----
+    def _files(self):
+        # (パス, stat)。<root> 直下は一時ファイル（. で始まる印のファイルは除く）、<root>/<2文字>/ の下がブロブ
+        for sub in os.listdir(self.root):
+            if sub.startswith("."):
+                continue
+            d = os.path.join(self.root, sub)
+            paths = [os.path.join(d, n) for n in os.listdir(d)] if os.path.isdir(d) else [d]
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    yield path, st
+
+    def gc(self, now: Optional[float] = None) -> int:
+        # どこからもリンクされていないブロブと、書きかけのまま残った一時ファイルを消す
+        cutoff = (now or time.time()) - self.grace
+        removed = size = 0
+        for path, st in self._files():
+            orphan = path.endswith(".tmp") or st.st_nlink <= 1
+            if orphan and st.st_ctime < cutoff:
+                try:
+                    os.remove(path)
+                    removed += 1
+                    size += st.st_size
+                except OSError:
+                    pass
+        with self._lock:
+            self.removed += removed
+            self.removed_bytes += size
+        return removed
+
+    # ----- バックグラウンド -----
+    def maybe_gc(self) -> Optional[int]:
+        # 全ワーカーで interval に 1 回だけ（印のファイルの mtime で調整）
+        now = time.time()
+        try:
+            if now - os.stat(self.mark_path).st_mtime < self.interval:
+                return None
+        except OSError:
+            pass
+        try:
+            with open(self.mark_path, "w"):
+                pass
+        except OSError:
+            return None
+        return self.gc(now)
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.maybe_gc()
+            except Exception:
+                pass
+            time.sleep(self.interval)
+
+    def ensure_started(self) -> None:
+        # プロセスごとに 1 本（gunicorn の fork 後にも動くよう、最初のリクエストで起こす）
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._loop, name="blob-gc", daemon=True).start()
+
+    def stats(self) -> dict:
+        blobs = links = size = shared = 0
+        for path, st in self._files():
+            if path.endswith(".tmp"):
+                continue
+            blobs += 1
+            links += max(0, st.st_nlink - 1)
+            size += st.st_size
+            shared += st.st_size * max(0, st.st_nlink - 2)
+        # saved_bytes: 重複を 1 つにまとめたことで使わずに済んでいるバイト数
+        return {"blobs": blobs, "links": links, "bytes": size, "saved_bytes": shared,
+                "removed": self.removed, "removed_bytes": self.removed_bytes, "hashed": self.hashed}
@@ -0,0 +1,315 @@
+import os
+import json
+import stat
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+
+# ---------- 保存ファイルの目録（SQLite） ----------
+# saves_meta.json と os.listdir + os.stat の代わり。1 ファイル 1 行で、メタ情報（JSON）と
+# サイズ・更新時刻を一緒に持ち、一覧に使う owner / visibility / pinned / deleted_at に索引を張る。
+# アプリからの書き込みは put() で反映し、アプリの外での追加・削除・書き換えは reconcile() で拾う。
+# 保存はほかの保存（取り込んだもの・同じ中身のもの）と inode を共有していることがあるので、アプリの外での
+# 書き換えも一時ファイルに書いて改名で差し替えること（その場で書き換えると共有している全部が変わる）。
+# reconcile() はリクエストの外（ensure_started() のスレッドか CLI）で回す。put() は書いた後のディレクトリの
+# mtime を目録に記録するので、アプリ自身の書き込みでは走査しない（記録は全ワーカーで共有）。
+# size が NULL の行はファイルが無い（ゴミ箱へ移したものなど）。
+# mtime は一覧に出す更新時刻、file_mtime は変更の検出に使うファイルの mtime。保存はブロブへの
+# ハードリンクで、同じ中身の古い inode を指すことがあるので、アプリが書いたときは書いた時刻を mtime にする
+class SavesCatalog:
+    def __init__(
+        self,
+        path: str,
+        saves_dir: str,
+        meta_path: Optional[str] = None,
+        reconcile_interval: float = 60,
+        poll: float = 5,
+    ):
+        self.path = path
+        self.saves_dir = saves_dir
+        self.reconcile_interval = reconcile_interval
+        self.poll = poll                   # ensure_started() のスレッドがディレクトリの mtime を見る間隔
+        self.reconciled = 0                # reconcile() で直した行の数
+        self.scans = 0                     # reconcile() でディレクトリを走査した回数
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = self._db()
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS saves (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                visibility TEXT NOT NULL DEFAULT 'private',
+                pinned INTEGER NOT NULL DEFAULT 0,
+                deleted_at INTEGER,
+                size INTEGER,
+                mtime REAL NOT NULL DEFAULT 0,
+                rec TEXT NOT NULL,
+                file_mtime REAL
+            );
+            CREATE INDEX IF NOT EXISTS saves_owner ON saves (owner, deleted_at, pinned, mtime);
+            CREATE INDEX IF NOT EXISTS saves_visibility ON saves (visibility, deleted_at, mtime);
+            CREATE INDEX IF NOT EXISTS saves_deleted ON saves (deleted_at);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """
+        )
+        if not self._has_file_mtime(db):
+            self._write(self._add_file_mtime)
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)", (int(time.time()),))
+        if meta_path:
+            self._migrate(meta_path)
+        self.reconcile()
+
+    def _db(self) -> sqlite3.Connection:
+        # スレッドごとに 1 接続（fork 後は作り直す）。自動コミットで、書き込みは BEGIN IMMEDIATE で囲む
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(db)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _has_file_mtime(db) -> bool:
+        return "file_mtime" in [c[1] for c in db.execute("PRAGMA table_info(saves)")]
+
+    def _add_file_mtime(self, db) -> None:
+        # file_mtime が無かった版の目録（それまでの mtime はファイルの mtime そのもの）。ほかのワーカーが先に足していれば何もしない
+        if not self._has_file_mtime(db):
+            db.execute("ALTER TABLE saves ADD COLUMN file_mtime REAL")
+            db.execute("UPDATE saves SET file_mtime = mtime")
+
+    def _dir_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.saves_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _set_meta(db, key: str, value) -> None:
+        if value is not None:
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _meta(self, key: str):
+        row = self._db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _stat(self, name: str) -> tuple:
+        # (size, mtime)。通常ファイルでなければ (None, 0)
+        try:
+            st = os.stat(os.path.join(self.saves_dir, name))
+        except OSError:
+            return None, 0
+        if not stat.S_ISREG(st.st_mode):
+            return None, 0
+        return st.st_size, st.st_mtime
+
+    @staticmethod
+    def _row(name: str, rec: dict, size, mtime, file_mtime) -> tuple:
+        return (
+            name,
+            rec.get("owner"),
+            rec.get("visibility") or "private",
+            1 if rec.get("pinned") else 0,
+            rec.get("deleted_at") or None,        # アプリ側は真偽で判定している
+            size,
+            mtime,
+            json.dumps(rec, ensure_ascii=False),
+            file_mtime,
+        )
+
+    def _migrate(self, meta_path: str) -> None:
+        # 初回だけ saves_meta.json を取り込む（ファイルは残す）。サイズと更新時刻は直後の reconcile() で埋まる
+        def run(db):
+            if db.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                return
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    raw = f.read().strip()
+                data = json.loads(raw) if raw else {}
+            except (OSError, ValueError):
+                data = {}
+            if isinstance(data, dict):
+                db.executemany(
+                    "INSERT OR IGNORE INTO saves (name, owner, visibility, pinned, deleted_at, size, mtime, rec, file_mtime)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._row(str(k), v, None, 0, None) for k, v in data.items() if isinstance(v, dict)],
+                )
+            db.execute("INSERT INTO meta (key, value) VALUES ('migrated', 1)")
+        if not self._db().execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            self._write(run)
+
+    # ----- 外からの変更の取り込み -----
+    def reconcile(self) -> int:
+        # ディレクトリを 1 回走査して、行のサイズ・更新時刻を実際のファイルに合わせる（変わったものは mtime も取り直す）。
+        # 知らないファイルはメタ無し（owner 無し・private）で追加し、消えたファイルは size を NULL にする。
+        # 走査の前に見たディレクトリの mtime を記録する（走査中の変更は次の回で拾う）
+        dir_mtime = self._dir_mtime()
+        seen = {}
+        try:
+            with os.scandir(self.saves_dir) as it:
+                for e in it:
+                    if e.name.lower().endswith(".txt") and e.is_file():
+                        st = e.stat()
+                        seen[e.name] = (st.st_size, st.st_mtime)
+        except OSError:
+            return 0
+
+        def diff(db):
+            known = {name: (size, fm) for name, size, fm in db.execute("SELECT name, size, file_mtime FROM saves")}
+            added = [self._row(name, {}, size, mtime, mtime) for name, (size, mtime) in seen.items() if name not in known]
+            changed = [
+                (size, mtime, mtime, name)
+                for name, (size, mtime) in seen.items() if name in known and known[name] != (size, mtime)
+            ]
+            gone = [(name,) for name, (size, _) in known.items() if size is not None and name not in seen]
+            return added, changed, gone
+
+        def note(db):
+            self._set_meta(db, "dir_mtime", dir_mtime)
+            self._set_meta(db, "reconciled_at", int(time.time()))
+
+        def run(db):
+            added, changed, gone = diff(db)
+            note(db)
+            db.executemany(
+                "INSERT INTO saves (name, owner, visibility, pinned, deleted_at, size, mtime, rec, file_mtime)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                added,
+            )
+            db.executemany("UPDATE saves SET size = ?, mtime = ?, file_mtime = ? WHERE name = ?", changed)
+            db.executemany("UPDATE saves SET size = NULL WHERE name = ?", gone)
+            return len(added) + len(changed) + len(gone)
+
+        # 差分が無ければ行は書かない（記録だけ更新する）
+        n = self._write(run) if any(diff(self._db())) else self._write(note) or 0
+        with self._lock:
+            self.reconciled += n
+            self.scans += 1
+        return n
+
+    def maybe_reconcile(self) -> bool:
+        # ディレクトリの mtime が記録と違うとき（アプリの外での追加・削除・改名）と、
+        # どのワーカーも reconcile_interval の間走査していないとき（その場の書き換え）。走査したら True
+        dir_mtime = self._dir_mtime()
+        if dir_mtime is None:
+            return False
+        last = self._meta("reconciled_at") or 0
+        if dir_mtime == self._meta("dir_mtime") and time.time() - last < self.reconcile_interval:
+            return False
+        self.reconcile()
+        return True
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.maybe_reconcile()
+            except Exception:
+                pass
+            time.sleep(self.poll)
+
+    def ensure_started(self) -> None:
+        # プロセスごとに 1 本（gunicorn の fork 後にも動くよう、最初のリクエストで起こす）
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._loop, name="saves-reconcile", daemon=True).start()
+
+    # ----- 読み取り -----
+    def get(self, name: str) -> Optional[dict]:
+        row = self._db().execute("SELECT rec FROM saves WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _list(self, where: str, args: tuple, order: str) -> list:
+        # [(name, size, mtime, rec)]。ファイルがあって、ゴミ箱に入っていないものだけ
+        rows = self._db().execute(
+            f"SELECT name, size, mtime, rec FROM saves"
+            f" WHERE {where} AND deleted_at IS NULL AND size IS NOT NULL ORDER BY {order}",
+            args,
+        )
+        return [(name, size, mtime, json.loads(rec)) for name, size, mtime, rec in rows]
+
+    def by_owner(self, owner: str) -> list:
+        # ピン留めが先、その中で新しい順
+        return self._list("owner = ?", (owner,), "pinned DESC, mtime DESC")
+
+    def public(self) -> list:
+        return self._list("visibility = 'public'", (), "mtime DESC")
+
+    def stats(self) -> dict:
+        total, present = self._db().execute("SELECT COUNT(*), COUNT(size) FROM saves").fetchone()
+        return {"rows": total, "files": present, "reconciled": self.reconciled, "scans": self.scans}
+
+    # ----- ゴミ箱の整理（retention.TrashRetention から） -----
+    def trashed_before(self, cutoff: int, limit: int, offset: int = 0) -> list:
+        # cutoff より前にゴミ箱へ入れて、同じ名前で保存し直されていないもの [(name, rec)]（古い順に limit 件）
+        rows = self._db().execute(
+            "SELECT name, rec FROM saves WHERE deleted_at < ? AND size IS NULL ORDER BY deleted_at LIMIT ? OFFSET ?",
+            (cutoff, limit, offset),
+        )
+        return [(name, json.loads(rec)) for name, rec in rows]
+
+    def created_at(self) -> int:
+        # この目録を作った時刻（これより前からゴミ箱にあるファイルは古い形式の残り）
+        return self._meta("created_at")
+
+    def trash_paths(self) -> set:
+        # ゴミ箱にある行が指している trash/saves のファイル名
+        rows = self._db().execute("SELECT rec FROM saves WHERE deleted_at IS NOT NULL")
+        return {json.loads(rec).get("trash_path") for rec, in rows} - {None}
+
+    def delete(self, names) -> int:
+        names = list(names)
+        return self._write(lambda db: db.executemany("DELETE FROM saves WHERE name = ?", [(n,) for n in names]).rowcount)
+
+    def compact(self) -> bool:
+        # WAL を本体に書き戻して切り詰め、空きページが 1/4 を超えていたら VACUUM する。VACUUM したら True
+        db = self._db()
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = db.execute("PRAGMA page_count").fetchone()[0]
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages and free * 4 > pages:
+            db.execute("VACUUM")
+            return True
+        return False
+
+    # ----- 書き込み -----
+    def put(self, name: str, rec: dict, mtime: Optional[float] = None) -> None:
+        # メタ情報を置き換え、サイズはファイルから取り直す。mtime は中身を書いた時刻で、書いたときに渡す。
+        # 渡さなければ（公開設定やゴミ箱への移動など）一覧の時刻はそのまま、新しい行ならファイルの mtime。
+        # ファイルを置いた・動かした後に呼ぶこと（そのときのディレクトリの mtime を自分の書き込みとして記録する）
+        size, file_mtime = self._stat(name)
+        dir_mtime = self._dir_mtime()
+
+        def run(db):
+            shown = mtime
+            if shown is None:
+                row = db.execute("SELECT mtime FROM saves WHERE name = ?", (name,)).fetchone()
+                shown = row[0] if row and row[0] else file_mtime
+            db.execute(
+                "INSERT OR REPLACE INTO saves (name, owner, visibility, pinned, deleted_at, size, mtime, rec, file_mtime)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row(name, rec, size, shown, file_mtime),
+            )
+            self._set_meta(db, "dir_mtime", dir_mtime)
+        self._write(run)
@@ -0,0 +1,157 @@
+import os
+import time
+import hashlib
+import threading
+from typing import Optional
+
+from parser import PageCache
+
+
+# ---------- 下書きストア ----------
+# セッションには本文のハッシュだけを置き、本文は <root>/<先頭2文字>/<ハッシュ>.txt に保存する。
+# 同じ本文は同じファイルになる（重複しない）。セッションはファイルを数えられないので参照カウントは持たず、
+# 読み書きのたびに mtime を更新し（リース）、ttl より長く触られていない下書きを掃除で消す。
+# セッションの下書きが差し替わったら前のものは release() でリースを retire_grace 秒に縮める
+# （同じ本文をほかのセッションが読めばリースは延び直す）。掃除は ensure_started() のスレッドで回す
+def draft_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class DraftStore:
+    def __init__(
+        self,
+        root: str,
+        ttl: float = 31 * 24 * 3600,
+        gc_interval: float = 3600,
+        retire_grace: float = 3600,
+        cache_entries: int = 64,
+        cache_chars: int = 16 * 1024 * 1024,
+    ):
+        self.root = root
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.retire_grace = retire_grace
+        self.cache = PageCache(cache_entries, cache_chars)
+        self.removed = 0
+        self.released = 0
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".txt")
+
+    def _write(self, key: str, text: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def _touch(self, key: str, text: str) -> None:
+        # リースの延長。ファイルの mtime が ttl / 100 より古くなったときだけ書く（縮めたリースもここで戻る）。
+        # 別のワーカーの掃除で消えていたら手元の本文で書き直す
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime < self.ttl / 100:
+                return
+            os.utime(path)
+        except FileNotFoundError:
+            self._write(key, text)
+        except OSError:
+            pass
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        # 無い（掃除された）下書きは None
+        if not key or len(key) != 32 or not key.isalnum():
+            return None
+        text = self.cache.get(key)
+        if text is None:
+            try:
+                with open(self._path(key), "r", encoding="utf-8", newline="") as f:
+                    text = f.read()
+            except OSError:
+                return None
+            self.cache.put(key, text)
+        self._touch(key, text)
+        return text
+
+    def put(self, text: str) -> str:
+        key = draft_key(text)
+        if os.path.exists(self._path(key)):
+            self._touch(key, text)
+        else:
+            self._write(key, text)
+        self.cache.put(key, text)
+        return key
+
+    def release(self, key: Optional[str]) -> None:
+        # 差し替えられた下書きのリースを retire_grace 秒に縮める（その間にほかのセッションが読めば延びる）
+        if not key or len(key) != 32 or not key.isalnum():
+            return
+        expires = time.time() - self.ttl + self.retire_grace
+        try:
+            if os.stat(self._path(key)).st_mtime > expires:
+                os.utime(self._path(key), (expires, expires))
+        except OSError:
+            return
+        with self._lock:
+            self.released += 1
+
+    def maybe_gc(self) -> None:
+        # 全ワーカーで gc_interval に 1 回だけ掃除する（印のファイルの mtime で調整）
+        mark = os.path.join(self.root, ".last_gc")
+        now = time.time()
+        try:
+            if now - os.stat(mark).st_mtime < self.gc_interval:
+                return
+        except OSError:
+            pass
+        try:
+            with open(mark, "w"):
+                pass
+        except OSError:
+            return
+        self.gc(now)
+
+    def gc(self, now: Optional[float] = None) -> int:
+        # ttl より長く触られていない下書きと、書きかけのまま残った一時ファイルを消す
+        cutoff = (now or time.time()) - self.ttl
+        removed = 0
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        with self._lock:
+            self.removed += removed
+        return removed
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.maybe_gc()
+            except Exception:
+                pass
+            time.sleep(self.gc_interval)
+
+    def ensure_started(self) -> None:
+        # プロセスごとに 1 本（gunicorn の fork 後にも動くよう、最初のリクエストで起こす）
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._loop, name="draft-gc", daemon=True).start()
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "removed": self.removed, "released": self.released}
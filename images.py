@@ -0,0 +1,219 @@
+import os
+import json
+import sqlite3
+import secrets
+import time
+import threading
+from typing import Optional
+
+
+# 画像 ID の範囲。本文の [uploadedimage:ID] は 4〜8 桁の数字を ID として扱う（parser.UploadIndex）ので、
+# 旧来と同じ 6 桁のランダムから始め、使っている ID が ID_DENSITY を超えたら 7 桁、8 桁へ広げる。
+# /image/<ID> は限定公開の画像も出すので、数え上げで当たらないよう ID はまばらで予測できないこと
+ID_MIN = 100000
+ID_MAX = 99999999
+ID_DENSITY = 0.01
+
+
+# ---------- 画像レコード（SQLite） ----------
+# uploads.json の代わり。1 画像 1 行で、レコードはそのままの形（JSON）で持ち、
+# 絞り込みに使う owner / visibility / deleted_at / ts だけ列にして索引を張る。
+# 書き込みのたびに meta.gen を 1 つ進めるので、他のプロセスも stamp() だけで変更に気づける。
+# ID は secrets で引いたランダムで、重なったら引き直す。確認と挿入は同じトランザクションなのでワーカー間でも重ならない
+class ImageStore:
+    def __init__(self, path: str, json_path: Optional[str] = None):
+        self.path = path
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                id TEXT PRIMARY KEY,
+                owner TEXT,
+                visibility TEXT NOT NULL DEFAULT 'private',
+                deleted_at INTEGER,
+                ts INTEGER NOT NULL DEFAULT 0,
+                rec TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_owner ON images (owner, deleted_at, ts);
+            CREATE INDEX IF NOT EXISTS images_visibility ON images (visibility, deleted_at, ts);
+            CREATE INDEX IF NOT EXISTS images_ts ON images (ts);
+            CREATE INDEX IF NOT EXISTS images_deleted ON images (deleted_at);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('gen', 0);
+            """
+        )
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)", (int(time.time()),))
+        if json_path:
+            self._migrate(json_path)
+
+    def _db(self) -> sqlite3.Connection:
+        # スレッドごとに 1 接続（fork 後は作り直す）。自動コミットで、書き込みは BEGIN IMMEDIATE で囲む
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(db)
+            db.execute("UPDATE meta SET value = value + 1 WHERE key = 'gen'")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _row(img_id: str, rec: dict) -> tuple:
+        return (
+            img_id,
+            rec.get("owner"),
+            rec.get("visibility") or "private",
+            rec.get("deleted_at") or None,        # アプリ側は真偽で判定している
+            int(rec.get("ts") or 0),
+            json.dumps(rec, ensure_ascii=False),
+        )
+
+    def _migrate(self, json_path: str) -> None:
+        # 初回だけ uploads.json を取り込む（ファイルは残す）。複数ワーカーが同時に来ても 1 回だけ
+        def run(db):
+            if db.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                return
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    raw = f.read().strip()
+                data = json.loads(raw) if raw else {}
+            except (OSError, ValueError):
+                data = {}
+            if isinstance(data, dict):
+                db.executemany(
+                    "INSERT OR IGNORE INTO images (id, owner, visibility, deleted_at, ts, rec) VALUES (?, ?, ?, ?, ?, ?)",
+                    [self._row(str(k), v) for k, v in data.items() if isinstance(v, dict)],
+                )
+            db.execute("INSERT INTO meta (key, value) VALUES ('migrated', 1)")
+        if not self._db().execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            self._write(run)
+
+    # ----- 読み取り -----
+    def stamp(self) -> int:
+        return self._db().execute("SELECT value FROM meta WHERE key = 'gen'").fetchone()[0]
+
+    def get(self, img_id: str) -> Optional[dict]:
+        row = self._db().execute("SELECT rec FROM images WHERE id = ?", (img_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, ids) -> dict:
+        ids = list(dict.fromkeys(ids))
+        out = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for img_id, rec in self._db().execute(f"SELECT id, rec FROM images WHERE id IN ({marks})", chunk):
+                out[img_id] = json.loads(rec)
+        return out
+
+    def _list(self, where: str, args: tuple) -> list:
+        # [(id, rec)]（新しい順）
+        rows = self._db().execute(f"SELECT id, rec FROM images WHERE {where} ORDER BY ts DESC", args)
+        return [(img_id, json.loads(rec)) for img_id, rec in rows]
+
+    def by_owner(self, owner: str, include_deleted: bool = False) -> list:
+        if include_deleted:
+            return self._list("owner = ?", (owner,))
+        return self._list("owner = ? AND deleted_at IS NULL", (owner,))
+
+    def public(self) -> list:
+        return self._list("visibility = 'public' AND deleted_at IS NULL", ())
+
+    def all(self) -> dict:
+        return {img_id: json.loads(rec) for img_id, rec in self._db().execute("SELECT id, rec FROM images")}
+
+    def count(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    # ----- ゴミ箱の整理（retention.TrashRetention から） -----
+    def trashed_before(self, cutoff: int, limit: int, offset: int = 0) -> list:
+        # cutoff より前にゴミ箱へ入れたもの [(id, rec)]（古い順に limit 件）
+        rows = self._db().execute(
+            "SELECT id, rec FROM images WHERE deleted_at < ? ORDER BY deleted_at LIMIT ? OFFSET ?",
+            (cutoff, limit, offset),
+        )
+        return [(img_id, json.loads(rec)) for img_id, rec in rows]
+
+    def created_at(self) -> int:
+        # このストアを作った時刻（これより前からゴミ箱にあるファイルは古い形式の残り）
+        return self._db().execute("SELECT value FROM meta WHERE key = 'created_at'").fetchone()[0]
+
+    def trash_paths(self) -> set:
+        # ゴミ箱にあるレコードが指している trash/uploads のファイル名
+        rows = self._db().execute("SELECT rec FROM images WHERE deleted_at IS NOT NULL")
+        return {json.loads(rec).get("trash_path") for rec, in rows} - {None}
+
+    def delete(self, ids) -> int:
+        ids = list(ids)
+        return self._write(lambda db: db.executemany("DELETE FROM images WHERE id = ?", [(i,) for i in ids]).rowcount)
+
+    def compact(self) -> bool:
+        # WAL を本体に書き戻して切り詰め、空きページが 1/4 を超えていたら VACUUM する。VACUUM したら True
+        db = self._db()
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = db.execute("PRAGMA page_count").fetchone()[0]
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages and free * 4 > pages:
+            db.execute("VACUUM")
+            return True
+        return False
+
+    # ----- 書き込み -----
+    def put(self, img_id: str, rec: dict) -> None:
+        self._write(lambda db: db.execute(
+            "INSERT OR REPLACE INTO images (id, owner, visibility, deleted_at, ts, rec) VALUES (?, ?, ?, ?, ?, ?)",
+            self._row(img_id, rec),
+        ))
+
+    @staticmethod
+    def _id_range(count: int) -> tuple:
+        # 使っている ID が ID_DENSITY 以下に収まる一番短い桁の範囲（8 桁で頭打ち）
+        lo = ID_MIN
+        while lo * 10 <= ID_MAX and count >= (lo * 10 - lo) * ID_DENSITY:
+            lo *= 10
+        return lo, min(lo * 10 - 1, ID_MAX)
+
+    def insert(self, rec: dict, attempts: int = 64) -> str:
+        # ランダムな ID で追加して ID を返す。使用中なら引き直す
+        def run(db):
+            lo, hi = self._id_range(db.execute("SELECT COUNT(*) FROM images").fetchone()[0])
+            for _ in range(attempts):
+                img_id = str(lo + secrets.randbelow(hi - lo + 1))
+                if not db.execute("SELECT 1 FROM images WHERE id = ?", (img_id,)).fetchone():
+                    break
+            else:
+                raise RuntimeError("image id space exhausted")
+            db.execute(
+                "INSERT INTO images (id, owner, visibility, deleted_at, ts, rec) VALUES (?, ?, ?, ?, ?, ?)",
+                self._row(img_id, rec),
+            )
+            return img_id
+        return self._write(run)
+
+    def update(self, img_id: str, **fields) -> Optional[dict]:
+        # フィールドを書き換えたレコードを返す。無ければ None
+        def run(db):
+            row = db.execute("SELECT rec FROM images WHERE id = ?", (img_id,)).fetchone()
+            if not row:
+                return None
+            rec = json.loads(row[0])
+            rec.update(fields)
+            db.execute(
+                "UPDATE images SET owner = ?, visibility = ?, deleted_at = ?, ts = ?, rec = ? WHERE id = ?",
+                self._row(img_id, rec)[1:] + (img_id,),
+            )
+            return rec
+        return self._write(run)
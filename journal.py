@@ -0,0 +1,271 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:          # Windows など。プロセス内の排他だけになる
+    fcntl = None
+
+
+# ---------- 追記型ジャーナル ----------
+# JSON ストア（dict）を「スナップショット <path> + 変更の追記ログ <path>.journal」で持つ。
+# 書き込みは変更を 1 行追記するだけで、ファイル全体の読み直し・書き直しをしない。
+# プロセス間は <path>.lock の flock で排他し（読み手は共有、書き手は排他）、同じプロセスで
+# 同時に来た書き込みはまとめて 1 回の write + fsync にする（グループコミット）。
+# ジャーナルが compact_every 行を超えたらスナップショットに畳み込む。
+# 変更は {"op": "set" | "del", "path": [キー, ...], "value": ...} で、何度当て直しても結果が同じ
+def apply_op(data: dict, op: dict, copy: bool = True) -> dict:
+    # copy=True ではたどった dict だけ作り直す（data() で渡した dict を書き換えない）
+    path = op.get("path") or []
+    if not path:
+        return op.get("value") if op.get("op") == "set" else {}
+    root = dict(data) if copy else data
+    node = root
+    for key in path[:-1]:
+        child = node.get(key)
+        if not isinstance(child, dict):
+            child = {}
+        elif copy:
+            child = dict(child)
+        node[key] = child
+        node = child
+    if op.get("op") == "set":
+        node[path[-1]] = op.get("value")
+    else:
+        node.pop(path[-1], None)
+    return root
+
+
+def _ident(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class _Pending:
+    __slots__ = ("ops", "check", "done", "error")
+
+    def __init__(self, ops: list, check):
+        self.ops = ops
+        self.check = check
+        self.done = False
+        self.error = None
+
+
+class JournalStore:
+    def __init__(
+        self,
+        path: str,
+        default: Optional[Callable[[], dict]] = None,
+        normalize: Optional[Callable[[dict], dict]] = None,
+        compact_every: int = 1000,
+        fsync: bool = True,
+    ):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.default = default or dict
+        self.normalize = normalize
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.commits = 0                   # 書き込んだ変更の数
+        self.flushes = 0                   # 実際の write + fsync の回数（commits より少なければまとまっている）
+        self.compactions = 0
+        self._lock = threading.RLock()     # プロセス内の排他（flock はプロセス単位なので別に要る）
+        self._cv = threading.Condition()
+        self._queue = []
+        self._leader = False
+        self._lock_fd = None
+        self._lock_pid = None
+        self._data = None
+        self._stamp = None                 # (スナップショット, ジャーナル) の _ident
+        self._offset = 0                   # ジャーナルのどこまで読んだか
+        self._entries = 0                  # ジャーナルの行数
+
+    # ----- ロック -----
+    def _flock(self, mode):
+        if self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_fd, mode)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            self._flock(fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                self._flock(fcntl.LOCK_UN)
+
+    # ----- 読み込み -----
+    def _load_snapshot(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = f.read().strip()
+            data = json.loads(raw) if raw else self.default()
+        except (OSError, ValueError):
+            data = self.default()
+        if not isinstance(data, dict):
+            data = self.default()
+        return self.normalize(data) if self.normalize else data
+
+    def _catch_up(self, writer: bool = False) -> None:
+        # ロックを持った状態で呼ぶ。スナップショットかジャーナルが差し替わっていれば読み直し、
+        # そうでなければジャーナルの続きだけを当てる
+        snap, jour = _ident(self.path), _ident(self.journal_path)
+        torn = writer and jour and jour[1] > self._offset      # 読み手が残した書きかけの行
+        if self._data is not None and (snap, jour) == self._stamp and not torn:
+            return
+        old_snap, old_jour = self._stamp or (None, None)
+        reload = (
+            self._data is None
+            or snap != old_snap                                 # 畳み込まれた（か外から書き換えられた）
+            or (jour and old_jour and jour[0] != old_jour[0])   # ジャーナルが差し替わった
+            or (jour[1] if jour else 0) < self._offset
+        )
+        if reload:
+            self._data = self._load_snapshot()
+            self._offset = 0
+            self._entries = 0
+
+        if jour and jour[1] > self._offset:
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                for op in entry.get("ops", []):
+                    self._data = apply_op(self._data, op, copy=not reload)
+                self._entries += 1
+            self._offset += end
+            if writer and end < len(chunk):
+                # 書きかけで落ちた行は捨てる（この後ろに追記すると壊れるため）
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(self._offset)
+        self._stamp = (_ident(self.path), _ident(self.journal_path))
+
+    def data(self) -> dict:
+        # 現在の内容（読み取り専用として扱うこと）。変化が無ければ stat 2 回だけ
+        if self._data is not None and (_ident(self.path), _ident(self.journal_path)) == self._stamp:
+            return self._data
+        with self._locked(exclusive=False):
+            self._catch_up()
+            return self._data
+
+    # ----- 書き込み -----
+    def commit(self, ops: list, check: Optional[Callable[[dict], None]] = None) -> None:
+        # ops をまとめて 1 行で追記する（全部当たるか、全部当たらないか）。
+        # check(data) は排他ロックの中で最新の内容に対して呼ばれ、例外を投げればこの変更だけ取りやめる
+        item = _Pending(list(ops), check)
+        with self._cv:
+            self._queue.append(item)
+            while not item.done and self._leader:
+                self._cv.wait()
+            if item.done:
+                if item.error:
+                    raise item.error
+                return
+            self._leader = True
+
+        # 先頭の 1 本が、待っている間に溜まった分もまとめて書く
+        try:
+            while True:
+                with self._cv:
+                    batch, self._queue = self._queue, []
+                if not batch:
+                    break
+                self._flush(batch)
+                with self._cv:
+                    for it in batch:
+                        it.done = True
+                    self._cv.notify_all()
+        finally:
+            with self._cv:
+                self._leader = False
+                self._cv.notify_all()
+        if item.error:
+            raise item.error
+
+    def _flush(self, batch: list) -> None:
+        try:
+            with self._locked(exclusive=True):
+                self._catch_up(writer=True)
+                lines = []
+                for it in batch:
+                    try:
+                        if it.check:
+                            it.check(self._data)
+                    except Exception as e:
+                        it.error = e
+                        continue
+                    for op in it.ops:
+                        self._data = apply_op(self._data, op)
+                    lines.append(json.dumps({"ops": it.ops}, ensure_ascii=False) + "\n")
+                if not lines:
+                    return
+                try:
+                    with open(self.journal_path, "ab") as f:
+                        f.write("".join(lines).encode("utf-8"))
+                        f.flush()
+                        if self.fsync:
+                            os.fsync(f.fileno())
+                except BaseException:
+                    self._data = None          # 書けなかった変更を当てた状態を捨てる（次で読み直す）
+                    raise
+                self._offset += len("".join(lines).encode("utf-8"))
+                self._entries += len(lines)
+                self._stamp = (_ident(self.path), _ident(self.journal_path))
+                self.commits += len(lines)
+                self.flushes += 1
+                if self._entries >= self.compact_every:
+                    self._compact()
+        except Exception as e:
+            for it in batch:
+                if it.error is None:
+                    it.error = e
+
+    # ----- 畳み込み -----
+    def _compact(self) -> None:
+        # 排他ロックの中で呼ぶ。スナップショットを書き換えてからジャーナルを空のものに差し替える。
+        # 間で落ちてもジャーナルの当て直しは結果が変わらないので、次の読み込みで元に戻る
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        tmp = f"{self.journal_path}.{os.getpid()}.tmp"
+        open(tmp, "wb").close()
+        os.replace(tmp, self.journal_path)
+        self._offset = 0
+        self._entries = 0
+        self._stamp = (_ident(self.path), _ident(self.journal_path))
+        self.compactions += 1
+
+    def compact(self) -> None:
+        with self._locked(exclusive=True):
+            self._catch_up(writer=True)
+            if self._entries:
+                self._compact()
+
+    def stats(self) -> dict:
+        return {
+            "commits": self.commits,
+            "flushes": self.flushes,
+            "compactions": self.compactions,
+            "journal_entries": self._entries,
+        }
@@ -1,9 +1,12 @@
 print(">> parser loaded:", __file__)
 
-import re, os, json, base64, mimetypes
-from typing import Optional
+import re, os, io, stat, json, shutil, base64, mimetypes, hashlib, threading, mmap, multiprocessing, zipfile
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
 from html import escape
-from urllib.parse import quote
+from urllib.parse import quote, unquote
 
 
 # ---------- 正規表現 ----------
@@ -15,9 +18,13 @@ RE_JUMP_INL = re.compile(r'\[jump:(\d+)\]')
 RE_JUMPURI  = re.compile(r'\[\[jumpuri:(.*?)\s*(?:>|&gt;)\s*(.*?)\]\]')
 RE_RUBY     = re.compile(r'\[\[rb:(.*?)\s*(?:>|&gt;)\s*(.*?)\]\]')
 RE_CHAPTER = re.compile(r'^\[chapter:(.+?)\]\s*', re.MULTILINE)
+RE_BLOCK_SPLIT = re.compile(r'(?=^\s*\[chapter:[^\]]+\])', re.M)
+RE_BLANK_RUN   = re.compile(r'\n{3,}')
+RE_PAGE_CHAPTER = re.compile(r'\s*\[chapter:(.+?)\]')
 
 BASE_DIR   = os.path.dirname(__file__)
-UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+DATA_DIR   = os.getenv("DATA_DIR") or BASE_DIR     # uploads/ などの置き場所（app.py と同じ）
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
 DB_PATH    = os.path.join(UPLOAD_DIR, "uploads.json")
 
 # ---------- 前処理 ----------
@@ -35,26 +42,160 @@ def split_pages(text: str):
     return [p.rstrip() for p in parts]
 
 # ---------- アップロード画像解決 ----------
+class _StoreView(Mapping):
+    # ストア使用時に snapshot() が返す読み取り専用の dict 相当。引いたレコードは同じ版の間だけ覚えておく
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, key):
+        rec = self._index._records((key,)).get(key)
+        if rec is None:
+            raise KeyError(key)
+        return rec
+
+    def __iter__(self):
+        return iter(self._index._store.all())
+
+    def __len__(self):
+        return self._index._store.count()
+
+
+class UploadIndex:
+    # 画像レコードの読み口。既定は uploads.json のメモリ上の写しで、(mtime_ns, size) が変わったときだけ読み直す。
+    # use_store() で画像ストア（images.ImageStore）に切り替えると、版はストアの stamp() で見て、
+    # レコードは要る ID だけ引く（同じ版の間は覚えておく）。画像ファイルの存在確認も同じ版の間は使い回す
+    def __init__(self, path: str, upload_dir: str):
+        self.path = path
+        self.upload_dir = upload_dir
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._stamp = None
+        self._gen = 0
+        self._db = {}
+        self._exists = {}
+        self._store = None
+
+    def use_store(self, store) -> None:
+        # store は stamp() / get_many(ids) / all() / count() を持つもの
+        with self._lock:
+            self._store = store
+            self._loaded = False
+
+    def _refresh(self) -> None:
+        # 呼び出し側でロックを持つこと
+        if self._store is not None:
+            stamp = ("store", self._store.stamp())
+            if self._loaded and stamp == self._stamp:
+                return
+            self._db = {}                  # ID → レコード（無い ID は None）の覚え書き
+            self._stamp = stamp
+            self._exists = {}
+            self._gen += 1
+            self._loaded = True
+            self.reloads += 1
+            return
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if self._loaded and stamp == self._stamp:
+            return
+        db = {}
+        if stamp is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    raw = f.read().strip()
+                db = json.loads(raw) if raw else {}
+            except Exception:
+                db = {}
+        self._db = db if isinstance(db, dict) else {}
+        self._stamp = stamp
+        self._exists = {}
+        self._gen += 1
+        self._loaded = True
+        self.reloads += 1
+
+    def invalidate(self) -> None:
+        # 同じプロセスで書き込んだ直後に呼ぶ（mtime の粒度が粗いファイルシステム対策）
+        with self._lock:
+            self._loaded = False
+
+    def version(self) -> int:
+        # 読み直すたびに増える世代番号。ページキャッシュのキーに使う
+        with self._lock:
+            self._refresh()
+            return self._gen
+
+    def stamp(self):
+        # 読み込んだ uploads.json の (mtime_ns, size)、またはストアの版。世代番号と違ってプロセスをまたいで比べられる
+        with self._lock:
+            self._refresh()
+            return self._stamp
+
+    def snapshot(self):
+        # 共有の dict（ストア使用時は読み取り専用の Mapping）をそのまま返す。呼び出し側は変更しないこと
+        with self._lock:
+            self._refresh()
+            return self._db if self._store is None else _StoreView(self)
+
+    def load(self) -> dict:
+        # 書き換えて保存する用のコピー（レコード単位で複製）
+        if self._store is not None:
+            return self._store.all()
+        return {k: dict(v) if isinstance(v, dict) else v for k, v in self.snapshot().items()}
+
+    def _records(self, ids) -> dict:
+        # 呼び出し時点の版でのレコード（ID → レコード、無い ID は None）
+        with self._lock:
+            self._refresh()
+            db, store = self._db, self._store
+            missing = [i for i in dict.fromkeys(ids) if i not in db]
+        if store is not None and missing:
+            found = store.get_many(missing)
+            with self._lock:
+                for i in missing:
+                    db[i] = found.get(i)
+        return db
+
+    def resolve_many(self, tokens) -> dict:
+        # [uploadedimage:*] のトークン（生の文字列）→ (src, alt)。鮮度確認は 1 回で済ませる
+        tokens = list(tokens)
+        ids = [t.strip() for t in tokens]
+        db = self._records([i for i in ids if i.isdigit() and 4 <= len(i) <= 8])
+        with self._lock:
+            exists = self._exists
+        out = {}
+        for token in tokens:
+            if token not in out:
+                out[token] = self._resolve(db, exists, token)
+        return out
+
+    def _resolve(self, db: dict, exists: dict, token: str) -> tuple[str, str]:
+        token = token.strip()
+        if token.isdigit() and 4 <= len(token) <= 8:
+            rec = db.get(token)
+            if rec:
+                stored = rec.get("stored_name", "")
+                if stored:
+                    ok = exists.get(stored)
+                    if ok is None:
+                        ok = exists[stored] = os.path.exists(os.path.join(self.upload_dir, stored))
+                    if ok:
+                        return f"/uploads/{stored}", token
+            return f"/image/{token}", token
+        return f"/uploads/{quote(token)}", token
+
+
+UPLOAD_INDEX = UploadIndex(DB_PATH, UPLOAD_DIR)
+
+
 def _load_upload_db():
-    try:
-        with open(DB_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return UPLOAD_INDEX.snapshot()
 
 def _resolve_uploaded_src(token: str) -> tuple[str, str]:
-    token = token.strip()
-    db = _load_upload_db()
-    if token.isdigit() and 4 <= len(token) <= 8:
-        rec = db.get(token)
-        alt_name = token
-        if rec:
-            stored = rec.get("stored_name", "")
-            path = os.path.join(UPLOAD_DIR, stored)
-            if stored and os.path.exists(path):
-                return f"/uploads/{stored}", token
-        return f"/image/{token}", token
-    return f"/uploads/{quote(token)}", token
+    return UPLOAD_INDEX.resolve_many((token,))[token]
 
 
 def _render_pixiv_embed(pid: str, page: Optional[int] = None) -> str:
@@ -92,7 +233,79 @@ def _render_pixiv_embed(pid: str, page: Optional[int] = None) -> str:
 
 
 # ---------- インライン ----------
+def _bracket_pairs(s: str, opener: str):
+    # [[X:左 > 右]]（区切りは > か &gt;）を RE_RUBY / RE_JUMPURI の .sub と同じ規則で左から読み、
+    # (開始, 終了, 左, 右) を順に返す。成立しない開き括弧に当たったら (開始, None, None, None) を返して終わる
+    # （それ以降の開き括弧も成立しない）。s は改行を含まないこと。探した位置を覚えておくので全体で線形時間
+    n = len(s)
+    size = len(opener)
+    gt = amp = close = -1          # 直近に見つけた > / &gt; / ]] の位置（無ければ n より後ろ）
+    o = s.find(opener)
+    while o != -1:
+        a = o + size
+        if gt < a:
+            gt = s.find(">", a)
+            if gt == -1:
+                gt = n + 4
+        if amp < a:
+            amp = s.find("&gt;", a)
+            if amp == -1:
+                amp = n + 4
+        if gt < amp:
+            r, q = gt, gt + 1
+        elif amp <= n:
+            r, q = amp, amp + 4
+        else:
+            yield o, None, None, None
+            return
+        if close < q:
+            close = s.find("]]", q)
+            if close == -1:
+                close = n + 4
+        if close > n:
+            yield o, None, None, None
+            return
+        yield o, close + 2, s[a:r].rstrip(), s[q:close].lstrip()
+        o = s.find(opener, close + 2)
+
+
+def _sub_bracket_pairs(text: str, opener: str, fmt) -> str:
+    out = []
+    pos = 0
+    for start, end, a, b in _bracket_pairs(text, opener):
+        if end is None:
+            break
+        out.append(text[pos:start])
+        out.append(fmt(a, b))
+        pos = end
+    if not out:
+        return text
+    out.append(text[pos:])
+    return "".join(out)
+
+
 def render_inline(text: str) -> str:
+    # ルビ → リンク → ページジャンプの順に置換する。
+    # 改行を含む場合は \s* が改行をまたげるので正規表現版に任せる（段落はすでに <br> 化されている）
+    if "\n" in text:
+        return _render_inline_regex(text)
+    if "[[rb:" in text:
+        text = _sub_bracket_pairs(text, "[[rb:", lambda a, b: f'<ruby>{a}<rt>{b}</rt></ruby>')
+    if "[[jumpuri:" in text:
+        text = _sub_bracket_pairs(
+            text, "[[jumpuri:",
+            lambda a, b: f'<a href="{b}" target="_blank" rel="noopener noreferrer">{a}</a>',
+        )
+    if "[jump:" in text:
+        text = RE_JUMP_INL.sub(
+            lambda m: f'<a class="jump" href="#{m.group(1)}" data-jump="{m.group(1)}">{m.group(1)}ページへ</a>',
+            text
+        )
+    return text
+
+
+def _render_inline_regex(text: str) -> str:
+    # 元の実装。開き括弧だけが大量にあると .*? の探索で二乗時間になる
     def rb_sub(m):
         return f'<ruby>{m.group(1)}<rt>{m.group(2)}</rt></ruby>'
     text = RE_RUBY.sub(rb_sub, text)
@@ -197,17 +410,874 @@ def render_block(block: str, page_index: int) -> str:
 
 
 
+# ---------- 構文木 ----------
+# tokenize_document() が返す木。インラインの地の文はエスケープ済みの str で持つ。
+class Jump(NamedTuple):
+    target: str
+
+class Ruby(NamedTuple):
+    base: list
+    rt: list
+
+class JumpUri(NamedTuple):
+    label: list
+    href: list
+
+class Chapter(NamedTuple):
+    title: str
+
+class Paragraph(NamedTuple):
+    children: list
+
+class BlankLine(NamedTuple):
+    pass
+
+class UploadedImage(NamedTuple):
+    token: str
+
+class PixivImage(NamedTuple):
+    pid: str
+    page: Optional[int]
+
+class Block(NamedTuple):
+    children: list
+
+class Page(NamedTuple):
+    index: int
+    text: str
+    blocks: list
+
+
+BLANK_LINE = BlankLine()
+EMPTY_BLOCK = Block([BLANK_LINE])      # 空白行が続くと空のブロックが大量にできるので共有する
+BLANKLINE_HTML = '<div class="blankline" aria-hidden="true"></div>'
+
+
+# ---------- トークナイザ（ブロック） ----------
+def _chapter_tags(text: str):
+    # [chapter:X] の (開始, 終了) 一覧（正規表現 \[chapter:[^\]]+\] と同じく、X は次の ] まで。改行も含みうる）
+    tags = []
+    close = -1
+    k = text.find("[chapter:")
+    while k != -1:
+        if close < k + 9:
+            close = text.find("]", k + 9)
+            if close == -1:
+                break                      # 以降に ] が無いのでタグは成立しない
+        if close > k + 9:
+            tags.append((k, close + 1))
+        k = text.find("[chapter:", k + 1)
+    return tags
+
+
+def _insert_chapter_breaks(text: str, tags) -> str:
+    # _preprocess の 3 つの置換と同じ位置に改行を差し込む
+    n = len(text)
+    inserts = {}
+
+    # (1) 直前の空白列に改行を含むタグ → その最初の改行を二重に
+    pos = 0
+    for k, e in tags:
+        if k < pos:
+            continue
+        j = k
+        while j > 0 and text[j - 1].isspace():
+            j -= 1
+        p = text.find("\n", j, k)
+        if p != -1:
+            inserts[p] = "\n"
+            pos = e
+
+    # (2) タグ直後が非空白 → 空行を挟む
+    pos = 0
+    for k, e in tags:
+        if k < pos:
+            continue
+        if e < n and not text[e].isspace():
+            inserts[e] = "\n\n"
+            pos = e + 1
+
+    # (3) タグ + 改行 + 非空白 → 空行を挟む
+    pos = 0
+    for k, e in tags:
+        if k < pos:
+            continue
+        if (e + 1 < n and text[e] == "\n" and e not in inserts
+                and not text[e + 1].isspace()):
+            inserts[e] = "\n"
+            pos = e + 2
+
+    if not inserts:
+        return text
+    parts = []
+    last = 0
+    for p in sorted(inserts):
+        parts.append(text[last:p])
+        parts.append(inserts[p])
+        last = p
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def _split_blocks(raw: str):
+    # RE_BLOCK_SPLIT と同じ位置（空白行に続く章タグ行の各行頭）で分割する。
+    # 章タグの閉じ括弧が後ろの行にあってもよい（タグの位置は _chapter_tags で一度に求める）
+    if "[chapter:" not in raw:
+        return [raw] if raw else []
+    tag_starts = {k for k, _ in _chapter_tags(raw)}
+    lines = raw.split("\n")
+    offsets = []
+    off = 0
+    for line in lines:
+        offsets.append(off)
+        off += len(line) + 1
+    starts = []
+    follows = False
+    for i in range(len(lines) - 1, 0, -1):
+        line = lines[i]
+        if "[chapter:" in line and offsets[i] + len(line) - len(line.lstrip()) in tag_starts:
+            follows = True
+        elif line and not line.isspace():
+            follows = False
+        if follows:
+            starts.append(i)
+    starts.append(0)
+    starts.reverse()
+    starts.append(len(lines))
+    return ["\n".join(lines[a:b]) for a, b in zip(starts, starts[1:])]
+
+
+def _page_texts(text: str):
+    # _preprocess + split_pages と同じページ本文（正規表現を使わないので入力に対して線形時間）
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if "[chapter:" in text:
+        text = _insert_chapter_breaks(text, _chapter_tags(text))
+    return split_pages(text)
+
+
+def _tokenize_block(s: str) -> Block:
+    # render_block と同じ規則で 1 ブロックを木にする（s は末尾の改行を除いたもの）
+    if not s:
+        return EMPTY_BLOCK
+    children = []
+    if s.startswith("[chapter:"):
+        end = s.find("]")
+        if end != -1:
+            children.append(Chapter(s[len("[chapter:"):end]))
+            s = s[end + 1:].lstrip("\n ")
+            if "\n\n\n" in s:
+                s = RE_BLANK_RUN.sub("\n\n", s)
+            if not s.strip():
+                children.append(BLANK_LINE)
+                return Block(children)
+
+    buf = []
+    for line in s.split("\n"):
+        if not line:
+            if buf:
+                children.append(_tokenize_paragraph(buf))
+                buf = []
+            children.append(BLANK_LINE)
+            continue
+        if "[" in line:
+            stripped = line.strip()
+            if stripped.startswith("[uploadedimage:") and stripped.endswith("]") and len(stripped) > 15:
+                if buf:
+                    children.append(_tokenize_paragraph(buf))
+                    buf = []
+                children.append(UploadedImage(stripped[len("[uploadedimage:"):-1]))
+                continue
+            if stripped.startswith("[pixivimage:"):
+                m = RE_PIXIV.match(stripped)
+                if m:
+                    if buf:
+                        children.append(_tokenize_paragraph(buf))
+                        buf = []
+                    children.append(PixivImage(m.group(1), int(m.group(2)) if m.group(2) else None))
+                    continue
+        buf.append(line)
+    if buf:
+        children.append(_tokenize_paragraph(buf))
+    return Block(children)
+
+
+def _tokenize_paragraph(lines) -> Paragraph:
+    esc = escape("\n".join(lines)).replace("\n", "<br>")
+    return Paragraph(_tokenize_inline(esc))
+
+
+# ---------- トークナイザ（インライン） ----------
+def _tokenize_jumps(s: str, out: list) -> list:
+    pos = 0
+    n = len(s)
+    i = s.find("[jump:")
+    while i != -1:
+        j = i + 6
+        while j < n and s[j].isdecimal():
+            j += 1
+        if j > i + 6 and j < n and s[j] == "]":
+            if i > pos:
+                out.append(s[pos:i])
+            out.append(Jump(s[i + 6:j]))
+            pos = j + 1
+            i = s.find("[jump:", pos)
+        else:
+            i = s.find("[jump:", i + 1)
+    if pos < n:
+        out.append(s[pos:])
+    return out
+
+
+def _tokenize_inline(s: str) -> list:
+    # エスケープ済みの段落（改行を含まない）を、ルビ → リンク → ページジャンプの順に
+    # 置換した場合と同じ結果になるよう 1 回の走査で読む。ルビとリンクが重なる場合は render_inline に任せる。
+    # 地の文は str のまま並べる。
+    if "[" not in s:
+        return [s]
+    if "[[" not in s:
+        return _tokenize_jumps(s, [])
+    jumps = "[jump:" in s
+    out = []
+    pos = 0
+    if not jumps and "[[jumpuri:" not in s:
+        # ルビだけの段落（いちばん多い形）
+        append = out.append
+        for start, end, a, b in _bracket_pairs(s, "[[rb:"):
+            if end is None:
+                break
+            if pos < start:
+                append(s[pos:start])
+            append(Ruby([a], [b]))
+            pos = end
+        if pos < len(s):
+            append(s[pos:])
+        return out
+
+    # ルビの置換結果にはリンクの区切りになりうる > や ]] が入るので、
+    # リンクがルビと重なるか、成立しないリンクの後ろにルビが残る場合は render_inline に任せる
+    rbs = _bracket_pairs(s, "[[rb:")
+    jus = _bracket_pairs(s, "[[jumpuri:")
+    rb = next(rbs, None)
+    ju = next(jus, None)
+    if rb is not None and rb[1] is None:
+        rb = None
+    while rb is not None or ju is not None:
+        if ju is not None and ju[1] is None:
+            if rb is not None:
+                return [render_inline(s)]
+            ju = None
+            continue
+        if ju is None or (rb is not None and rb[0] < ju[0]):
+            start, end, a, b = rb
+            if ju is not None and ju[0] < end:
+                return [render_inline(s)]
+            kind = Ruby
+            rb = next(rbs, None)
+            if rb is not None and rb[1] is None:
+                rb = None                  # これ以降のルビも成立しない
+        else:
+            start, end, a, b = ju
+            if rb is not None and rb[0] < end:
+                return [render_inline(s)]
+            kind = JumpUri
+            ju = next(jus, None)
+        if jumps:
+            _tokenize_jumps(s[pos:start], out)
+            out.append(kind(_tokenize_jumps(a, []), _tokenize_jumps(b, [])))
+        else:
+            if pos < start:
+                out.append(s[pos:start])
+            out.append(kind([a], [b]))
+        pos = end
+    if pos < len(s):
+        if jumps:
+            _tokenize_jumps(s[pos:], out)
+        else:
+            out.append(s[pos:])
+    return out
+
+
+def tokenize_page(raw: str, index: int = 1) -> Page:
+    return Page(index, raw, [_tokenize_block(b.rstrip("\n")) for b in _split_blocks(raw)])
+
+
+def tokenize_document(text: str) -> list:
+    return [tokenize_page(raw, i) for i, raw in enumerate(_page_texts(text), start=1)]
+
+
+# ---------- HTML出力（構文木） ----------
+def _emit_inline(nodes) -> str:
+    out = []
+    for node in nodes:
+        kind = type(node)
+        if kind is str:
+            out.append(node)
+        elif kind is Jump:
+            t = node.target
+            out.append(f'<a class="jump" href="#{t}" data-jump="{t}">{t}ページへ</a>')
+        else:
+            a, b = node
+            a = a[0] if len(a) == 1 and type(a[0]) is str else _emit_inline(a)
+            b = b[0] if len(b) == 1 and type(b[0]) is str else _emit_inline(b)
+            if kind is Ruby:
+                out.append(f'<ruby>{a}<rt>{b}</rt></ruby>')
+            else:
+                out.append(f'<a href="{b}" target="_blank" rel="noopener noreferrer">{a}</a>')
+    return "".join(out)
+
+
+def _emit_uploaded(token: str, srcs: dict) -> str:
+    src, alt = srcs[token]
+    if src.startswith("/image/") and alt == token:
+        return (
+            '<figure class="illustration missing"><div class="img-missing">'
+            f'画像が見つかりません: {escape(alt)}</div></figure>'
+        )
+    return f'<figure class="illustration"><img src="{src}" alt="{escape(alt)}"></figure>'
+
+
+def _emit_block(block: Block, srcs: dict) -> str:
+    if block is EMPTY_BLOCK:
+        return BLANKLINE_HTML
+    out = []
+    for node in block.children:
+        kind = type(node)
+        if kind is Paragraph:
+            children = node.children
+            if len(children) == 1 and type(children[0]) is str:
+                out.append(f"<p>{children[0]}</p>")
+            else:
+                out.append(f"<p>{_emit_inline(children)}</p>")
+        elif kind is BlankLine:
+            out.append(BLANKLINE_HTML)
+        elif kind is Chapter:
+            out.append(f'<h2 class="chapter">{escape(node.title)}</h2>')
+        elif kind is UploadedImage:
+            out.append(_emit_uploaded(node.token, srcs))
+        else:
+            out.append(_render_pixiv_embed(node.pid, node.page))
+    return "".join(out)
+
+
+def _uploaded_tokens(page: Page) -> list:
+    return [n.token for b in page.blocks for n in b.children if type(n) is UploadedImage]
+
+
+def render_page(page: Page, srcs: Optional[dict] = None) -> str:
+    # srcs は画像トークン → (src, alt)。省略時はこのページ分をまとめて解決する
+    if srcs is None:
+        tokens = _uploaded_tokens(page)
+        srcs = UPLOAD_INDEX.resolve_many(tokens) if tokens else {}
+    return "\n".join(_emit_block(b, srcs) for b in page.blocks)
+
+
+# ---------- ページ描画キャッシュ ----------
+class PageCache:
+    # 文字列値の LRU。件数と文字数の両方で上限を持つ。
+    # PAGE_CACHE は (ページ本文のハッシュ, アップロードDBの版) → 描画済み HTML、
+    # DATA_URI_CACHE は (パス, mtime_ns, size) → 画像の data URI、TOC_CACHE は本文のハッシュ → 目次の JSON
+    def __init__(self, max_entries: int = 4096, max_chars: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            html = self._data.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html: str) -> None:
+        if len(html) > self.max_chars:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._chars -= len(old)
+            self._data[key] = html
+            self._chars += len(html)
+            while len(self._data) > self.max_entries or self._chars > self.max_chars:
+                _, dropped = self._data.popitem(last=False)
+                self._chars -= len(dropped)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._chars = 0
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._data),
+                "chars": self._chars,
+                "max_entries": self.max_entries,
+                "max_chars": self.max_chars,
+            }
+
+
+PAGE_CACHE = PageCache()
+
+
+def _upload_db_version():
+    return UPLOAD_INDEX.version()
+
+
+def _page_key(raw: str, version):
+    return (hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest(), version)
+
+
+def _render_page_cached(raw: str, version) -> str:
+    key = _page_key(raw, version)
+    html = PAGE_CACHE.get(key)
+    if html is None:
+        html = render_page(tokenize_page(raw))
+        PAGE_CACHE.put(key, html)
+    return html
+
+
 # ---------- 文書 ----------
-def parse_document(text: str):
-    text = _preprocess(text)
-    pages_raw = split_pages(text)
-    pages = []
-    for i, raw in enumerate(pages_raw, start=1):
-        blocks = [b for b in re.split(r'(?=^\s*\[chapter:[^\]]+\])', raw, flags=re.M) if b != ""]
-        html_blocks = [render_block(b, i) for b in blocks]
-        pages.append({"index": i, "html": "\n".join(html_blocks), "text": raw})
-    return pages
+def parse_document(text: str, workers: int = 0):
+    # workers > 1 かつ十分に長い文書はプロセスプールで描画する（結果は直列と同じ）
+    if workers > 1 and len(text) >= PARALLEL_MIN_CHARS:
+        return [
+            {"index": i, "html": html, "text": raw}
+            for i, (raw, html) in enumerate(_render_pages(_page_texts(text), workers), start=1)
+        ]
+
+    version = _upload_db_version()
+    raws = _page_texts(text)
+    htmls = [None] * len(raws)
+    missed = []
+    for i, raw in enumerate(raws):
+        key = _page_key(raw, version)
+        html = PAGE_CACHE.get(key)
+        if html is None:
+            missed.append((i, key, tokenize_page(raw, i + 1)))
+        else:
+            htmls[i] = html
+
+    # キャッシュに無かったページの画像トークンは文書全体でまとめて解決する
+    if missed:
+        tokens = [t for _, _, page in missed for t in _uploaded_tokens(page)]
+        srcs = UPLOAD_INDEX.resolve_many(tokens) if tokens else {}
+        for i, key, page in missed:
+            htmls[i] = render_page(page, srcs)
+            PAGE_CACHE.put(key, htmls[i])
+
+    return [
+        {"index": i, "html": html, "text": raw}
+        for i, (raw, html) in enumerate(zip(raws, htmls), start=1)
+    ]
+
+
+def _page_result(raw: str, p: int, total: int) -> dict:
+    m = RE_PAGE_CHAPTER.match(raw)
+    return {
+        "index": p,
+        "html": _render_page_cached(raw, _upload_db_version()),
+        "text": raw,
+        "total": total,
+        "chapter": m.group(1) if m else None,
+    }
+
+
+def parse_page(text: str, p: int = 1) -> dict:
+    # ページ分割だけ全体に行い、描画は p ページ目のみ（p は 1..総ページ数 に丸める）
+    pages = _page_texts(text)
+    total = len(pages)
+    p = max(1, min(total, p))
+    return _page_result(pages[p - 1], p, total)
+
+
+# ---------- 文書（ストリーミング） ----------
+def _is_local_page(seg: str, last: bool) -> bool:
+    # seg（[newpage] で区切った 1 ページ分の生テキスト）を単独で前処理しても文書全体と同じになるか。
+    # 閉じ括弧が次の [newpage] まで無い章タグがあると、その ] まで 1 つのタグになるので全体に依存する
+    if last or "[chapter:" not in seg:
+        return True
+    return seg.find("]", seg.rfind("[chapter:") + 9) != -1
+
+
+def iter_document(source, chunk_size: int = 1 << 16, workers: int = 0):
+    # parse_document のストリーミング版。source は str / read() を持つテキストファイル / str チャンクの反復子。
+    # ページを 1 枚ずつ {"index", "html", "text"} で返し、結果は parse_document と同じ
+    pages = _render_pages(_iter_page_texts(source, chunk_size), workers)
+    for index, (raw, html) in enumerate(pages, start=1):
+        yield {"index": index, "html": html, "text": raw}
+
+
+def _iter_page_texts(source, chunk_size: int):
+    # _page_texts の逐次版。単独で処理できないページが現れたら、そこから後ろだけはまとめて読んで処理する
+    if isinstance(source, str):
+        chunks = (source,)
+    elif hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), "")
+    else:
+        chunks = source
+
+    sep = "[newpage]"
+    pending = []       # 現在のページの断片
+    carry = ""         # チャンク境界をまたぐ [newpage] 用に末尾 8 文字を持ち越す
+    tail = None        # 単独で処理できないページ以降の生テキスト
+
+    for chunk in chunks:
+        if tail is not None:
+            tail.append(chunk)
+            continue
+        data = carry + chunk
+        pos = 0
+        hit = data.find(sep)
+        while hit != -1:
+            pending.append(data[pos:hit])
+            seg = "".join(pending)
+            pending = []
+            pos = hit + len(sep)
+            if not _is_local_page(seg, last=False):
+                tail = [seg, sep, data[pos:]]
+                break
+            yield _page_texts(seg)[0]
+            hit = data.find(sep, pos)
+        if tail is not None:
+            carry = ""
+            continue
+        cut = max(pos, len(data) - (len(sep) - 1))
+        pending.append(data[pos:cut])
+        carry = data[cut:]
 
+    if tail is None:
+        pending.append(carry)
+        tail = ["".join(pending)]
+    yield from _page_texts("".join(tail))
+
+
+# ---------- 並列描画 ----------
+PARALLEL_MIN_CHARS = 1 << 20       # これより短い文書は直列のまま描画する
+PARALLEL_BATCH_PAGES = 32          # ワーカーへ 1 回で渡すページ数
+
+_POOL = None
+_POOL_KEY = None
+_POOL_LOCK = threading.Lock()
+
+
+def _init_render_worker(images_db: Optional[str]) -> None:
+    # ワーカー側の起動時。spawn した子は parser を読み直すだけなので、親が画像ストアに
+    # 切り替えていれば同じ images.db を開き直す（そのままだと uploads.json を引いてしまう）
+    if images_db:
+        from images import ImageStore
+        UPLOAD_INDEX.use_store(ImageStore(images_db))
+
+
+def _render_pool(workers: int) -> ProcessPoolExecutor:
+    global _POOL, _POOL_KEY
+    images_db = getattr(UPLOAD_INDEX._store, "path", None)
+    key = (workers, images_db)
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_KEY != key:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+            # fork だとスレッドが握っていたロックごと複製されるので spawn で起動する
+            _POOL = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_render_worker,
+                initargs=(images_db,),
+            )
+            _POOL_KEY = key
+        return _POOL
+
+
+def _drop_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False)
+        _POOL = None
+
+
+def _render_batch(raws: list) -> list:
+    # ワーカー側。画像トークンはこのバッチ分をまとめて解決する
+    pages = [tokenize_page(raw) for raw in raws]
+    tokens = [t for page in pages for t in _uploaded_tokens(page)]
+    srcs = UPLOAD_INDEX.resolve_many(tokens) if tokens else {}
+    return [render_page(page, srcs) for page in pages]
+
+
+def _render_pages(raws, workers: int = 0):
+    # ページ本文の反復子を描画して (raw, html) を順に返す。
+    # 直列で PARALLEL_MIN_CHARS 文字ぶん描画しても続くときだけ、残りをバッチに分けてプロセスプールに回す
+    version = _upload_db_version()
+    raws = iter(raws)
+    seen = 0
+    for raw in raws:
+        yield raw, _render_page_cached(raw, version)
+        seen += len(raw)
+        if workers > 1 and seen >= PARALLEL_MIN_CHARS:
+            break
+    else:
+        return
+
+    pool = _render_pool(workers)
+    inflight = deque()
+
+    def submit(batch):
+        # キャッシュ済みのページは親プロセスで埋め、残りだけワーカーに送る
+        keys = [_page_key(raw, version) for raw in batch]
+        htmls = [PAGE_CACHE.get(key) for key in keys]
+        todo = [raw for raw, html in zip(batch, htmls) if html is None]
+        job = None
+        if todo:
+            try:
+                job = pool.submit(_render_batch, todo)
+            except Exception:
+                job = _render_batch(todo)        # プールが使えなければこのバッチは自前で描画する
+        inflight.append((batch, keys, htmls, todo, job))
+
+    def drain():
+        batch, keys, htmls, todo, job = inflight.popleft()
+        if job is not None:
+            if isinstance(job, list):
+                rendered = job
+            else:
+                try:
+                    rendered = job.result()
+                except Exception:
+                    _drop_pool()                 # 壊れたプールは捨て、このバッチは自前で描画する
+                    rendered = _render_batch(todo)
+            done = iter(rendered)
+            for i, key in enumerate(keys):
+                if htmls[i] is None:
+                    htmls[i] = next(done)
+                    PAGE_CACHE.put(key, htmls[i])
+        return zip(batch, htmls)
+
+    batch = []
+    for raw in raws:
+        batch.append(raw)
+        if len(batch) >= PARALLEL_BATCH_PAGES:
+            submit(batch)
+            batch = []
+            if len(inflight) > workers * 2:
+                yield from drain()
+    if batch:
+        submit(batch)
+    while inflight:
+        yield from drain()
+
+
+# ---------- 保存ファイルのページ索引 ----------
+# [newpage] のバイト位置と章見出しの一覧（目次）を保存ファイルの横に置いておき、
+# 読むときは mmap から 1 ページ分だけ切り出す。索引は本文の (mtime_ns, size) で検証する
+PAGE_INDEX_VERSION = 2
+NEWPAGE_BYTES = b"[newpage]"
+TOC_CACHE = PageCache(256, 4 * 1024 * 1024)       # 本文のハッシュ → 目次の JSON（下書き用）
+
+
+def _page_chapters(raw: str, p: int) -> list:
+    # _tokenize_block が見出しにするのと同じ、ブロック先頭の章タグ
+    out = []
+    for block in _split_blocks(raw):
+        if block.startswith("[chapter:"):
+            end = block.find("]")
+            if end != -1:
+                out.append({"page": p, "title": block[len("[chapter:"):end]})
+    return out
+
+
+def _toc(pages: list) -> list:
+    return [c for p, raw in enumerate(pages, start=1) if "[chapter:" in raw for c in _page_chapters(raw, p)]
+
+
+def chapter_toc(text: str) -> dict:
+    # 目次 {total, chapters: [{page, title}]}。描画はしないので全文パースより軽く、結果は本文ごとに覚えておく
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    hit = TOC_CACHE.get(key)
+    if hit is not None:
+        return json.loads(hit)
+    pages = _page_texts(text)
+    toc = {"total": len(pages), "chapters": _toc(pages)}
+    TOC_CACHE.put(key, json.dumps(toc, ensure_ascii=False))
+    return toc
+
+
+def _page_spans(newpages: list, size: int) -> list:
+    starts = [0] + [off + len(NEWPAGE_BYTES) for off in newpages]
+    return list(zip(starts, newpages + [size]))
+
+
+def build_page_index(data: bytes) -> dict:
+    # data は UTF-8 の本文。不正なバイト列なら UnicodeDecodeError
+    text = data.decode("utf-8")
+    newpages = []
+    pos = data.find(NEWPAGE_BYTES)
+    while pos != -1:
+        newpages.append(pos)
+        pos = data.find(NEWPAGE_BYTES, pos + len(NEWPAGE_BYTES))
+
+    # ページごとに処理しても文書全体と同じページ本文になるか（ページをまたぐ章タグなどは不可）
+    whole = _page_texts(text)
+    sliced = [_page_texts(data[a:b].decode("utf-8"))[0] for a, b in _page_spans(newpages, len(data))]
+
+    return {
+        "version": PAGE_INDEX_VERSION,
+        "exact": sliced == whole,
+        "newpages": newpages,
+        "total": len(whole),
+        "chapters": _toc(whole),
+    }
+
+
+def write_page_index(path: str, index_path: str) -> Optional[dict]:
+    # path の本文から索引を作って index_path に書く。読めない本文なら何もしない
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        idx = build_page_index(data)
+    except (OSError, UnicodeDecodeError):
+        return None
+    idx["mtime_ns"] = st.st_mtime_ns
+    idx["size"] = st.st_size
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp = index_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(idx, f, ensure_ascii=False)
+    os.replace(tmp, index_path)
+    return idx
+
+
+def _load_page_index(index_path: str) -> Optional[dict]:
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            idx = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(idx, dict) or idx.get("version") != PAGE_INDEX_VERSION:
+        return None
+    return idx
+
+
+def read_page_toc(path: str, index_path: str) -> Optional[dict]:
+    # 索引に入れておいた目次 {total, chapters}。本文が索引より新しければ None
+    idx = _load_page_index(index_path)
+    if idx is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if (st.st_mtime_ns, st.st_size) != (idx.get("mtime_ns"), idx.get("size")):
+        return None
+    return {"total": idx.get("total", 1), "chapters": idx.get("chapters") or []}
+
+
+def read_indexed_page(path: str, index_path: str, p: int = 1) -> Optional[dict]:
+    # 索引が本文と一致するときだけ p ページ目を切り出して描画する。使えなければ None
+    idx = _load_page_index(index_path)
+    if idx is None or not idx.get("exact"):
+        return None
+
+    newpages = idx.get("newpages") or []
+    total = len(newpages) + 1
+    p = max(1, min(total, p))
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_mtime_ns, st.st_size) != (idx.get("mtime_ns"), idx.get("size")):
+                return None
+            start = newpages[p - 2] + len(NEWPAGE_BYTES) if p > 1 else 0
+            end = newpages[p - 1] if p <= len(newpages) else st.st_size
+            if end <= start:
+                chunk = b""
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    chunk = mm[start:end]
+        raw = _page_texts(chunk.decode("utf-8"))[0]
+    except (OSError, ValueError):
+        return None
+    return _page_result(raw, p, total)
+
+
+# ---------- 描画済みページの共有キャッシュ（ディスク） ----------
+class DiskPageCache:
+    # 公開作品の描画済みページを全ワーカーで共有する。<root>/<作品名のハッシュ>/<版>-<ページ>.html に置き、
+    # 版は (本文の mtime_ns, size, uploads.json の stamp) のハッシュ。版が変わったファイルは次に書くときに消す
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _dir(self, name: str) -> str:
+        return os.path.join(self.root, hashlib.blake2b(name.encode("utf-8"), digest_size=16).hexdigest())
+
+    def version(self, path: str) -> Optional[str]:
+        # 本文ファイル path の今の版。読めなければ None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = repr((st.st_mtime_ns, st.st_size, UPLOAD_INDEX.stamp())).encode("utf-8")
+        return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+    def get(self, name: str, version: str, p: int) -> Optional[str]:
+        try:
+            with open(os.path.join(self._dir(name), f"{version}-{p}.html"), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    html = ""
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        html = mm.read().decode("utf-8")
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return html
+
+    def put(self, name: str, version: str, p: int, html: str) -> None:
+        # 一時ファイルに書いてから置き換えるので、他のワーカーが書きかけを読むことはない
+        d = self._dir(name)
+        try:
+            os.makedirs(d, exist_ok=True)
+            for old in os.listdir(d):
+                if not old.startswith(version + "-"):
+                    try:
+                        os.remove(os.path.join(d, old))
+                    except OSError:
+                        pass
+            path = os.path.join(d, f"{version}-{p}.html")
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self.writes += 1
+
+    def invalidate(self, name: str) -> None:
+        shutil.rmtree(self._dir(name), ignore_errors=True)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "writes": self.writes,
+        }
 
 
 # ---------- 段落 ----------
@@ -239,64 +1309,156 @@ def _encode_file_to_data_uri(path: str) -> Optional[str]:
     return f"data:{mime};base64,{b64}"
 
 
-def _inline_export_assets(html_doc: str) -> str:
-    css_path = os.path.join(BASE_DIR, "static", "style.css")
-    if os.path.exists(css_path):
-        with open(css_path, "r", encoding="utf-8") as f:
-            css = f.read()
+# 書き出し用の静的ファイル（CSS / JS）と画像の data URI は (mtime_ns, size) を確かめてメモリから使う
+DATA_URI_CACHE = PageCache(max_entries=1024, max_chars=64 * 1024 * 1024)
+RE_IMG_SRC  = re.compile(r'<img[^>]+src="([^"]+)"')
+RE_SRC_ATTR = re.compile(r'src="([^"]+)"')
+_STATIC_TEXT = {}
+
+
+def _static_text(name: str) -> Optional[str]:
+    path = os.path.join(BASE_DIR, "static", name)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    hit = _STATIC_TEXT.get(path)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    _STATIC_TEXT[path] = (stamp, text)
+    return text
+
+
+def _data_uri_cached(path: str) -> Optional[str]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    key = (path, st.st_mtime_ns, st.st_size)
+    data_uri = DATA_URI_CACHE.get(key)
+    if data_uri is None:
+        data_uri = _encode_file_to_data_uri(path)
+        if data_uri:
+            DATA_URI_CACHE.put(key, data_uri)
+    return data_uri
+
+
+def _inline_css(html_doc: str) -> str:
+    css = _static_text("style.css")
+    if css is not None:
         html_doc = html_doc.replace(
             '<link rel="stylesheet" href="static/style.css">',
             f"<style>\n{css}\n</style>",
         )
+    return html_doc
+
 
-    js_path = os.path.join(BASE_DIR, "static", "app.js")
-    if os.path.exists(js_path):
-        with open(js_path, "r", encoding="utf-8") as f:
-            js = f.read()
+def _inline_js(html_doc: str) -> str:
+    js = _static_text("app.js")
+    if js is not None:
         html_doc = html_doc.replace(
             '<script src="static/app.js"></script>',
             f"<script>\n{js}\n</script>",
         )
+    return html_doc
 
-    image_sources = set(re.findall(r'<img[^>]+src="([^"]+)"', html_doc))
-    if image_sources:
-        db = _load_upload_db()
-        for src in image_sources:
-            path = None
-            if src.startswith("/uploads/"):
-                path = os.path.join(BASE_DIR, src.lstrip("/"))
-            elif src.startswith("/image/"):
-                token = src.split("/", 2)[-1]
-                rec = db.get(token)
-                if rec:
-                    stored = rec.get("stored_name")
-                    if stored:
-                        path = os.path.join(UPLOAD_DIR, stored)
-
-            if not path or not os.path.exists(path):
-                continue
 
-            data_uri = _encode_file_to_data_uri(path)
-            if data_uri:
-                html_doc = html_doc.replace(f'src="{src}"', f'src="{data_uri}"')
+def _image_path(src: str, db: dict) -> Optional[str]:
+    # 書き出しで読む画像ファイル。/uploads/ は URL デコードし、uploads の外を指すものは読まない
+    if src.startswith("/uploads/"):
+        path = os.path.join(UPLOAD_DIR, unquote(src[len("/uploads/"):]))
+        root = os.path.realpath(UPLOAD_DIR)
+        if os.path.commonpath([root, os.path.realpath(path)]) != root:
+            return None
+        return path
+    if src.startswith("/image/"):
+        rec = db.get(src.split("/", 2)[-1])
+        if rec:
+            stored = rec.get("stored_name")
+            if stored:
+                return os.path.join(UPLOAD_DIR, stored)
+    return None
 
-    return html_doc
 
+def _rewrite_img_srcs(html_doc: str, memo: dict, resolve) -> str:
+    # <img> の src を resolve(src, db) の戻り値に置き換える（文書は 1 回だけ走査する）。
+    # memo は src → 置換後の値（None は置き換えない）で、同じ文書内の再解決を省く
+    image_sources = set(RE_IMG_SRC.findall(html_doc))
+    if not image_sources:
+        return html_doc
+    db = None
+    repl = {}
+    for src in image_sources:
+        if src not in memo:
+            if db is None:
+                db = _load_upload_db()
+            memo[src] = resolve(src, db)
+        if memo[src]:
+            repl[src] = memo[src]
+    if not repl:
+        return html_doc
+    return RE_SRC_ATTR.sub(
+        lambda m: f'src="{repl[m.group(1)]}"' if m.group(1) in repl else m.group(0),
+        html_doc,
+    )
 
-def to_html_document(
+
+def _data_uri_for_src(src: str, db: dict) -> Optional[str]:
+    path = _image_path(src, db)
+    return _data_uri_cached(path) if path else None
+
+
+def _inline_images(html_doc: str, memo: Optional[dict] = None) -> str:
+    return _rewrite_img_srcs(html_doc, {} if memo is None else memo, _data_uri_for_src)
+
+
+def _inline_export_assets(html_doc: str) -> str:
+    return _inline_images(_inline_js(_inline_css(html_doc)))
+
+
+def iter_html_document(
     pages,
     writing_mode: str = "horizontal",
     include_boilerplate: bool = False,
     inline_assets: bool = False,
-) -> str:
-    body = []
-    total = len(pages)
+    workers: int = 0,
+):
+    # to_html_document と同じ HTML を断片ごとに返す。ページは描画された順に流し、
+    # inline_assets のときは CSS / JS / 画像をそれぞれ出力する箇所で埋め込む
+    if isinstance(pages, str):
+        pages = iter_document(pages, workers=workers)
+    inline = include_boilerplate and inline_assets
+    memo = {}
+
+    if include_boilerplate:
+        head = (
+            "<!doctype html>\n"
+            "<html lang=\"ja\">\n"
+            "<head><meta charset=\"utf-8\"><meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">"
+            "<title>PixiText Export</title><link rel=\"stylesheet\" href=\"static/style.css\"></head>\n"
+            "<body>"
+        )
+        yield _inline_css(head) if inline else head
+
+    yield f'<div class="document {"vertical" if writing_mode=="vertical" else "horizontal"}">'
+
+    total = 0
     for p in pages:
+        total += 1
         idx = p["index"]
-        body.append(f'<section class="page" id="page-{idx}" data-index="{idx}">')
-        body.append(f'<span id="{idx}" class="page-anchor" aria-hidden="true"></span>')
-        body.append(f'<div class="page-inner">{p["html"]}</div>')
-        body.append('</section>')
+        section = (
+            ("\n" if total > 1 else "")
+            + f'<section class="page" id="page-{idx}" data-index="{idx}">\n'
+            + f'<span id="{idx}" class="page-anchor" aria-hidden="true"></span>\n'
+            + f'<div class="page-inner">{p["html"]}</div>\n'
+            + '</section>'
+        )
+        yield _inline_images(section, memo) if inline else section
 
     pager = ['<div class="bottom-pager" role="navigation" aria-label="ページ移動"><div class="pager-center">']
     pager.append('<a class="page-arrow prev" href="#1">&lsaquo;</a>')
@@ -304,20 +1466,87 @@ def to_html_document(
         pager.append(f'<a class="page-number" href="#{i}" data-page="{i}">{i}</a>')
     pager.append(f'<a class="page-arrow next" href="#{total}">&rsaquo;</a>')
     pager.append('</div></div>')
-
-    content = "\n".join(body) + "\n" + "\n".join(pager)
-    wrapper = f'<div class="document {"vertical" if writing_mode=="vertical" else "horizontal"}">{content}</div>'
+    yield "\n" + "\n".join(pager) + "</div>"
 
     if include_boilerplate:
-        html = (
-            "<!doctype html>\n"
-            "<html lang=\"ja\">\n"
-            "<head><meta charset=\"utf-8\"><meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">"
-            "<title>PixiText Export</title><link rel=\"stylesheet\" href=\"static/style.css\"></head>\n"
-            f"<body>{wrapper}<script src=\"static/app.js\"></script></body></html>"
-        )
-        if inline_assets:
-            html = _inline_export_assets(html)
-        return html
+        tail = '<script src="static/app.js"></script></body></html>'
+        yield _inline_js(tail) if inline else tail
+
+
+def to_html_document(
+    pages,
+    writing_mode: str = "horizontal",
+    include_boilerplate: bool = False,
+    inline_assets: bool = False,
+    workers: int = 0,
+) -> str:
+    # pages は parse_document のリスト / iter_document のジェネレータ / 本文の文字列（ここで描画する）
+    return "".join(iter_html_document(pages, writing_mode, include_boilerplate, inline_assets, workers))
+
+
+# ---------- ZIP 書き出し ----------
+# index.html と static/style.css, static/app.js、images/ 以下に元の画像ファイルを 1 つずつ入れる。
+# 画像は base64 にせず相対パスで参照する
+class _ZipSink(io.RawIOBase):
+    # ZipFile の書き込み先（シーク不可）。書かれたバイト列を溜めておき drain() で取り出す
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        if self._parts:
+            data = b"".join(self._parts)
+            self._parts = []
+            yield data
+
+
+def iter_zip_document(pages, writing_mode: str = "horizontal", workers: int = 0):
+    # to_html_document(include_boilerplate=True) の ZIP 版。ZIP のバイト列を断片ごとに返す
+    sink = _ZipSink()
+    files = {}          # ZIP 内の名前 → 実ファイル（同じ画像は 1 回だけ入れる）
+    memo = {}
+    static_root = os.path.realpath(os.path.join(BASE_DIR, "static"))
+
+    def resolve(src, db):
+        if src.startswith("/static/"):
+            path = os.path.join(static_root, unquote(src[len("/static/"):]))
+            if os.path.commonpath([static_root, os.path.realpath(path)]) != static_root:
+                return None
+            arcname = "static/" + os.path.relpath(path, static_root).replace(os.sep, "/")
+        else:
+            path = _image_path(src, db)
+            if not path:
+                return None
+            arcname = "images/" + os.path.basename(path)
+        if not os.path.isfile(path):
+            return None
+        files.setdefault(arcname, path)
+        return quote(arcname)
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("index.html", "w") as f:
+            for chunk in iter_html_document(pages, writing_mode, include_boilerplate=True, workers=workers):
+                f.write(_rewrite_img_srcs(chunk, memo, resolve).encode("utf-8"))
+                yield from sink.drain()
+
+        for name in ("style.css", "app.js"):
+            path = os.path.join(static_root, name)
+            if os.path.isfile(path):
+                files.setdefault(f"static/{name}", path)
 
-    return wrapper
+        for arcname, path in files.items():
+            # 画像はすでに圧縮済みなので無圧縮で入れる
+            compress = zipfile.ZIP_STORED if arcname.startswith("images/") else zipfile.ZIP_DEFLATED
+            try:
+                zf.write(path, arcname, compress_type=compress)
+            except OSError:
+                continue                          # 書き出し中に消えたファイルは入れない
+            yield from sink.drain()
+    yield from sink.drain()
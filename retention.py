@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+
+# ---------- ゴミ箱の保持期間 ----------
+# ゴミ箱に入れてから max_age 秒を過ぎた画像・保存を、ファイルもレコードも完全に消す（バックグラウンド）。
+# max_age が 0 以下（既定）なら止まっていて、運用側が期間を決めたときだけ動く。
+# 1 回の整理では batch 件ずつ消し、レコードの無いゴミ箱のファイルも片付けてから、メタデータの DB を詰め、
+# 参照の無くなったブロブを掃除し、trash_log.jsonl をローテーションする。
+# レコードの無いファイルのうち、ストア（images.db / 目録）を作る前からあったもの（古い形式のゴミ箱）は消さない。
+# どのワーカーが走らせるかは印のファイルの mtime で調整する（全体で interval に 1 回）。
+# dry_run では何も消さず、消すはずの件数とバイト数だけ数える
+class TrashRetention:
+    def __init__(
+        self,
+        images,
+        saves,
+        uploads_trash: str,
+        saves_trash: str,
+        mark_path: str,
+        blob_stores=(),
+        log_path: Optional[str] = None,
+        max_age: float = 0,
+        interval: float = 3600,
+        batch: int = 200,
+        dry_run: bool = False,
+        log_max_bytes: int = 5 * 1024 * 1024,
+        log_keep: int = 5,
+    ):
+        self.images = images
+        self.saves = saves
+        self.uploads_trash = uploads_trash
+        self.saves_trash = saves_trash
+        self.mark_path = mark_path
+        self.blob_stores = list(blob_stores)
+        self.log_path = log_path
+        self.max_age = max_age
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.dry_run = dry_run
+        self.log_max_bytes = log_max_bytes
+        self.log_keep = max(1, log_keep)
+        self.totals = {
+            "runs": 0, "images": 0, "saves": 0, "orphans": 0, "files": 0,
+            "bytes_reclaimed": 0, "blobs": 0, "blob_bytes": 0, "vacuums": 0, "log_rotations": 0,
+        }
+        self.last = None                   # 直近 1 回の結果
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    # ----- 1 回分 -----
+    def run(self, now: Optional[float] = None, dry_run: Optional[bool] = None, max_age: Optional[float] = None) -> dict:
+        # max_age を渡せばこの回だけその期間で数える（止めてある間に dry_run で見積もる用）
+        now = now or time.time()
+        dry = self.dry_run if dry_run is None else dry_run
+        max_age = self.max_age if max_age is None else max_age
+        if max_age <= 0:
+            raise ValueError("trash retention is off")
+        cutoff = int(now - max_age)
+        started = time.perf_counter()
+        report = {
+            "dry_run": dry, "cutoff": cutoff, "images": 0, "saves": 0, "orphans": 0, "files": 0,
+            "bytes_reclaimed": 0, "blobs": 0, "blob_bytes": 0, "vacuums": 0, "log_rotated": False,
+        }
+        for store, trash_dir, key in (
+            (self.images, self.uploads_trash, "images"),
+            (self.saves, self.saves_trash, "saves"),
+        ):
+            self._purge(store, trash_dir, key, cutoff, dry, report)
+            self._orphans(store, trash_dir, cutoff, dry, report)
+
+        if not dry:
+            report["vacuums"] = int(self.images.compact()) + int(self.saves.compact())
+            for blobs in self.blob_stores:
+                before = blobs.removed_bytes
+                report["blobs"] += blobs.gc(now)
+                report["blob_bytes"] += blobs.removed_bytes - before
+            report["log_rotated"] = self._rotate_log()
+            self._log(report, now)
+
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            if not dry:
+                self.totals["runs"] += 1
+                for k in ("images", "saves", "orphans", "files", "bytes_reclaimed", "blobs", "blob_bytes", "vacuums"):
+                    self.totals[k] += report[k]
+                self.totals["log_rotations"] += int(report["log_rotated"])
+            self.last = report
+        return report
+
+    def _remove(self, path: str, dry: bool, report: dict) -> None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        # ほかに参照が無ければ（ブロブと自分だけ、またはブロブ外のファイル）その分が空く
+        if st.st_nlink <= 2:
+            report["bytes_reclaimed"] += st.st_size
+        report["files"] += 1
+        if not dry:
+            try:
+                os.remove(path)
+            except OSError:
+                report["files"] -= 1
+
+    def _purge(self, store, trash_dir: str, key: str, cutoff: int, dry: bool, report: dict) -> None:
+        # 期限切れのレコードを batch 件ずつ。dry_run は消さないので読む位置をずらして進む
+        offset = 0
+        while True:
+            rows = store.trashed_before(cutoff, self.batch, offset)
+            if not rows:
+                break
+            for _, rec in rows:
+                name = os.path.basename(rec.get("trash_path") or "")
+                if name:
+                    self._remove(os.path.join(trash_dir, name), dry, report)
+            if dry:
+                offset += len(rows)
+            else:
+                store.delete(k for k, _ in rows)
+            report[key] += len(rows)
+            if len(rows) < self.batch:
+                break
+
+    def _orphans(self, store, trash_dir: str, cutoff: int, dry: bool, report: dict) -> None:
+        # どのレコードも指していないゴミ箱のファイル（移動とレコードの書き込みの間で落ちた残りなど）。
+        # ゴミ箱へ移した時刻（ctime）で数え、期限内のものと、ストアを作る前からあったもの（古い形式）は触らない
+        try:
+            names = os.listdir(trash_dir)
+        except OSError:
+            return
+        referenced = store.trash_paths()
+        since = store.created_at()
+        for name in names:
+            if name in referenced or name.startswith("."):
+                continue
+            path = os.path.join(trash_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path) and since <= st.st_ctime < cutoff:
+                self._remove(path, dry, report)
+                report["orphans"] += 1
+
+    def _rotate_log(self) -> bool:
+        # trash_log.jsonl が log_max_bytes を超えたら .1, .2, ... に送り、log_keep 世代より古いものは捨てる。
+        # 書き手は 1 行ごとに開き直すので、次の行から新しいファイルに入る
+        if not self.log_path:
+            return False
+        try:
+            if os.path.getsize(self.log_path) < self.log_max_bytes:
+                return False
+            for i in range(self.log_keep - 1, 0, -1):
+                if os.path.exists(f"{self.log_path}.{i}"):
+                    os.replace(f"{self.log_path}.{i}", f"{self.log_path}.{i + 1}")
+            os.replace(self.log_path, f"{self.log_path}.1")
+        except OSError:
+            return False
+        return True
+
+    def _log(self, report: dict, now: float) -> None:
+        if not self.log_path:
+            return
+        payload = {
+            "event": "trash_purge",
+            **report,
+            "ts": int(now),
+            "iso": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+        }
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+    # ----- バックグラウンド -----
+    def maybe_run(self) -> Optional[dict]:
+        # 全ワーカーで interval に 1 回だけ（印のファイルの mtime で調整）
+        now = time.time()
+        try:
+            if now - os.stat(self.mark_path).st_mtime < self.interval:
+                return None
+        except OSError:
+            pass
+        try:
+            with open(self.mark_path, "w"):
+                pass
+        except OSError:
+            return None
+        return self.run(now)
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.maybe_run()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+            time.sleep(self.interval)
+
+    def ensure_started(self) -> None:
+        # プロセスごとに 1 本（gunicorn の fork 後にも動くよう、最初のリクエストで起こす）。max_age が 0 以下なら止める
+        if self._worker_pid == os.getpid() or self.max_age <= 0:
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._loop, name="trash-retention", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_age": self.max_age,
+                "interval": self.interval,
+                "batch": self.batch,
+                "dry_run": self.dry_run,
+                "totals": dict(self.totals),
+                "last": self.last,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,173 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+
+import flask_session
+from flask_session.sessions import ServerSideSession, SessionInterface
+from itsdangerous import BadSignature, want_bytes
+
+
+# ---------- SQLite セッション ----------
+# 1 セッション 1 行（WAL モード）。期限の列に索引を張り、期限切れはバックグラウンドで少しずつ消す。
+# 変更の無いセッションは書き込まない（Cookie の更新が要るときも DB には触らない）
+class SqliteSession(ServerSideSession):
+    pass
+
+
+class SqliteSessionInterface(SessionInterface):
+    session_class = SqliteSession
+
+    def __init__(
+        self,
+        path: str,
+        key_prefix: str = "session:",
+        use_signer: bool = False,
+        permanent: bool = True,
+        sweep_interval: float = 300,
+        sweep_batch: int = 500,
+    ):
+        self.path = path
+        self.key_prefix = key_prefix
+        self.use_signer = use_signer
+        self.permanent = permanent
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.swept = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sweeper_pid = None
+        db = self._db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, data BLOB NOT NULL, expiry INTEGER NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)")
+
+    def _db(self) -> sqlite3.Connection:
+        # スレッドごとに 1 接続（fork 後は作り直す）。自動コミット
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # ----- 期限切れの掃除 -----
+    def sweep(self, now=None) -> int:
+        # 期限切れを sweep_batch 件ずつ消す（1 回の書き込みロックを短くする）
+        now = int(now if now is not None else time.time())
+        db = self._db()
+        total = 0
+        while True:
+            n = db.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expiry <= ? LIMIT ?)",
+                (now, self.sweep_batch),
+            ).rowcount
+            total += n
+            if n < self.sweep_batch:
+                break
+        with self._lock:
+            self.swept += total
+        return total
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except sqlite3.Error:
+                pass
+
+    def _ensure_sweeper(self) -> None:
+        # プロセスごとに 1 本（gunicorn の fork 後にも動くよう、最初のリクエストで起こす）
+        if self._sweeper_pid == os.getpid() or not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True).start()
+
+    # ----- SessionInterface -----
+    def open_session(self, app, request):
+        self._ensure_sweeper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.session_class(sid=self._generate_sid(), permanent=self.permanent)
+        if self.use_signer:
+            signer = self._get_signer(app)
+            if signer is None:
+                return None
+            try:
+                sid = signer.unsign(sid).decode()
+            except BadSignature:
+                return self.session_class(sid=self._generate_sid(), permanent=self.permanent)
+
+        now = int(time.time())
+        key = self.key_prefix + sid
+        row = self._db().execute("SELECT data, expiry FROM sessions WHERE id = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return self.session_class(sid=sid, permanent=self.permanent)
+        try:
+            data = pickle.loads(row[0])
+        except Exception:
+            return self.session_class(sid=sid, permanent=self.permanent)
+
+        # 読むだけのセッションも期限の半分を過ぎたら延ばす（毎回は書かない）
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        if row[1] - now < lifetime // 2:
+            self._db().execute("UPDATE sessions SET expiry = ? WHERE id = ?", (now + lifetime, key))
+        return self.session_class(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        name = self.get_cookie_name(app)
+        if not session:
+            if session.modified:
+                self._db().execute("DELETE FROM sessions WHERE id = ?", (self.key_prefix + session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            expiry = int(time.time() + app.permanent_session_lifetime.total_seconds())
+            self._db().execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expiry) VALUES (?, ?, ?)",
+                (self.key_prefix + session.sid, pickle.dumps(dict(session), pickle.HIGHEST_PROTOCOL), expiry),
+            )
+        elif not self.should_set_cookie(app, session):
+            return
+
+        sid = session.sid
+        if self.use_signer:
+            sid = self._get_signer(app).sign(want_bytes(sid)).decode("utf-8")
+        response.set_cookie(
+            name,
+            sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class Session(flask_session.Session):
+    # SESSION_TYPE="sqlite" を使えるようにした flask_session.Session（ほかの種類はそのまま）。
+    # SESSION_SQLITE_PATH: DB ファイル、SESSION_SQLITE_SWEEP_INTERVAL: 掃除の間隔（秒、0 で止める）
+    def _get_interface(self, app):
+        config = app.config
+        if config.get("SESSION_TYPE") != "sqlite":
+            return super()._get_interface(app)
+        return SqliteSessionInterface(
+            config.get("SESSION_SQLITE_PATH") or os.path.join(os.getcwd(), "flask_session.db"),
+            config.get("SESSION_KEY_PREFIX", "session:"),
+            config.get("SESSION_USE_SIGNER", False),
+            config.get("SESSION_PERMANENT", True),
+            config.get("SESSION_SQLITE_SWEEP_INTERVAL", 300),
+        )
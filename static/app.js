@@ -89,17 +89,66 @@ window.addEventListener('pageshow', (e) => {
 
 // --- 4) プレビュー送信前にエラーチェックしてトースト表示 ---
 (()=>{
-  async function requestPreview(fd){
-    const resp = await fetch('/api/preview_page', {
+  // サーバーが持っている下書きの版（rev）と、その時点の本文。
+  // 2 回目以降は差分だけ送り、版がずれていたら全文を送り直す
+  const DOC_KEY = 'pixitext.previewDoc';
+
+  function loadDoc(){
+    try { return JSON.parse(sessionStorage.getItem(DOC_KEY) || 'null'); } catch (_) { return null; }
+  }
+  function saveDoc(rev, text){
+    try { sessionStorage.setItem(DOC_KEY, JSON.stringify({ rev, text })); }
+    catch (_) { sessionStorage.removeItem(DOC_KEY); } // 容量オーバー時は毎回全文送信
+  }
+
+  // 先頭と末尾の一致部分を除いた 1 か所の置換（位置は UTF-16 単位）
+  function textDelta(a, b){
+    if (a === b) return null;
+    let s = 0;
+    const n = Math.min(a.length, b.length);
+    while (s < n && a.charCodeAt(s) === b.charCodeAt(s)) s++;
+    let e = 0;
+    while (e < n - s && a.charCodeAt(a.length - 1 - e) === b.charCodeAt(b.length - 1 - e)) e++;
+    // サロゲートペアの途中で切らない
+    if (s > 0 && /[\uD800-\uDBFF]/.test(a[s - 1])) s--;
+    if (e > 0 && /[\uDC00-\uDFFF]/.test(a[a.length - e])) e--;
+    return { offset: s, delete: a.length - s - e, insert: b.slice(s, b.length - e) };
+  }
+
+  async function postJSON(url, body){
+    const resp = await fetch(url, {
       method: 'POST',
-      body: fd,
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body),
       credentials: 'same-origin',
     });
-
     const data = await resp.json().catch(() => ({}));
     return { resp, data };
   }
 
+  async function requestPreview(fd){
+    const text = String(fd.get('text') || '').replace(/\r\n?/g, '\n');
+    const writing_mode = fd.get('writing_mode') || 'horizontal';
+
+    const doc = loadDoc();
+    if (doc && doc.rev && typeof doc.text === 'string') {
+      const op = textDelta(doc.text, text);
+      // 全文を送るときと同じく 1 ページ目に着地する（p を省くと編集したページが返る）
+      const r = await postJSON('/api/preview_patch', {
+        base_rev: doc.rev, ops: op ? [op] : [], writing_mode, p: 1,
+      });
+      if (r.resp.ok && r.data.success) {
+        saveDoc(r.data.rev, text);
+        return r;
+      }
+      if (!r.data.resync) return r;
+    }
+
+    const r = await postJSON('/api/preview_page', { text, writing_mode });
+    if (r.resp.ok && r.data.success) saveDoc(r.data.rev, text);
+    return r;
+  }
+
   document.addEventListener('submit', async (e)=>{
     const form = e.target;
     const submitter = e.submitter || document.activeElement;
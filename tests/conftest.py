@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app を読み込むとモジュールの読み込み時にデータの置き場所（DATA_DIR）が決まるので、テストごとに読み直す
+_APP_MODULES = (
+    "app", "parser", "users", "images", "catalog", "blobs", "drafts", "sessions", "journal", "retention", "bench_parser",
+)
+
+# 同梱のサンプルデータ（古い形式の uploads.json・saves_meta.json・ゴミ箱）だけ写す。実行時にできるものは除く
+_SAMPLE = ("uploads", "saves", "trash", "users.json")
+_RUNTIME = shutil.ignore_patterns(
+    "images.db*", ".blobs", ".catalog", ".pageindex", ".pagecache", "*.journal", "*.lock", ".last_retention", ".DS_Store",
+)
+
+
+def _forget_app_modules() -> None:
+    for name in _APP_MODULES:
+        sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    dst = tmp_path / "data"
+    dst.mkdir()
+    for name in _SAMPLE:
+        src = os.path.join(ROOT, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst / name, ignore=_RUNTIME)
+        else:
+            shutil.copy2(src, dst / name)
+    return dst
+
+
+@pytest.fixture
+def load_app(data_dir, monkeypatch):
+    # DATA_DIR を一時ディレクトリにして app を読み込み直す。env は app.config が読む環境変数
+    loaded = []
+
+    def load(**env):
+        monkeypatch.setenv("DATA_DIR", str(data_dir))
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        _forget_app_modules()
+        import app
+        loaded.append(app)
+        return app
+
+    yield load
+    parser = sys.modules.get("parser")
+    if loaded and parser is not None:
+        parser._drop_pool()
+    _forget_app_modules()
+
+
+@pytest.fixture
+def appmod(load_app):
+    return load_app()
+
+
+@pytest.fixture
+def client(appmod):
+    return appmod.app.test_client()
+
+
+@pytest.fixture
+def signup(client):
+    # ユーザーを作ってログインした状態にし、その user_id を返す
+    def run(username: str = "writer", password: str = "pw") -> str:
+        client.post("/signup", data={"username": username, "password": password})
+        return client.get("/_whoami").get_json()["user_id"]
+    return run
+
@@ -0,0 +1,87 @@
+import os
+import time
+
+from blobs import BlobStore
+
+
+def _store(tmp_path):
+    return BlobStore(str(tmp_path / ".blobs"))
+
+
+def _put(store, dst, data: bytes) -> str:
+    tmp = store.tmp_path()
+    with open(tmp, "wb") as f:
+        f.write(data)
+    return store.put(tmp, str(dst))
+
+
+def test_link_reuses_the_digest_of_a_known_file(tmp_path):
+    store = _store(tmp_path)
+    blob = _put(store, tmp_path / "a.txt", b"x" * 1000)
+    assert store.link(str(tmp_path / "a.txt"), str(tmp_path / "b.txt")) == blob
+    assert store.link(str(tmp_path / "b.txt"), str(tmp_path / "c.txt")) == blob
+    assert store.hashed == 0
+    assert store.refs(blob) == 3
+
+
+def test_replacing_the_last_link_removes_the_old_blob(tmp_path):
+    store = _store(tmp_path)
+    for i in range(5):
+        _put(store, tmp_path / "a.txt", f"版 {i}".encode())
+    stats = store.stats()
+    assert (stats["blobs"], stats["links"]) == (1, 1)
+    assert stats["removed"] == 4
+
+
+def test_replacing_a_shared_name_keeps_the_blob_for_the_others(tmp_path):
+    store = _store(tmp_path)
+    blob = _put(store, tmp_path / "a.txt", b"shared")
+    store.link(str(tmp_path / "a.txt"), str(tmp_path / "b.txt"))
+    _put(store, tmp_path / "a.txt", b"changed")
+    assert (tmp_path / "b.txt").read_bytes() == b"shared"
+    assert store.refs(blob) == 1
+    assert store.stats()["blobs"] == 2
+
+
+def test_maybe_gc_runs_once_per_interval(tmp_path):
+    store = _store(tmp_path)
+    assert store.maybe_gc() == 0
+    assert store.maybe_gc() is None
+    assert os.path.exists(store.mark_path)
+    assert store.stats()["blobs"] == 0                  # 印のファイルはブロブとして数えない
+
+
+def test_resaving_a_file_keeps_one_blob(appmod, client, signup):
+    signup("blobs")
+    for i in range(5):
+        client.post("/save_local", data={"filename": "draft.txt", "text": f"原稿 {i}"})
+    stats = appmod.SAVE_BLOBS.stats()
+    assert (stats["blobs"], stats["links"]) == (1, 1)
+
+
+def test_saving_over_an_import_leaves_the_source_alone(appmod, client, signup):
+    signup("blobs")
+    client.post("/save_local", data={"filename": "src.txt", "text": "元の原稿"})
+    client.post("/saves/visibility", data={"fname": "src.txt", "visibility": "public"})
+    client.post("/saves/import", data={"fname": "src.txt"})
+    assert appmod.SAVE_BLOBS.refs(os.path.join(appmod.SAVES_DIR, "src_import.txt")) == 2
+    client.post("/save_local", data={"filename": "src_import.txt", "text": "書き換えた原稿"})
+    with open(os.path.join(appmod.SAVES_DIR, "src.txt"), encoding="utf-8") as f:
+        assert f.read() == "元の原稿"
+
+
+def test_save_sharing_an_old_blob_lists_with_its_write_time(appmod, client, signup):
+    uid = signup("blobs")
+    client.post("/save_local", data={"filename": "old.txt", "text": "同じ中身"})
+
+    # 1 日前に書いたことにする（ブロブと old.txt は同じ inode）
+    old = time.time() - 86400
+    old_path = os.path.join(appmod.SAVES_DIR, "old.txt")
+    os.utime(old_path, (old, old))
+    appmod.SAVES.put("old.txt", appmod.SAVES.get("old.txt"), mtime=old)
+
+    client.post("/save_local", data={"filename": "new.txt", "text": "同じ中身"})
+    rows = {name: mtime for name, size, mtime, m in appmod.SAVES.by_owner(uid)}
+    assert list(rows) == ["new.txt", "old.txt"]
+    assert time.time() - rows["new.txt"] < 60
+    assert os.stat(old_path).st_mtime == old            # 共有の inode の mtime は触らない
@@ -0,0 +1,37 @@
+import os
+
+from catalog import SavesCatalog
+
+
+def _catalog(tmp_path, **kw):
+    saves = tmp_path / "saves"
+    saves.mkdir(exist_ok=True)
+    return SavesCatalog(str(saves / ".catalog" / "saves.db"), str(saves), **kw), saves
+
+
+def test_own_writes_do_not_trigger_a_scan(tmp_path):
+    cat, saves = _catalog(tmp_path)
+    scans = cat.scans
+    for i in range(3):
+        (saves / f"{i}.txt").write_text("本文", encoding="utf-8")
+        cat.put(f"{i}.txt", {"owner": "u", "visibility": "public"})
+        assert not cat.maybe_reconcile()
+    assert cat.scans == scans
+    assert len(cat.public()) == 3
+
+
+def test_outside_changes_are_picked_up_by_maybe_reconcile(tmp_path):
+    cat, saves = _catalog(tmp_path)
+    (saves / "outside.txt").write_text("本文", encoding="utf-8")
+    assert cat.get("outside.txt") is None              # 一覧では走査しない
+    assert cat.maybe_reconcile()
+    assert cat.get("outside.txt") == {}
+
+
+def test_interval_reconcile_is_shared_between_workers(tmp_path):
+    a, saves = _catalog(tmp_path, reconcile_interval=3600)
+    b = SavesCatalog(a.path, str(saves), reconcile_interval=3600)   # 別のワーカー
+    assert not a.maybe_reconcile() and not b.maybe_reconcile()
+    os.utime(saves, (0, 0))                             # 外での変更に見せる
+    assert b.maybe_reconcile()
+    assert not a.maybe_reconcile()
@@ -0,0 +1,37 @@
+import os
+import time
+
+from drafts import DraftStore, draft_key
+
+
+def _files(root):
+    return [n for d, _, names in os.walk(root) for n in names if not n.startswith(".")]
+
+
+def test_superseded_drafts_are_collected_after_the_grace(appmod, client, signup):
+    signup("drafts")
+    for i in range(5):
+        client.post("/api/preview_page", json={"text": f"下書き {i}"})
+        client.post("/save_local", data={"filename": "d.txt", "text": f"保存 {i}"})
+    assert len(_files(appmod.DRAFTS_DIR)) == 10           # 差し替えたものは猶予のあいだだけ残る
+
+    appmod.DRAFTS.gc(time.time() + appmod.DRAFTS.retire_grace + 1)
+    assert _files(appmod.DRAFTS_DIR) == [draft_key("保存 4") + ".txt"]
+    assert client.get("/api/preview_page").get_json()["success"]
+
+
+def test_put_does_not_sweep_on_the_request_thread(tmp_path, monkeypatch):
+    store = DraftStore(str(tmp_path))
+    monkeypatch.setattr(store, "gc", lambda now=None: (_ for _ in ()).throw(AssertionError("gc in put")))
+    store.put("本文")
+    assert store.get(draft_key("本文")) == "本文"
+
+
+def test_reading_a_released_draft_extends_its_lease_again(tmp_path):
+    # 同じ本文を別のセッションも使っている場合
+    store = DraftStore(str(tmp_path), ttl=1000, retire_grace=10)
+    key = store.put("共有の本文")
+    store.release(key)
+    assert store.get(key) == "共有の本文"
+    assert store.gc(time.time() + 20) == 0
+    assert store.get(key) == "共有の本文"
@@ -0,0 +1,63 @@
+import io
+import os
+import zipfile
+
+TEXT = "[chapter:一]\n壱[newpage][uploadedimage:988583]\n弐[newpage]参"
+
+
+def test_html_export_is_streamed(appmod, client, signup):
+    import parser
+    signup("exporter")
+    resp = client.post("/export", data={"text": TEXT, "format": "html", "writing_mode": "vertical"})
+    assert resp.is_streamed
+    assert resp.headers["Content-Disposition"] == 'attachment; filename="export.html"'
+    expected = parser.to_html_document(parser.parse_document(TEXT), "vertical", include_boilerplate=True, inline_assets=True)
+    assert resp.get_data(as_text=True) == expected
+
+
+def test_html_export_yields_one_chunk_per_page(appmod):
+    import parser
+    chunks = list(parser.iter_html_document(TEXT))
+    assert sum('<section class="page"' in c for c in chunks) == 3
+    assert "".join(chunks) == parser.to_html_document(parser.parse_document(TEXT))
+
+
+def test_assets_are_inlined_once_per_image(appmod):
+    import parser
+    text = "[uploadedimage:988583][newpage][uploadedimage:988583]"
+    path = os.path.join(parser.UPLOAD_DIR, "sample.png")
+    uri = parser._encode_file_to_data_uri(path)
+    parser.DATA_URI_CACHE.clear()
+
+    doc = parser.to_html_document(text, include_boilerplate=True, inline_assets=True)
+    assert doc.count(f'src="{uri}"') == 2
+    assert parser.DATA_URI_CACHE.stats()["misses"] == 1
+    assert "<style>\n" in doc and 'href="static/style.css"' not in doc
+    assert "<script>\n" in doc and 'src="static/app.js"' not in doc
+    assert doc == parser._inline_export_assets(parser.to_html_document(text, include_boilerplate=True))
+
+    # 画像を差し替えたら (mtime, size) が変わるので読み直す
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    assert parser._encode_file_to_data_uri(path) in parser.to_html_document(text, include_boilerplate=True, inline_assets=True)
+
+
+def test_images_outside_uploads_are_not_inlined(appmod):
+    import parser
+    html = '<img src="/uploads/../app.py" alt="">'
+    assert parser._inline_images(html) == html
+
+
+def test_zip_export_shares_assets_by_relative_path(appmod, client, signup):
+    signup("exporter")
+    text = "[uploadedimage:988583][newpage][uploadedimage:988583][newpage][pixivimage:1]"
+    resp = client.post("/export", data={"text": text, "format": "zip"})
+    assert resp.is_streamed
+    with zipfile.ZipFile(io.BytesIO(resp.get_data())) as zf:
+        names = set(zf.namelist())
+        index = zf.read("index.html").decode("utf-8")
+        assert names == {"index.html", "static/style.css", "static/app.js", "static/replacement.png", "images/sample.png"}
+        assert zf.getinfo("images/sample.png").compress_type == zipfile.ZIP_STORED
+    assert index.count('src="images/sample.png"') == 2
+    assert 'src="static/replacement.png"' in index
+    assert "base64" not in index
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+# golden/ の HTML は元の正規表現版の parser.py（最初のコミット）で manuscript.txt を書き出したもの。
+# 構文木の経路でもバイト単位で同じになることを見る
+GOLDEN = os.path.join(os.path.dirname(__file__), "golden")
+
+
+def _read(name: str) -> str:
+    with open(os.path.join(GOLDEN, name), encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+@pytest.fixture
+def P(load_app):
+    load_app()
+    import parser
+    return parser
+
+
+@pytest.fixture
+def manuscript():
+    return _read("manuscript.txt")
+
+
+def test_document_is_byte_identical(P, manuscript):
+    expected = _read("document.html")
+    assert P.to_html_document(P.parse_document(manuscript)) == expected
+    assert P.to_html_document(P.iter_document(manuscript, chunk_size=16)) == expected
+    assert P.to_html_document(manuscript) == expected
+
+
+def test_export_is_byte_identical(P, manuscript):
+    expected = _read("document_vertical_export.html")
+    pages = P.parse_document(manuscript)
+    assert P.to_html_document(pages, "vertical", include_boilerplate=True) == expected
@@ -0,0 +1,44 @@
+import io
+import os
+
+from images import ID_MIN, ImageStore
+
+
+def _upload(client, appmod, name):
+    with open(os.path.join(appmod.BASE_DIR, "uploads", "sample.png"), "rb") as f:
+        client.post("/upload", data={"file": (io.BytesIO(f.read()), name)}, content_type="multipart/form-data")
+    return next(k for k, v in appmod.IMAGES.all().items() if v["original_name"] == name)
+
+
+def test_ids_are_unique_and_not_sequential(tmp_path):
+    store = ImageStore(str(tmp_path / "images.db"))
+    ids = [store.insert({"stored_name": f"{i}.png"}) for i in range(200)]
+    assert len(set(ids)) == len(ids)
+    assert all(len(i) == 6 and i.isdigit() for i in ids)
+    nums = sorted(int(i) for i in ids)
+    assert sum(b - a == 1 for a, b in zip(nums, nums[1:])) < 5      # 連番になっていない
+    assert nums[0] >= ID_MIN
+
+
+def test_id_width_grows_with_the_store(tmp_path):
+    assert ImageStore._id_range(0) == (100000, 999999)
+    assert ImageStore._id_range(9000) == (1000000, 9999999)
+    assert ImageStore._id_range(10 ** 7)[1] == 99999999
+
+
+def test_migrated_ids_are_never_reused(tmp_path):
+    store = ImageStore(str(tmp_path / "images.db"))
+    store._id_range = staticmethod(lambda count: (100000, 100001))
+    store.put("100000", {"stored_name": "old.png"})
+    assert store.insert({"stored_name": "new.png"}) == "100001"
+
+
+def test_unlisted_image_is_served_by_its_id(appmod, client, signup):
+    signup("images")
+    nid = _upload(client, appmod, "unlisted.png")
+    appmod.IMAGES.update(nid, visibility="unlisted")
+    assert appmod.app.test_client().get(f"/image/{nid}").status_code == 200
+
+    import parser
+    stored = appmod.IMAGES.get(nid)["stored_name"]
+    assert f'src="/uploads/{stored}"' in parser.parse_page(f"[uploadedimage:{nid}]")["html"]
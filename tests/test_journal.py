@@ -0,0 +1,64 @@
+import json
+import threading
+
+import pytest
+
+from journal import JournalStore
+
+
+def _store(tmp_path, **kw):
+    return JournalStore(str(tmp_path / "db.json"), fsync=False, **kw)
+
+
+def _set(key, value):
+    return [{"op": "set", "path": ["items", key], "value": value}]
+
+
+def test_commits_append_and_other_instances_catch_up(tmp_path):
+    a, b = _store(tmp_path), _store(tmp_path)
+    a.commit(_set("x", 1))
+    assert b.data() == {"items": {"x": 1}}
+    b.commit([{"op": "del", "path": ["items", "x"]}])
+    assert a.data() == {"items": {}}
+    assert not (tmp_path / "db.json").exists()          # スナップショットはまだ書いていない
+    assert len((tmp_path / "db.json.journal").read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_concurrent_commits_are_grouped(tmp_path):
+    store = _store(tmp_path)
+    threads = [threading.Thread(target=store.commit, args=(_set(str(i), i),)) for i in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(store.data()["items"]) == 50
+    assert store.commits == 50
+    assert store.flushes <= 50
+
+
+def test_failed_check_drops_only_that_change(tmp_path):
+    store = _store(tmp_path)
+
+    def taken(data):
+        raise ValueError("taken")
+
+    with pytest.raises(ValueError):
+        store.commit(_set("x", 1), check=taken)
+    store.commit(_set("y", 2))
+    assert store.data() == {"items": {"y": 2}}
+
+
+def test_compaction_and_torn_lines(tmp_path):
+    store = _store(tmp_path, compact_every=3)
+    for i in range(3):
+        store.commit(_set(str(i), i))
+    assert store.compactions == 1
+    assert json.loads((tmp_path / "db.json").read_text(encoding="utf-8"))["items"] == {"0": 0, "1": 1, "2": 2}
+    assert (tmp_path / "db.json.journal").read_bytes() == b""
+
+    # 書きかけで落ちた行は次の書き手が捨てる
+    with open(tmp_path / "db.json.journal", "ab") as f:
+        f.write(b'{"ops": [{"op": "set", "path": ["items", "torn"]')
+    fresh = _store(tmp_path)
+    fresh.commit(_set("3", 3))
+    assert _store(tmp_path).data()["items"] == {"0": 0, "1": 1, "2": 2, "3": 3}
@@ -0,0 +1,12 @@
+def test_spoofed_forwarded_for_does_not_reset_ip_backoff(appmod, client):
+    codes = []
+    for i in range(appmod.LOGIN_THROTTLE.free + 2):
+        # 毎回ちがう偽の X-Forwarded-For（と別のユーザー名）。プロキシは本当の接続元を末尾に足す
+        resp = client.post(
+            "/login",
+            data={"username": f"nobody{i}", "password": "wrong"},
+            headers={"X-Forwarded-For": f"10.0.0.{i}, 203.0.113.7"},
+        )
+        codes.append(resp.status_code)
+    assert 429 not in codes[:-1]
+    assert codes[-1] == 429
@@ -0,0 +1,48 @@
+from parser import PageCache
+
+
+def test_page_cache_evicts_least_recently_used():
+    cache = PageCache(max_entries=2, max_chars=100)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("1", None, "3")
+    cache.put("d", "x" * 99)
+    assert cache.stats()["chars"] <= 100
+    cache.put("e", "x" * 101)                           # 上限より大きい値は入れない
+    assert cache.get("e") is None
+
+
+def test_editing_one_page_rerenders_only_that_page(appmod):
+    import parser
+    pages = [f"{i} ページ目" for i in range(1, 6)]
+    parser.PAGE_CACHE.clear()
+    parser.parse_document("[newpage]".join(pages))
+    pages[2] = "書き換えた 3 ページ目"
+    parser.PAGE_CACHE.hits = parser.PAGE_CACHE.misses = 0
+    html = [p["html"] for p in parser.parse_document("[newpage]".join(pages))]
+    assert (parser.PAGE_CACHE.hits, parser.PAGE_CACHE.misses) == (4, 1)
+    assert "書き換えた" in html[2]
+
+
+def test_new_image_record_invalidates_cached_pages(appmod):
+    import parser
+    text = "[uploadedimage:123456]"
+    assert "画像が見つかりません" in parser.parse_page(text)["html"]
+    appmod.IMAGES.put("123456", {"stored_name": "sample.png", "original_name": "sample.png", "visibility": "public"})
+    assert 'src="/uploads/sample.png"' in parser.parse_page(text)["html"]
+
+
+def test_page_cache_stats_are_hidden_from_regular_users(client, signup):
+    signup("reader")
+    assert client.get("/_page_cache").status_code == 404
+
+
+def test_page_cache_stats_are_shown_to_admins(appmod, client, signup):
+    uid = signup("operator")
+    appmod.app.config["ADMIN_USER_IDS"] = frozenset({uid})
+    client.post("/preview", data={"text": "一枚目[newpage]二枚目"}, follow_redirects=True)
+    stats = client.get("/_page_cache").get_json()
+    assert stats["misses"] >= 1
+    assert {"hits", "entries", "disk"} <= set(stats)
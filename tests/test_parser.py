@@ -0,0 +1,145 @@
+import random
+from html import escape
+
+import pytest
+
+# 大きな入力での比較・計測は bench_parser.py の --fuzz / --adversarial で行う。ここでは小さく回す
+FUZZ_INPUTS = 300
+ADVERSARIAL_SIZE = 20_000
+MAX_GROWTH = 8.0        # 入力を 4 倍にしたときの時間の伸び（線形なら約 4。bench の既定 6 より緩め）
+
+
+@pytest.fixture
+def P(load_app):
+    load_app()
+    import parser
+    return parser
+
+
+@pytest.fixture
+def bench(P):
+    import bench_parser
+    return bench_parser
+
+
+def _inputs(bench, count: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(bench.FUZZ_ATOMS) for _ in range(rng.randint(0, 40)))
+
+
+def test_render_inline_matches_the_regex_reference(P, bench):
+    for text in _inputs(bench, FUZZ_INPUTS, seed=1):
+        line = escape(text.replace("\r", "").replace("\n", " "))
+        assert P.render_inline(line) == P._render_inline_regex(line), line
+
+
+def test_documents_match_the_reference_pipeline(P, bench):
+    for text in _inputs(bench, FUZZ_INPUTS, seed=2):
+        expected = bench._legacy_pages(text)
+        P.PAGE_CACHE.clear()
+        assert [p["html"] for p in P.parse_document(text)] == expected, text
+        assert [p["html"] for p in P.iter_document(text, chunk_size=7)] == expected, text
+        for i, html in enumerate(expected, start=1):
+            page = P.parse_page(text, i)
+            assert (page["html"], page["total"]) == (html, len(expected)), text
+
+
+@pytest.mark.parametrize("name", [
+    "rb_open_gt", "rb_amp", "rb_overlap", "jumpuri_open", "jump_digits",
+    "chapter_open", "chapter_open_lines", "blank_then_tag", "spaced_tags", "newpages",
+])
+def test_adversarial_input_grows_linearly(P, bench, name):
+    make = bench.ADVERSARIAL[name]
+
+    def timed(text):
+        def parse():
+            P.PAGE_CACHE.clear()
+            P.parse_document(text)
+        return max(bench._time(parse, 3), 1e-3)
+
+    small = timed(make(ADVERSARIAL_SIZE))
+    large = timed(make(ADVERSARIAL_SIZE * 4))
+    assert large / small < MAX_GROWTH, f"{name}: x{large / small:.2f} at 4x size"
+
+
+def test_parse_page_renders_only_the_requested_page(P):
+    text = "[newpage]".join(f"[chapter:第{i}章]\n{i} ページ目" for i in range(1, 4))
+    P.PAGE_CACHE.clear()
+    page = P.parse_page(text, 2)
+    assert (page["index"], page["total"], page["chapter"]) == (2, 3, "第2章")
+    assert P.PAGE_CACHE.stats()["entries"] == 1         # 描いたのは 2 ページ目だけ
+    assert page["html"] == P.parse_document(text)[1]["html"]
+
+
+def test_parse_page_clamps_the_page_number(P):
+    text = "一[newpage]二"
+    assert P.parse_page(text, 0)["index"] == 1
+    assert P.parse_page(text, 99)["index"] == 2
+    assert P.parse_page("", 3)["total"] == 1
+
+
+def test_indexed_page_matches_parse_page(P, tmp_path):
+    text = "[chapter:一]\n壱[newpage]弐 &[newpage][chapter:三]\n参"
+    path, index_path = tmp_path / "a.txt", tmp_path / ".pageindex" / "a.json"
+    path.write_text(text, encoding="utf-8")
+    idx = P.write_page_index(str(path), str(index_path))
+    assert (idx["exact"], idx["total"]) == (True, 3)
+    for p in (1, 2, 3, 9):
+        assert P.read_indexed_page(str(path), str(index_path), p) == P.parse_page(text, p)
+
+    path.write_text(text + "[newpage]肆", encoding="utf-8")       # 本文が索引より新しい
+    assert P.read_indexed_page(str(path), str(index_path), 1) is None
+    assert P.read_page_toc(str(path), str(index_path)) is None
+
+
+@pytest.mark.parametrize("text", [
+    "一[newpage]二[newpage]三",
+    "一[chapter:またぐ[newpage]二]三[newpage]四",      # 単独で処理できないページ以降はまとめて処理する
+    "[newpage][newpage]",
+])
+def test_iter_document_matches_parse_document(P, tmp_path, text):
+    expected = P.parse_document(text)
+    path = tmp_path / "a.txt"
+    path.write_text(text, encoding="utf-8")
+    with open(path, encoding="utf-8") as f:
+        assert list(P.iter_document(f, chunk_size=3)) == expected
+    assert list(P.iter_document(iter(text))) == expected
+
+
+def test_iter_document_reads_lazily(P):
+    read = []
+
+    def chunks():
+        for i in range(1, 101):
+            read.append(i)
+            yield f"{i} ページ目[newpage]"
+
+    pages = P.iter_document(chunks())
+    assert next(pages)["text"] == "1 ページ目"
+    assert len(read) < 5
+
+
+def test_benchmark_corpora_are_seeded(bench):
+    a, b = bench.build_corpora(0.01, seed=3), bench.build_corpora(0.01, seed=3)
+    assert a == b
+    assert set(a) == {"plain", "ruby", "images", "pages", "links"}
+    assert a != bench.build_corpora(0.01, seed=4)
+
+
+def test_benchmark_times_every_stage(bench):
+    text = bench.build_corpora(0.002, seed=1)["ruby"]
+    stages = bench._stages(text)
+    assert set(stages) == {
+        "_preprocess", "split_pages", "render_block", "render_inline",
+        "parse_document", "parse_document_cached", "to_html_document",
+    }
+    for fn in stages.values():
+        assert bench._time(fn, 1) >= 0
+
+
+def test_benchmark_flags_regressions(bench):
+    current = {"results": {"plain": {"stages": {"parse_document": {"mb_per_s": 1.0}}}}}
+    baseline = {"results": {"plain": {"stages": {"parse_document": {"mb_per_s": 2.0}}}}}
+    assert len(bench.compare(current, baseline, 0.25)) == 1
+    assert bench.compare(current, baseline, 0.6) == []
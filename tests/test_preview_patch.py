@@ -0,0 +1,36 @@
+def test_patched_preview_lands_where_the_full_preview_does(client, signup):
+    # app.js は差分の送信に p: 1 を付ける。全文を送るときと同じ 1 ページ目に着地すること
+    signup("preview")
+    text = "一[newpage]二[newpage]三"
+    full = client.post("/api/preview_page", json={"text": text}).get_json()
+    edit = {"offset": len(text), "delete": 0, "insert": "!"}
+    landed = client.post("/api/preview_patch", json={"base_rev": full["rev"], "ops": [edit], "p": 1}).get_json()
+    edit = {"offset": len(text) + 1, "delete": 0, "insert": "?"}
+    touched = client.post("/api/preview_patch", json={"base_rev": landed["rev"], "ops": [edit]}).get_json()
+    assert (full["p"], landed["p"], touched["p"]) == (1, 1, 3)
+
+
+def test_patch_offsets_are_utf16_code_units(appmod):
+    text = "😀あ"                                          # 😀 は JavaScript では 2 単位
+    assert appmod._apply_text_patch(text, [{"offset": 2, "delete": 1, "insert": "い"}]) == ("😀い", 1)
+    assert appmod._apply_text_patch(text, [{"offset": 0, "delete": 9, "insert": ""}]) is None
+    assert appmod._apply_text_patch(text, [{"offset": "0"}]) is None
+
+
+def test_patched_draft_matches_the_full_text(client, signup):
+    signup("preview")
+    full = client.post("/api/preview_page", json={"text": "一[newpage]二"}).get_json()
+    edit = {"offset": 0, "delete": 1, "insert": "壱"}
+    patched = client.post("/api/preview_patch", json={"base_rev": full["rev"], "ops": [edit]}).get_json()
+    resent = client.post("/api/preview_page", json={"text": "壱[newpage]二"}).get_json()
+    assert patched["rev"] == resent["rev"]
+    assert patched["page_html"] == resent["page_html"]
+
+
+def test_stale_revision_asks_for_the_full_text(client, signup):
+    signup("preview")
+    old = client.post("/api/preview_page", json={"text": "一"}).get_json()
+    client.post("/api/preview_page", json={"text": "二"})
+    resp = client.post("/api/preview_patch", json={"base_rev": old["rev"], "ops": []})
+    assert resp.status_code == 409
+    assert resp.get_json()["resync"] is True
@@ -0,0 +1,60 @@
+import os
+
+
+def test_inexact_page_index_is_not_rebuilt_on_every_miss(appmod, client, signup, monkeypatch):
+    calls = []
+    write = appmod.write_page_index
+    monkeypatch.setattr(appmod, "write_page_index", lambda *a: calls.append(a) or write(*a))
+
+    signup("viewer")
+    # ページをまたぐ章タグがあるので索引は exact にならない（毎回全文から描画する）
+    text = "一[chapter:またぐ[newpage]二]三[newpage]四[newpage]五"
+    client.post("/save_local", data={"filename": "inexact.txt", "text": text})
+    client.post("/saves/visibility", data={"fname": "inexact.txt", "visibility": "public"})
+    calls.clear()
+
+    for p in (1, 2, 3, 2):
+        appmod.PUBLIC_PAGE_CACHE.invalidate("inexact.txt")
+        assert client.get(f"/saves/public/view?fname=inexact.txt&p={p}").status_code == 200
+    assert calls == []
+
+    # 索引が古くなれば作り直す
+    client.post("/save_local", data={"filename": "inexact.txt", "text": text + "[newpage]六"})
+    os.remove(appmod._page_index_path("inexact.txt"))
+    calls.clear()
+    assert client.get("/saves/public/view?fname=inexact.txt&p=1").status_code == 200
+    assert len(calls) == 1
+
+
+def test_disk_cache_is_shared_and_drops_old_versions(appmod, tmp_path):
+    import parser
+    path = tmp_path / "a.txt"
+    path.write_text("一", encoding="utf-8")
+    writer, reader = parser.DiskPageCache(str(tmp_path / "cache")), parser.DiskPageCache(str(tmp_path / "cache"))
+    v1 = writer.version(str(path))
+    writer.put("a.txt", v1, 1, "<p>一</p>")
+    assert reader.get("a.txt", v1, 1) == "<p>一</p>"            # 別のワーカーからも読める
+
+    path.write_text("一二", encoding="utf-8")
+    v2 = writer.version(str(path))
+    assert v2 != v1
+    writer.put("a.txt", v2, 1, "<p>一二</p>")
+    assert reader.get("a.txt", v1, 1) is None
+    writer.invalidate("a.txt")
+    assert reader.get("a.txt", v2, 1) is None
+
+
+def test_public_pages_are_served_from_the_disk_cache(appmod, client, signup):
+    signup("author")
+    client.post("/save_local", data={"filename": "work.txt", "text": "初版[newpage]二枚目"})
+    client.post("/saves/visibility", data={"fname": "work.txt", "visibility": "public"})
+    reader = appmod.app.test_client()
+    url = "/saves/public/view?fname=work.txt&p=1"
+
+    assert "初版" in reader.get(url).get_data(as_text=True)
+    hits = appmod.PUBLIC_PAGE_CACHE.hits
+    assert "初版" in reader.get(url).get_data(as_text=True)
+    assert appmod.PUBLIC_PAGE_CACHE.hits == hits + 1
+
+    client.post("/save_local", data={"filename": "work.txt", "text": "改訂版[newpage]二枚目"})
+    assert "改訂版" in reader.get(url).get_data(as_text=True)
@@ -0,0 +1,60 @@
+import io
+import os
+
+import pytest
+
+
+def test_pool_workers_resolve_images_uploaded_after_migration(load_app):
+    appmod = load_app(RENDER_WORKERS=2)
+    import parser
+    client = appmod.app.test_client()
+    client.post("/signup", data={"username": "render", "password": "pw"})
+    with open(os.path.join(appmod.BASE_DIR, "uploads", "sample.png"), "rb") as f:
+        png = f.read()
+    client.post("/upload", data={"file": (io.BytesIO(png), "late.png")}, content_type="multipart/form-data")
+    nid, rec = next((k, v) for k, v in appmod.IMAGES.all().items() if v["original_name"] == "late.png")
+
+    # 直列で描く分（PARALLEL_MIN_CHARS）を越えた後ろのページに画像を置き、プールのワーカーに描かせる
+    filler = ("あ" * 1000 + "\n") * 40
+    pages = [filler] * (parser.PARALLEL_MIN_CHARS // len(filler) + 2 * parser.PARALLEL_BATCH_PAGES)
+    pages.append(f"[uploadedimage:{nid}]")
+    pooled = list(parser.iter_document("[newpage]".join(pages), workers=appmod.app.config["RENDER_WORKERS"]))
+
+    assert parser._POOL is not None
+    assert f'src="/uploads/{rec["stored_name"]}"' in pooled[-1]["html"]
+
+
+@pytest.fixture
+def P(load_app, monkeypatch):
+    load_app()
+    import parser
+    # 小さな文書でもプールに回るようにする（判定は親プロセスだけが見る）
+    monkeypatch.setattr(parser, "PARALLEL_MIN_CHARS", 100)
+    monkeypatch.setattr(parser, "PARALLEL_BATCH_PAGES", 4)
+    return parser
+
+
+def _text():
+    return "[newpage]".join(f"[chapter:{i}]\n{i} ページ目[[rb:漢字>かんじ]]" * 3 for i in range(1, 41))
+
+
+def test_pooled_rendering_matches_serial(P):
+    text = _text()
+    serial = P.parse_document(text)
+    P.PAGE_CACHE.clear()
+    assert P.parse_document(text, workers=2) == serial
+    assert P._POOL is not None
+    P.PAGE_CACHE.clear()
+    assert list(P.iter_document(text, workers=2)) == serial
+
+
+def test_broken_pool_falls_back_to_serial(P, monkeypatch):
+    class Broken:
+        def submit(self, *a):
+            raise RuntimeError("pool is gone")
+
+    text = _text()
+    serial = P.parse_document(text)
+    P.PAGE_CACHE.clear()
+    monkeypatch.setattr(P, "_render_pool", lambda workers: Broken())
+    assert P.parse_document(text, workers=2) == serial
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from retention import TrashRetention
+
+
+class _Store:
+    # retention が使う分だけのストア
+    def __init__(self, created_at, trash=()):
+        self._created_at = created_at
+        self.trash = dict(trash)           # trash_path → deleted_at
+
+    def created_at(self):
+        return self._created_at
+
+    def trash_paths(self):
+        return set(self.trash)
+
+    def trashed_before(self, cutoff, limit, offset=0):
+        rows = sorted((at, name) for name, at in self.trash.items() if at < cutoff)[offset:offset + limit]
+        return [(name, {"trash_path": name}) for _, name in rows]
+
+    def delete(self, names):
+        for n in list(names):
+            self.trash.pop(n, None)
+
+    def compact(self):
+        return False
+
+
+def _retention(tmp_path, store, **kw):
+    trash = tmp_path / "trash"
+    trash.mkdir(exist_ok=True)
+    empty = _Store(store.created_at())
+    return TrashRetention(empty, store, str(tmp_path / "none"), str(trash), str(tmp_path / ".mark"), **kw), trash
+
+
+def test_off_by_default(tmp_path):
+    retention, _ = _retention(tmp_path, _Store(0))
+    retention.ensure_started()
+    assert retention._worker_pid is None
+    with pytest.raises(ValueError):
+        retention.run()
+
+
+def test_orphans_from_before_the_store_are_kept(tmp_path):
+    legacy = tmp_path / "trash" / "legacy.txt"
+    legacy.parent.mkdir()
+    legacy.write_text("古い形式")
+    time.sleep(0.05)
+    created = time.time()                  # ストアを作ったのは legacy.txt の後、orphan.txt の前
+    time.sleep(0.05)
+    retention, trash = _retention(tmp_path, _Store(created), max_age=60)
+    (trash / "orphan.txt").write_text("レコードが書けなかったもの")
+
+    report = retention.run(now=time.time() + 3600)
+    assert report["orphans"] == 1
+    assert legacy.exists()
+    assert not (trash / "orphan.txt").exists()
+
+
+def test_dry_run_estimate_while_off(tmp_path):
+    store = _Store(0, {"old.txt": 1})
+    retention, trash = _retention(tmp_path, store)
+    (trash / "old.txt").write_text("x")
+    report = retention.run(dry_run=True, max_age=60)
+    assert report["saves"] == 1 and report["dry_run"]
+    assert (trash / "old.txt").exists() and store.trash
+
+
+def test_stats_view_is_for_operators_only(appmod, client, signup):
+    uid = signup("operator")
+    assert client.get("/_trash_retention").status_code == 404
+    appmod.app.config["ADMIN_USER_IDS"] = frozenset({uid})
+    stats = client.get("/_trash_retention").get_json()
+    assert stats["max_age"] == 0
@@ -0,0 +1,35 @@
+import time
+
+from sessions import SqliteSessionInterface
+
+
+def _rows(iface):
+    return iface._db().execute("SELECT id, expiry FROM sessions").fetchall()
+
+
+def test_sessions_live_in_sqlite(appmod, client, signup):
+    import sessions                                     # app と一緒に読み直したもの
+    iface = appmod.app.session_interface
+    assert isinstance(iface, sessions.SqliteSessionInterface)
+    uid = signup("session")
+    rows = _rows(iface)
+    assert len(rows) == 1
+
+    # 読むだけのリクエストは書き込まない
+    client.get("/_whoami")
+    assert _rows(iface) == rows
+    assert client.get("/_whoami").get_json()["user_id"] == uid
+
+    client.get("/logout")
+    assert _rows(iface) == []
+
+
+def test_sweep_removes_expired_sessions_in_batches(tmp_path):
+    iface = SqliteSessionInterface(str(tmp_path / "sessions.db"), sweep_interval=0, sweep_batch=3)
+    now = int(time.time())
+    db = iface._db()
+    for i in range(10):
+        db.execute("INSERT INTO sessions VALUES (?, ?, ?)", (f"session:{i}", b"", now - 1 if i < 7 else now + 60))
+    assert iface.sweep(now) == 7
+    assert sorted(r[0] for r in _rows(iface)) == ["session:7", "session:8", "session:9"]
+    assert iface.swept == 7
@@ -0,0 +1,26 @@
+TEXT = "[chapter:序]\n壱[newpage]弐\n[chapter:破]\n参[newpage]地の文の [chapter:ではない]"
+
+
+def test_chapter_toc_matches_rendered_headings(appmod):
+    import parser
+    toc = parser.chapter_toc(TEXT)
+    assert toc == {"total": 3, "chapters": [{"page": 1, "title": "序"}, {"page": 2, "title": "破"}]}
+    headings = [(p["index"], p["html"].count('class="chapter"')) for p in parser.parse_document(TEXT)]
+    assert headings == [(1, 1), (2, 1), (3, 0)]
+
+
+def test_toc_of_the_draft(client, signup):
+    signup("reader")
+    assert client.get("/api/toc").status_code == 400
+    client.post("/preview", data={"text": TEXT})
+    body = client.get("/api/toc").get_json()
+    assert (body["total"], [c["title"] for c in body["chapters"]]) == (3, ["序", "破"])
+
+
+def test_toc_of_a_save_is_public_only(client, signup):
+    signup("author")
+    client.post("/save_local", data={"filename": "work.txt", "text": TEXT})
+    assert client.get("/api/toc?fname=work.txt").status_code == 404
+    client.post("/saves/visibility", data={"fname": "work.txt", "visibility": "public"})
+    body = client.get("/api/toc?fname=work.txt").get_json()
+    assert [c["page"] for c in body["chapters"]] == [1, 2]
@@ -0,0 +1,54 @@
+import json
+
+from images import ImageStore
+from parser import UploadIndex
+
+
+def _write(path, db):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(db, f)
+
+
+def _index(tmp_path, db):
+    _write(tmp_path / "uploads.json", db)
+    (tmp_path / "a.png").write_bytes(b"png")
+    return UploadIndex(str(tmp_path / "uploads.json"), str(tmp_path))
+
+
+def test_reloads_only_when_the_file_changes(tmp_path):
+    index = _index(tmp_path, {"123456": {"stored_name": "a.png"}})
+    version = index.version()
+    for _ in range(5):
+        index.resolve_many(["123456"])
+    assert (index.version(), index.reloads) == (version, 1)
+
+    _write(tmp_path / "uploads.json", {"123456": {"stored_name": "a.png"}, "654321": {"stored_name": "b.png"}})
+    assert index.version() != version
+    assert index.reloads == 2
+
+
+def test_resolve_many(tmp_path):
+    index = _index(tmp_path, {"123456": {"stored_name": "a.png"}, "654321": {"stored_name": "gone.png"}})
+    assert index.resolve_many(["123456", " 654321 ", "999999", "a b.png"]) == {
+        "123456": ("/uploads/a.png", "123456"),
+        " 654321 ": ("/image/654321", "654321"),         # ファイルが無いレコード
+        "999999": ("/image/999999", "999999"),
+        "a b.png": ("/uploads/a%20b.png", "a b.png"),
+    }
+
+
+def test_missing_file_is_an_empty_index(tmp_path):
+    index = UploadIndex(str(tmp_path / "none.json"), str(tmp_path))
+    assert dict(index.snapshot()) == {}
+    assert index.resolve_many(["123456"]) == {"123456": ("/image/123456", "123456")}
+
+
+def test_store_records_are_looked_up_per_version(tmp_path):
+    index = _index(tmp_path, {})
+    store = ImageStore(str(tmp_path / "images.db"))
+    index.use_store(store)
+    version = index.version()
+    assert index.resolve_many(["123456"])["123456"] == ("/image/123456", "123456")
+    store.put("123456", {"stored_name": "a.png"})
+    assert index.version() != version
+    assert index.resolve_many(["123456"])["123456"] == ("/uploads/a.png", "123456")
@@ -0,0 +1,51 @@
+import multiprocessing
+
+import pytest
+
+
+def _signup_many(args):
+    # 別プロセス側。DATA_DIR は親の環境から引き継ぐ
+    prefix, n = args
+    import time
+    import users
+    time.time = lambda: 1767225600.0       # 全部が同じミリ秒に届いたことにする
+    return [users.create_user(f"{prefix}{i}", "pw") for i in range(n)]
+
+
+def test_concurrent_signups_all_succeed(data_dir, monkeypatch, load_app):
+    monkeypatch.setenv("DATA_DIR", str(data_dir))
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        uids = [u for chunk in pool.map(_signup_many, [(f"p{w}_", 10) for w in range(4)]) for u in chunk]
+    assert len(set(uids)) == 40
+
+    load_app()
+    import users
+    names = users.user_names()
+    assert all(names.get(uid) for uid in uids)
+
+
+def test_directory_is_rebuilt_only_when_users_change(appmod):
+    import users
+    uid = users.create_user("dir_a", "pw")
+    index = users._directory()
+    assert users._directory() is index                  # 変更が無ければ作り直さない
+    assert users.find_by_username("dir_a")[0] == uid
+    assert users.find_by_username("nobody") == (None, None)
+
+    other = users.create_user("dir_b", "pw")
+    assert users._directory() is not index
+    assert users.user_names()[other] == "dir_b"
+
+
+def test_duplicate_username_is_rejected(appmod):
+    import users
+    users.create_user("same", "pw")
+    with pytest.raises(ValueError, match="username exists"):
+        users.create_user("same", "pw")
+
+
+def test_public_lists_show_owner_names(appmod, client, signup):
+    signup("named_author")
+    client.post("/save_local", data={"filename": "mine.txt", "text": "本文"})
+    client.post("/saves/visibility", data={"fname": "mine.txt", "visibility": "public"})
+    assert "named_author" in appmod.app.test_client().get("/explore?type=saves").get_data(as_text=True)
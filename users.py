@@ -1,28 +1,19 @@
 from pathlib import Path
-import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
 import time
 import secrets
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
 
-BASE_DIR = Path(__file__).resolve().parent
-USERS_DB = BASE_DIR / "users.json"
-
-def load_users():
-    empty = {"users": {}}
-    if not USERS_DB.exists():
-        return empty
+from journal import JournalStore
 
-    try:
-        raw = USERS_DB.read_text(encoding="utf-8").strip()
-        if not raw:
-            return empty
-        data = json.loads(raw)
-    except Exception:
-        return empty
+BASE_DIR = Path(__file__).resolve().parent
+USERS_DB = Path(os.getenv("DATA_DIR") or BASE_DIR) / "users.json"
 
-    if not isinstance(data, dict):
-        return empty
 
+def _normalize(data):
     # 旧形式（uid直下）を救済したいならこれも入れる
     if "users" not in data and all(isinstance(v, dict) for v in data.values()):
         data = {"users": data}
@@ -33,17 +24,135 @@ def load_users():
     return data
 
 
+# users.json はスナップショットで、変更は users.json.journal に 1 行ずつ追記する（複数ワーカーでも消えない）
+USERS = JournalStore(str(USERS_DB), default=lambda: {"users": {}}, normalize=_normalize)
+
+
+def load_users():
+    # 読み取り専用。書き換えは USERS.commit() で
+    return USERS.data()
+
+
 def save_users(db):
-    USERS_DB.write_text(json.dumps(db, ensure_ascii=False, indent=2), encoding="utf-8")
+    USERS.commit([{"op": "set", "path": [], "value": db}])
+
+
+# ---------- ユーザー索引 ----------
+# username → uid と uid → username をメモリに持つ。USERS.data() はファイル（スナップショットと
+# ジャーナル）の stat が変わったときだけ別の dict を返すので、その dict ごとに 1 回だけ作り直す。
+# 他のワーカーの登録も次の呼び出しで反映される
+_index = (None, {}, {})
+
+
+def _directory(db=None):
+    global _index
+    db = db if db is not None else load_users()
+    cached = _index
+    if cached[0] is db:
+        return cached
+    by_name, names = {}, {}
+    for uid, u in db.get("users", {}).items():
+        name = u.get("username")
+        by_name.setdefault(name, uid)     # 同名があれば先の方（以前の線形探索と同じ）
+        names[uid] = name
+    _index = (db, by_name, names)
+    return _index
 
 
 def find_by_username(username: str):
-    db = load_users()
-    users = db.get("users", {})
-    for uid, u in users.items():
-        if u.get("username") == username:
-            return uid, u
-    return None, None
+    db, by_name, _ = _directory()
+    uid = by_name.get(username)
+    if uid is None:
+        return None, None
+    return uid, db["users"][uid]
+
+
+def user_names():
+    # uid → username（読み取り専用）。一覧ページではこれを 1 回取って引く
+    return _directory()[2]
+
+
+# ---------- パスワードハッシュのワーカー ----------
+# scrypt / pbkdf2 はリクエストのスレッドで回さず、少数のワーカースレッドで計算する（計算中は GIL を離す）。
+# 計算中 + 待ちが workers + max_pending を超えたら、計算せずにすぐ HashBusy を投げる。
+# ログインが殺到しても、ハッシュを待って止まるリクエストのスレッドはこの数まで
+class HashBusy(Exception):
+    pass
+
+
+class HashPool:
+    def __init__(self, workers: int = 2, max_pending: int = 8):
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # fork 後（gunicorn のワーカー）に作り直す
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="pwhash")
+                self._pid = os.getpid()
+            return self._pool
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashBusy()
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+
+HASH_POOL = HashPool(
+    int(os.getenv("HASH_WORKERS", "2") or 2),
+    int(os.getenv("HASH_MAX_PENDING", "8") or 8),
+)
+
+
+# ---------- ログインの失敗回数 ----------
+# キー（IP やユーザー名）ごとに失敗を数え、free 回を超えたら base 秒から倍々で待たせる（cap 秒まで）。
+# 待ち中の試行はハッシュを計算せずに断る。forget 秒失敗が無ければ数え直し。
+# プロセスごとのメモリなので、ワーカーが複数なら上限もその分ゆるくなる
+class LoginThrottle:
+    def __init__(self, free: int = 3, base: float = 1.0, cap: float = 300.0, forget: float = 3600.0, max_keys: int = 10000):
+        self.free = free
+        self.base = base
+        self.cap = cap
+        self.forget = forget
+        self.max_keys = max_keys
+        self._fails = OrderedDict()        # key → (回数, 最後の失敗時刻, この時刻まで断る)
+        self._lock = threading.Lock()
+
+    def retry_after(self, *keys) -> float:
+        # 0 なら試してよい。正なら断る（あと何秒か）
+        now = time.time()
+        with self._lock:
+            waits = [self._fails[k][2] - now for k in keys if k in self._fails]
+        return max([0.0] + waits)
+
+    def failed(self, *keys) -> None:
+        now = time.time()
+        with self._lock:
+            for k in keys:
+                count, last, _ = self._fails.pop(k, (0, now, 0.0))
+                if now - last > self.forget:
+                    count = 0
+                count += 1
+                wait = 0.0 if count <= self.free else min(self.cap, self.base * 2 ** (count - self.free - 1))
+                self._fails[k] = (count, now, now + wait)
+            while len(self._fails) > self.max_keys:
+                self._fails.popitem(last=False)
+
+    def succeeded(self, *keys) -> None:
+        with self._lock:
+            for k in keys:
+                self._fails.pop(k, None)
 
 
 def create_user(username: str, password: str):
@@ -53,24 +162,31 @@ def create_user(username: str, password: str):
     if not password:
         raise ValueError("password empty")
 
-    db = load_users()
-    if any(u.get("username") == username for u in db["users"].values()):
+    if find_by_username(username)[0]:
         raise ValueError("username exists")
 
-    uid = f"u_{int(time.time() * 1000)}"
-    db["users"][uid] = {
+    uid = f"u_{secrets.token_hex(8)}"   # 同じミリ秒の登録でも重ならない
+    rec = {
         "username": username,
-        "password_hash": generate_password_hash(password),
+        "password_hash": HASH_POOL.run(generate_password_hash, password),
         "created_at": int(time.time())
     }
-    save_users(db)
+
+    # ハッシュ計算の間に同じ名前が登録されていないか、ロックの中で確かめ直す
+    def check(db):
+        if uid in db["users"]:
+            raise ValueError("user id exists")
+        if username in _directory(db)[1]:
+            raise ValueError("username exists")
+
+    USERS.commit([{"op": "set", "path": ["users", uid], "value": rec}], check=check)
     return uid
 
 def verify_login(username: str, password: str):
     uid, u = find_by_username((username or "").strip())
     if not u:
         return None
-    if check_password_hash(u.get("password_hash", ""), password or ""):
+    if HASH_POOL.run(check_password_hash, u.get("password_hash", ""), password or ""):
         return uid
     return None
 